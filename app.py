@@ -4,6 +4,7 @@ from src.utils import setup_logging
 from src.vlm_captioner import VLMCaptioner
 from src.rag_indexer import RAGIndexer
 from src.rag_query import RAGQuery
+from src import embedding_registry
 import os
 import time
 
@@ -15,9 +16,17 @@ image_dir = config.IMAGE_DIR
 chroma_db_dir = config.CHROMA_DB_DIR
 collection_name = config.COLLECTION_NAME
 embedding_model = config.EMBEDDING_MODEL
+embedding_mode = config.EMBEDDING_MODE
 vlm_model = config.VLM_MODEL
 api_key = config.OPENAI_API_KEY
 
+@st.cache_resource
+def warmup_embedder(model_name: str, mode: str):
+    """每個行程只載入一次 embedding model，之後的 rerun、索引與查詢共用"""
+    return embedding_registry.warmup(model_name, embedding_registry.backend_for_mode(mode))
+
+warmup_embedder(embedding_model, embedding_mode)
+
 st.title("VLM→RAG 圖片檢索系統")
 
 tab1, tab2 = st.tabs(["索引管理", "查詢介面"])
@@ -35,15 +44,25 @@ with tab1:
     if st.button("開始索引"):
         st.info("開始生成描述與建立索引...")
         print("[INFO] Starting indexing process-------",vlm_model)
-        captioner = VLMCaptioner(api_key=api_key, model=vlm_model)
-        indexer = RAGIndexer(chroma_db_dir, collection_name, embedding_model)
+        captioner = VLMCaptioner(api_key=api_key, model=vlm_model, base_url=config.OPENAI_BASE_URL,
+                                 max_side=config.IMAGE_MAX_SIDE, jpeg_quality=config.IMAGE_JPEG_QUALITY,
+                                 preprocess_workers=config.PREPROCESS_WORKERS)
+        indexer = RAGIndexer(chroma_db_dir, collection_name, embedding_model, embedding_mode)
         image_files = [os.path.join(image_dir, f) for f in os.listdir(image_dir)
                        if f.lower().endswith((".jpg", ".jpeg", ".png"))]
-        captions = captioner.batch_generate(image_files)
+        captions = captioner.batch_generate(
+            image_files,
+            mode=config.CAPTION_MODE,
+            concurrency=config.CAPTION_CONCURRENCY,
+            requests_per_minute=config.VLM_RPM,
+            tokens_per_minute=config.VLM_TPM,
+            job_dir=config.BATCH_JOB_DIR,
+            poll_interval=config.BATCH_POLL_INTERVAL,
+        )
         indexer.batch_index(captions)
         st.success("索引完成！")
 
-    indexer = RAGIndexer(chroma_db_dir, collection_name, embedding_model)
+    indexer = RAGIndexer(chroma_db_dir, collection_name, embedding_model, embedding_mode)
     stats = indexer.get_collection_stats()
     st.write(f"總圖片數: {stats['total_indexed']}")
     st.write(f"最後索引時間: {time.strftime('%Y-%m-%d %H:%M:%S')}")
@@ -53,7 +72,8 @@ with tab2:
     query_text = st.text_input("請輸入查詢文字")
     top_k = st.number_input("返回圖片數量 Top-K", min_value=1, max_value=10, value=5)
     if st.button("搜尋") and query_text:
-        rag = RAGQuery(chroma_db_dir, collection_name, embedding_model)
+        rag = RAGQuery(chroma_db_dir, collection_name, embedding_model, embedding_mode,
+                       search_mode=config.SEARCH_MODE, search_threads=config.SEARCH_THREADS)
         result = rag.query(query_text, top_k=top_k)
         st.write(f"查詢時間: {result['query_time']} 秒")
         for item in result["results"]:
@@ -0,0 +1,119 @@
+"""
+CLI 入口的冷啟動時間檢查
+
+每個入口各以全新的 Python 行程載入（不執行 main），量測匯入時間並記錄啟動時已載入的重量級依賴。
+任一入口的中位數超過 STARTUP_BUDGET_MS，或在啟動時就匯入了重量級依賴，即以 exit code 1 結束。
+
+    python scripts/check_startup_time.py [--repeat 5] [--budget_ms 500]
+
+app.py 為 Streamlit script，匯入即執行整個頁面（含載入 model），不在此檢查。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+ENTRY_POINTS = [
+    "scripts/test_query.py",
+    "scripts/index_images.py",
+    "scripts/merge_shards.py",
+    "scripts/compact_index.py",
+    "scripts/embedding_server.py",
+]
+# 只應在實際用到的路徑上匯入的依賴
+HEAVY_MODULES = ("openai", "tqdm", "PIL", "llama_index", "sentence_transformers", "torch", "chromadb")
+
+# 子行程：以非 __main__ 名稱載入入口檔（不執行 main），回報耗時、已載入的重量級依賴與最慢的模組
+_PROBE = """
+import importlib.util, json, sys, time
+t0 = time.perf_counter()
+spec = importlib.util.spec_from_file_location("_startup_probe", sys.argv[1])
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+elapsed = time.perf_counter() - t0
+heavy = sorted({m.split(".")[0] for m in sys.modules} & set(sys.argv[2:]))
+print(json.dumps({"seconds": elapsed, "heavy": heavy}))
+"""
+
+
+def _slowest_imports(stderr: str, n: int = 5):
+    """解析 -X importtime 輸出，回傳 self 時間最長的 n 個模組 [(模組, 毫秒)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us) / 1000.0))
+    return sorted(rows, key=lambda r: -r[1])[:n]
+
+
+def measure(entry: str, repeat: int) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    cmd = [sys.executable, "-X", "importtime", "-c", _PROBE, str(ROOT / entry), *HEAVY_MODULES]
+    times, heavy, slowest = [], set(), []
+    for _ in range(repeat):
+        proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"entry": entry, "error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "unknown"}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        times.append(result["seconds"])
+        heavy.update(result["heavy"])
+        slowest = _slowest_imports(proc.stderr)
+    return {
+        "entry": entry,
+        "median_ms": round(statistics.median(times) * 1000, 1),
+        "max_ms": round(max(times) * 1000, 1),
+        "heavy_modules": sorted(heavy),
+        "slowest_imports": [{"module": m, "self_ms": round(ms, 1)} for m, ms in slowest],
+    }
+
+
+def main():
+    sys.path.insert(0, str(ROOT))
+    from src.config import get_config
+
+    parser = argparse.ArgumentParser(description="檢查 CLI 入口的冷啟動（匯入）時間")
+    parser.add_argument("entries", nargs="*", default=ENTRY_POINTS, help="要檢查的入口檔（相對於專案根目錄）")
+    parser.add_argument("--repeat", type=int, default=5, help="每個入口量測次數（取中位數）")
+    parser.add_argument("--budget_ms", type=float, default=None, help="每個入口的時間上限（預設 STARTUP_BUDGET_MS）")
+    parser.add_argument("--output", type=str, default="logs/startup_times.json", help="結果輸出路徑")
+    args = parser.parse_args()
+    budget = args.budget_ms if args.budget_ms is not None else get_config().STARTUP_BUDGET_MS
+
+    results, failures = [], []
+    for entry in args.entries:
+        r = measure(entry, max(1, args.repeat))
+        results.append(r)
+        if "error" in r:
+            failures.append(f"{entry}: 無法載入（{r['error']}）")
+            print(f"❌ {entry}: {r['error']}")
+            continue
+        over = r["median_ms"] > budget
+        slowest = ", ".join(f"{s['module']} {s['self_ms']}ms" for s in r["slowest_imports"][:3])
+        print(f"{'❌' if over or r['heavy_modules'] else '✅'} {entry}: {r['median_ms']} ms（上限 {budget:g} ms）"
+              f" | 最慢: {slowest}")
+        if over:
+            failures.append(f"{entry}: {r['median_ms']} ms > {budget:g} ms")
+        if r["heavy_modules"]:
+            failures.append(f"{entry}: 啟動時即匯入 {', '.join(r['heavy_modules'])}")
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": datetime.now().isoformat(), "python": sys.version.split()[0],
+                   "budget_ms": budget, "results": results}, f, indent=2, ensure_ascii=False)
+    print(f"\n結果已儲存至: {output}")
+
+    if failures:
+        print("\n超出啟動預算:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
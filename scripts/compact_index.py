@@ -0,0 +1,24 @@
+"""
+合併 manual 向量庫的 segment
+"""
+import argparse
+from src.config import get_config
+from src.rag_indexer import SimpleVectorDB, get_vector_db_path
+from src.utils import setup_logging
+
+def main():
+    parser = argparse.ArgumentParser(description="合併向量庫 segment")
+    parser.add_argument("--full", action="store_true", help="全部合併為單一 segment")
+    parser.add_argument("--small_rows", type=int, default=None, help="筆數低於此值的 segment 視為小 segment")
+    args = parser.parse_args()
+
+    setup_logging()
+    config = get_config()
+    path = get_vector_db_path(config.CHROMA_DB_DIR, config.COLLECTION_NAME)
+    db = SimpleVectorDB.load(path)
+    before = db.segment_count()
+    db.compact(small_segment_rows=args.small_rows, full=args.full)
+    print(f"[INFO] {path}: {before} -> {db.segment_count()} segments, {db.live_count()} 筆")
+
+if __name__ == "__main__":
+    main()
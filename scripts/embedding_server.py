@@ -0,0 +1,40 @@
+"""
+啟動共用的 embedding server：載入一份 EMBEDDING_MODEL，供 EMBEDDING_MODE=server 的行程共用
+
+    python scripts/embedding_server.py --port 8010
+    EMBEDDING_MODE=server streamlit run app.py
+"""
+import argparse
+import logging
+from urllib.parse import urlsplit
+from src.config import get_config
+from src.embedding_service import create_server
+from src.utils import setup_logging
+
+def main():
+    config = get_config()
+    default = urlsplit(config.EMBEDDING_SERVER_URL)
+    parser = argparse.ArgumentParser(description="共用 embedding 推論服務")
+    parser.add_argument("--model", type=str, default=config.EMBEDDING_MODEL, help="embedding model 名稱")
+    parser.add_argument("--host", type=str, default=default.hostname or "127.0.0.1", help="監聽位址（預設只接受本機連線）")
+    parser.add_argument("--port", type=int, default=default.port or 8010, help="監聽 port")
+    parser.add_argument("--max_batch", type=int, default=config.EMBEDDING_SERVER_MAX_BATCH,
+                        help="合併並發請求時每批最多的文字數")
+    parser.add_argument("--max_wait_ms", type=float, default=config.EMBEDDING_SERVER_MAX_WAIT_MS,
+                        help="第一個請求到達後等待湊批的最長時間（毫秒）")
+    args = parser.parse_args()
+
+    setup_logging()
+    server = create_server(args.model, args.host, args.port, args.max_batch, args.max_wait_ms / 1000.0)
+    logging.info(f"Embedding server 已啟動: http://{args.host}:{args.port} ({args.model})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+        logging.info(f"Embedding server 已停止: {server.batcher.stats()}")
+
+if __name__ == "__main__":
+    main()
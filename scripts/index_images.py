@@ -1,23 +1,89 @@
 import argparse
+import math
 import os
 import shutil
+import subprocess
+import sys
 import time
+import numpy as np
 from src.config import get_config
 from src.utils import get_image_list, setup_logging
 from src.vlm_captioner import VLMCaptioner
-from src.rag_indexer import RAGIndexer
+from src.rag_indexer import RAGIndexer, SimpleVectorDB
+from src.file_manifest import FileManifest
+from src.ingest_journal import IngestJournal
+from src.near_duplicates import group_near_duplicates
+from src.ingest_pipeline import IngestPipeline
+from src.sharding import ShardConflictError, find_shards, merge_shards, parse_shard, select_shard, shard_collection
+
+def run_workers(args, config, logger):
+    """在本機啟動 workers 個子行程各處理一個 shard，全部成功後合併回主 collection"""
+    n = args.workers
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    # VLM 速率上限由所有 worker 平分
+    if config.VLM_RPM:
+        env["VLM_RPM"] = str(max(1, math.ceil(config.VLM_RPM / n)))
+    if config.VLM_TPM:
+        env["VLM_TPM"] = str(max(1, math.ceil(config.VLM_TPM / n)))
+    base = [sys.executable, os.path.abspath(__file__), "--image_dir", args.image_dir or config.IMAGE_DIR]
+    if args.max:
+        base += ["--max", str(args.max)]
+    base += [flag for flag, on in (("--full", args.full), ("--resume", args.resume)) if on]
+    procs = [subprocess.Popen(base + ["--shard", f"{i}/{n}"], env=env) for i in range(n)]
+    logger.info(f"已啟動 {n} 個 shard worker")
+    if config.CAPTION_MODE == "batch":
+        # 每個 shard 各自建立 Batch API job（job id 互不重複）；單一 shard 中斷時以
+        # --shard i/N --batch_job <該 shard 的 job id> 續跑，再以 merge_shards.py 合併
+        logger.info("CAPTION_MODE=batch：各 shard 分別送出 batch job")
+    failed = [i for i, proc in enumerate(procs) if proc.wait() != 0]
+    if failed:
+        logger.error(f"shard {failed} 失敗，未合併；修正後可加 --resume 重跑")
+        sys.exit(1)
+    try:
+        # 以暫存 collection 重建後換上：合併失敗時原本的 collection 保持不變
+        report = merge_shards(
+            find_shards(config.CHROMA_DB_DIR, config.COLLECTION_NAME, n),
+            config.CHROMA_DB_DIR, config.COLLECTION_NAME,
+            max_segments=config.MAX_SEGMENTS,
+            search_engine=config.SEARCH_ENGINE, ivf_nlist=config.IVF_NLIST,
+            quantization=config.QUANTIZATION, pq_m=config.PQ_M,
+            replace=True,
+        )
+    except ShardConflictError as e:
+        # 同一份清單依路徑分片不會重複；出現衝突表示混入了其他 N 或舊的 shard
+        logger.error(f"shard 合併中止: {e}")
+        sys.exit(1)
+    logger.info(f"[SUCCESS] {n} 個 shard 已合併: {report.merged} 筆，重複 {report.duplicates}")
 
 def main():
     parser = argparse.ArgumentParser(description="批次索引圖片")
     parser.add_argument("--image_dir", type=str, default=None, help="圖片目錄路徑")
     parser.add_argument("--max", type=int, default=None, help="最大處理數量")
     parser.add_argument("--force", action="store_true", help="強制重新索引（刪除現有資料）")
+    parser.add_argument("--full", action="store_true",
+                        help="忽略檔案清單，處理所有圖片（預設只處理新增或變更的圖片）")
+    parser.add_argument("--resume", action="store_true",
+                        help="從上次中斷的 checkpoint journal 續跑（已完成的 caption / embedding 不再重做）")
+    parser.add_argument("--batch_job", type=str, default=None,
+                        help="續跑指定的 Batch API caption job（隱含 CAPTION_MODE=batch）")
+    parser.add_argument("--shard", type=str, default=None,
+                        help="只處理第 i 個 shard（i/N，依路徑雜湊穩定分配），寫入 {collection}.shard-i-of-N")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="在本機以 N 個行程分片索引，完成後合併回主 collection")
     args = parser.parse_args()
+    if args.workers > 1 and (args.shard or args.batch_job):
+        parser.error("--workers 不能與 --shard 或 --batch_job 同時使用")
+    shard = parse_shard(args.shard) if args.shard else None
 
     config = get_config()
     image_dir = args.image_dir or config.IMAGE_DIR
     chroma_db_dir = config.CHROMA_DB_DIR
     collection_name = config.COLLECTION_NAME
+    if shard:
+        # 每個 shard 有自己的向量庫、檔案清單與 journal，之後以 merge_shards.py 合併
+        collection_name = shard_collection(collection_name, *shard)
     embedding_model = config.EMBEDDING_MODEL
     embedding_mode = config.EMBEDDING_MODE
     vlm_model = config.VLM_MODEL
@@ -34,29 +100,124 @@ def main():
         shutil.rmtree(chroma_db_dir)
         logger.info(f"已刪除現有 Chroma DB: {chroma_db_dir}")
 
+    if args.workers > 1:
+        run_workers(args, config, logger)
+        return
+
     image_list = get_image_list(image_dir)
     if args.max:
         image_list = image_list[:args.max]
+    if shard:
+        image_list = select_shard(image_list, shard[0], shard[1], root=image_dir)
+        logger.info(f"shard {shard[0]}/{shard[1]}: {collection_name}")
     logger.info(f"找到 {len(image_list)} 張圖片")
 
     if not image_list:
-        logger.warning("沒有可處理的圖片，結束。")
+        logger.warning("沒有可處理的圖片。")
+
+    # 以檔案清單比對 (path, size, mtime, 內容雜湊)，只處理新增 / 變更的圖片並移除已刪除的
+    manifest = FileManifest.open(chroma_db_dir, collection_name)
+    if not len(manifest):
+        # 既有向量庫第一次使用檔案清單：把已在庫中的圖片登記為已索引，避免重複寫入
+        existing = SimpleVectorDB.open(chroma_db_dir, collection_name)
+        indexed = {os.path.abspath(m["image_path"]) for m in existing.live_metadata()}
+        present = [p for p in image_list if os.path.abspath(p) in indexed]
+        if present:
+            manifest.record(present, {})
+            logger.info(f"已將既有向量庫中的 {len(present)} 張圖片登記到檔案清單")
+    scan = manifest.scan(image_list, root=image_dir)
+    if args.max and scan.deleted:
+        logger.info("使用 --max 時不處理已刪除的圖片")
+        scan.deleted = []
+    if scan.touched:
+        manifest.record(scan.touched, scan.file_info)
+    to_index = image_list if args.full else scan.to_index
+    # 變更的圖片不需先移除：寫入時依 image_path 取代舊列，處理完成前仍可搜尋到舊版本
+    stale_paths = {e.path for e in scan.deleted}
+    journal = IngestJournal.open(chroma_db_dir, collection_name,
+                                 flush_every=config.JOURNAL_FLUSH_EVERY,
+                                 flush_interval=config.JOURNAL_FLUSH_INTERVAL)
+    if len(journal) and not args.resume:
+        logger.warning(f"捨棄上次未完成的 journal（{len(journal)} 個 checkpoint）；需要續跑請加 --resume")
+        journal.clear()
+    if not to_index and not stale_paths and not args.batch_job:
+        logger.info(f"[SUCCESS] 沒有需要更新的圖片（{scan.summary()}）")
         return
 
-    logger.info("開始生成描述...")
+    logger.info("開始生成描述並建立索引...")
     print("[INFO] VLM Model:",vlm_model)
-    captioner = VLMCaptioner(api_key=api_key, model=vlm_model)
+    captioner = VLMCaptioner(api_key=api_key, model=vlm_model, base_url=config.OPENAI_BASE_URL,
+                             max_side=config.IMAGE_MAX_SIDE, jpeg_quality=config.IMAGE_JPEG_QUALITY,
+                             preprocess_workers=config.PREPROCESS_WORKERS)
     start_time = time.time()
-    captions = captioner.batch_generate(image_list)
 
-    logger.info("開始建立索引...")
     print("[DEBUG] Configuration:", embedding_model)
-    # 顯示 embedding model 維度資訊
-    # llama-index 0.10.x 需直接傳入 model_name，不支援 prompts 參數
     # llama-index 0.10.x 不支援 prompts 參數，直接進入 RAGIndexer
-    indexer = RAGIndexer(chroma_db_dir, collection_name, embedding_model, embedding_mode)
-    success = indexer.batch_index(captions)
-    total = len(captions)
+    indexer = RAGIndexer(chroma_db_dir, collection_name, embedding_model, embedding_mode,
+                         max_segments=config.MAX_SEGMENTS,
+                         search_engine=config.SEARCH_ENGINE, ivf_nlist=config.IVF_NLIST,
+                         quantization=config.QUANTIZATION, pq_m=config.PQ_M,
+                         embed_batch_size=config.EMBED_BATCH_SIZE,
+                         tombstone_ratio=config.TOMBSTONE_RATIO,
+                         lexical_index=config.LEXICAL_INDEX)
+    if stale_paths:
+        removed = indexer.remove_images(stale_paths)
+        manifest.remove(e.path for e in scan.deleted)
+        logger.info(f"已從索引移除 {removed} 筆已刪除的圖片")
+    precaptioned = []
+    if args.resume and len(journal):
+        # 已 embed 但未 commit 的項目直接寫入；只有 caption 的項目略過 VLM
+        journal_captions, journal_embedded = journal.replay()
+        pending = {os.path.abspath(p): p for p in to_index}
+        replay = [(vec, meta) for vec, meta in journal_embedded if os.path.abspath(meta["image_path"]) in pending]
+        if replay:
+            indexer.add_embedded(np.stack([vec for vec, _ in replay]), [meta for _, meta in replay])
+            indexer.persist()
+            manifest.record([meta["image_path"] for _, meta in replay], scan.file_info)
+            for _, meta in replay:
+                pending.pop(os.path.abspath(meta["image_path"]), None)
+        precaptioned = [c for c in journal_captions.values() if os.path.abspath(c["image_path"]) in pending]
+        for c in precaptioned:
+            pending.pop(os.path.abspath(c["image_path"]), None)
+        to_index = list(pending.values())
+        logger.info(f"[RESUME] 由 journal 寫入 {len(replay)} 筆、沿用 {len(precaptioned)} 筆 caption，"
+                    f"尚需處理 {len(to_index)} 張")
+    duplicates = {}
+    if config.DEDUP_METHOD != "none" and to_index:
+        # 近似重複的圖片只 caption 代表圖，其餘沿用代表圖的 caption 與向量
+        groups = group_near_duplicates(to_index, config.DEDUP_METHOD, config.DEDUP_MAX_DISTANCE,
+                                       workers=config.PREPROCESS_WORKERS)
+        to_index, duplicates = groups.representatives, groups.members
+    # caption、embed、寫入三個 stage 同時進行，定期 commit 到向量庫
+    pipeline = IngestPipeline(
+        captioner, indexer,
+        caption_kwargs=dict(
+            mode="batch" if args.batch_job else config.CAPTION_MODE,
+            concurrency=config.CAPTION_CONCURRENCY,
+            requests_per_minute=config.VLM_RPM,
+            tokens_per_minute=config.VLM_TPM,
+            job_id=args.batch_job,
+            job_dir=config.BATCH_JOB_DIR,
+            poll_interval=config.BATCH_POLL_INTERVAL,
+        ),
+        queue_size=config.PIPELINE_QUEUE_SIZE,
+        commit_every=config.COMMIT_EVERY,
+        commit_interval=config.COMMIT_INTERVAL,
+        # 向量庫 commit 後才登記檔案清單，中斷時未 commit 的圖片下次會重新處理
+        on_commit=lambda metas: manifest.record([m["image_path"] for m in metas], scan.file_info),
+        journal=journal,
+        duplicates=duplicates,
+    )
+    try:
+        report = pipeline.run(to_index, precaptioned=precaptioned)
+    except KeyboardInterrupt:
+        # pipeline.run 結束前已把 journal 緩衝寫入磁碟
+        logger.warning("索引已中斷；已完成的 caption / embedding 保存在 journal，加 --resume 續跑")
+        sys.exit(130)
+    # 全部 commit 完成，journal 不再需要
+    journal.clear()
+    total = report["total"]
+    success = report["indexed"]
     fail = total - success
     elapsed = round((time.time() - start_time) / 60, 2)
 
@@ -64,7 +225,11 @@ def main():
     logger.info(f"  - 總圖片數: {total}")
     logger.info(f"  - 成功: {success}")
     logger.info(f"  - 失敗: {fail}")
+    if report["linked_duplicates"]:
+        logger.info(f"  - 近似重複（沿用代表圖）: {report['linked_duplicates']}")
     logger.info(f"  - 總耗時: {elapsed} 分鐘")
+    for name, stage in report["stages"].items():
+        logger.info(f"  - {name}: {stage['items']} 筆, {stage['items_per_second']}/s, 工作 {stage['busy_seconds']}s")
     logger.info("  - API 成本估算: $0.22")  # 可根據實際計算調整
 
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+"""
+合併 index_images.py --shard i/N 產生的分片向量庫
+"""
+import argparse
+import sys
+from src.config import get_config
+from src.sharding import ShardConflictError, find_shards, merge_shards
+from src.utils import setup_logging
+
+def main():
+    parser = argparse.ArgumentParser(description="合併分片向量庫到主 collection")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="shard 總數 N，合併 CHROMA_DB_DIR 中的 {collection}.shard-i-of-N")
+    parser.add_argument("--sources", nargs="+", default=None,
+                        help="直接指定 shard 向量庫目錄（例如由其他機器複製過來的 *_vectors）")
+    parser.add_argument("--on_conflict", choices=["error", "keep_newer"], default="error",
+                        help="同一圖片出現在多個 shard 時：error 中止且不寫入，keep_newer 保留 indexed_at 較新的")
+    parser.add_argument("--replace", action="store_true",
+                        help="以 shard 內容重建主 collection（預設追加到既有資料）")
+    args = parser.parse_args()
+    if not args.shards and not args.sources:
+        parser.error("需指定 --shards 或 --sources")
+
+    setup_logging()
+    config = get_config()
+    sources = args.sources or find_shards(config.CHROMA_DB_DIR, config.COLLECTION_NAME, args.shards)
+    if not sources:
+        print("[ERROR] 找不到任何 shard")
+        sys.exit(1)
+    try:
+        report = merge_shards(
+            sources, config.CHROMA_DB_DIR, config.COLLECTION_NAME,
+            on_conflict=args.on_conflict,
+            max_segments=config.MAX_SEGMENTS,
+            search_engine=config.SEARCH_ENGINE, ivf_nlist=config.IVF_NLIST,
+            quantization=config.QUANTIZATION, pq_m=config.PQ_M,
+            replace=args.replace,
+        )
+    except ShardConflictError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    print(f"[INFO] 合併 {len(sources)} 個 shard: {report.merged} 筆，重複 {report.duplicates}，衝突 {len(report.conflicts)}")
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,6 @@
 執行完整評估測試
 """
 import sys
-import time
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
@@ -33,13 +32,13 @@ def run_evaluation():
     print(f"每個查詢返回: Top-5")
     print(f"\n{'查詢':<20} {'耗時(秒)':<12} {'結果數':<10} {'最高分':<10} {'最低分'}")
     print(f"{'-'*80}")
-    total_time = 0
     results_data = []
-    for query_text in test_queries:
-        start_time = time.time()
-        result = query_engine.query(query_text, top_k=5)
-        query_time = time.time() - start_time
-        total_time += query_time
+    # 批次查詢：一次 embed 全部查詢並以矩陣-矩陣乘積計分
+    batch = query_engine.query_many(test_queries, top_k=5)
+    total_time = batch["total_time"]
+    for result in batch["queries"]:
+        query_text = result["query"]
+        query_time = result["query_time"]
         results_data.append({
             "query": query_text,
             "time": query_time,
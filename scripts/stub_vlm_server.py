@@ -0,0 +1,257 @@
+"""
+本機 stub：模擬 OpenAI chat completions 與 Batch API（files / batches），供 caption 流程離線測試
+
+    python scripts/stub_vlm_server.py --port 8008 --delay 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8008/v1 OPENAI_API_KEY=stub python scripts/index_images.py --max 20
+    OPENAI_BASE_URL=http://127.0.0.1:8008/v1 OPENAI_API_KEY=stub CAPTION_MODE=batch python scripts/index_images.py
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, delay: float, fail_every: int, batch_delay: float = 2.0):
+        self.delay = delay
+        self.fail_every = fail_every
+        self.batch_delay = batch_delay
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.files = {}  # file id -> (metadata, bytes)
+        self.batches = {}  # batch id -> batch object
+
+
+def _caption_for(body: dict) -> str:
+    """依圖片內容產生固定的 caption，方便驗證結果順序"""
+    url = ""
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    url = part["image_url"]["url"]
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
+    return f"stub 描述 {digest}"
+
+
+def _chat_completion(body: dict, n: int) -> dict:
+    return {
+        "id": f"chatcmpl-stub-{n}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": _caption_for(body)},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 850, "completion_tokens": 30, "total_tokens": 880},
+    }
+
+
+def _store_file(state: StubState, filename: str, purpose: str, data: bytes) -> dict:
+    meta = {
+        "id": f"file-{uuid.uuid4().hex[:24]}",
+        "object": "file",
+        "bytes": len(data),
+        "created_at": int(time.time()),
+        "filename": filename,
+        "purpose": purpose,
+        "status": "processed",
+    }
+    with state.lock:
+        state.files[meta["id"]] = (meta, data)
+    return meta
+
+
+def _run_batch(state: StubState, batch_id: str):
+    """背景處理 batch：等待 batch_delay 後逐行產生回應，寫成 output / error 檔"""
+    with state.lock:
+        batch = state.batches[batch_id]
+        batch["status"] = "in_progress"
+        batch["in_progress_at"] = int(time.time())
+        _, data = state.files[batch["input_file_id"]]
+    time.sleep(state.batch_delay)
+    outputs, errors = [], []
+    for line in data.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        with state.lock:
+            state.requests += 1
+            n = state.requests
+        if state.fail_every and n % state.fail_every == 0:
+            errors.append({
+                "id": f"batch_req_{n}",
+                "custom_id": request["custom_id"],
+                "response": None,
+                "error": {"code": "server_error", "message": "stub failure"},
+            })
+            continue
+        outputs.append({
+            "id": f"batch_req_{n}",
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "request_id": f"req_{n}", "body": _chat_completion(request["body"], n)},
+            "error": None,
+        })
+
+    def dump(rows):
+        return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+
+    output_file = _store_file(state, f"{batch_id}_output.jsonl", "batch_output", dump(outputs))
+    error_file = _store_file(state, f"{batch_id}_error.jsonl", "batch_output", dump(errors)) if errors else None
+    with state.lock:
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+        batch["output_file_id"] = output_file["id"]
+        batch["error_file_id"] = error_file["id"] if error_file else None
+        batch["request_counts"] = {
+            "total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors),
+        }
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: dict):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _not_found(self):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        def _read_body(self) -> bytes:
+            length = int(self.headers.get("Content-Length", 0))
+            return self.rfile.read(length)
+
+        def do_POST(self):
+            raw = self._read_body()
+            if self.path.endswith("/chat/completions"):
+                self._chat(json.loads(raw or b"{}"))
+            elif self.path.endswith("/files"):
+                self._upload(raw)
+            elif self.path.endswith("/batches"):
+                self._create_batch(json.loads(raw or b"{}"))
+            else:
+                self._not_found()
+
+        def do_GET(self):
+            parts = self.path.split("?")[0].rstrip("/").split("/")
+            if len(parts) >= 2 and parts[-2] == "batches":
+                batch = state.batches.get(parts[-1])
+                if batch is None:
+                    self._not_found()
+                    return
+                with state.lock:
+                    self._send_json(200, dict(batch))
+            elif len(parts) >= 3 and parts[-1] == "content" and parts[-3] == "files":
+                entry = state.files.get(parts[-2])
+                if entry is None:
+                    self._not_found()
+                    return
+                data = entry[1]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self._not_found()
+
+        def _chat(self, body: dict):
+            with state.lock:
+                state.requests += 1
+                n = state.requests
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                time.sleep(state.delay)
+                if state.fail_every and n % state.fail_every == 0:
+                    self._send_json(429, {"error": {"message": "stub rate limit", "type": "rate_limit"}})
+                    return
+                self._send_json(200, _chat_completion(body, n))
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def _upload(self, raw: bytes):
+            header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+            message = BytesParser(policy=HTTP).parsebytes(header + raw)
+            fields, filename, data = {}, "upload.jsonl", b""
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if name == "file":
+                    filename = part.get_filename() or filename
+                    data = part.get_payload(decode=True)
+                else:
+                    fields[name] = part.get_payload(decode=True).decode("utf-8")
+            self._send_json(200, _store_file(state, filename, fields.get("purpose", "batch"), data))
+
+        def _create_batch(self, body: dict):
+            if body.get("input_file_id") not in state.files:
+                self._send_json(400, {"error": {"message": "input_file_id not found"}})
+                return
+            batch = {
+                "id": f"batch_{uuid.uuid4().hex[:24]}",
+                "object": "batch",
+                "endpoint": body.get("endpoint", "/v1/chat/completions"),
+                "input_file_id": body["input_file_id"],
+                "completion_window": body.get("completion_window", "24h"),
+                "status": "validating",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                "metadata": body.get("metadata"),
+            }
+            with state.lock:
+                state.batches[batch["id"]] = batch
+            threading.Thread(target=_run_batch, args=(state, batch["id"]), daemon=True).start()
+            self._send_json(200, batch)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = 8008, delay: float = 0.5, fail_every: int = 0, batch_delay: float = 2.0) -> ThreadingHTTPServer:
+    """在背景執行緒啟動 stub，回傳 server（server.state 可查詢請求統計）"""
+    state = StubState(delay, fail_every, batch_delay)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI chat completions / Batch API stub")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--delay", type=float, default=0.5, help="每個請求的模擬延遲（秒）")
+    parser.add_argument("--fail_every", type=int, default=0, help="每 N 個請求回傳一次失敗（0 = 不失敗）")
+    parser.add_argument("--batch_delay", type=float, default=2.0, help="batch 從建立到完成的模擬時間（秒）")
+    args = parser.parse_args()
+    server = serve(args.port, args.delay, args.fail_every, args.batch_delay)
+    print(f"[INFO] Stub VLM server: http://127.0.0.1:{args.port}/v1")
+    try:
+        while True:
+            time.sleep(5)
+            state = server.state
+            print(f"[INFO] requests={state.requests} max_in_flight={state.max_in_flight} batches={len(state.batches)}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
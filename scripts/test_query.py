@@ -8,6 +8,13 @@ def main():
     parser = argparse.ArgumentParser(description="查詢測試腳本")
     parser.add_argument("query", type=str, nargs="?", help="查詢文字")
     parser.add_argument("--top_k", type=int, default=None, help="返回 top_k 結果")
+    parser.add_argument("--mode", choices=["vector", "lexical", "hybrid"], default=None,
+                        help="查詢模式（預設為 SEARCH_MODE）：lexical 只用 caption 關鍵字，hybrid 以 RRF 合併")
+    parser.add_argument("--path_prefix", type=str, default=None, help="只查詢 image_path 以此開頭的圖片")
+    parser.add_argument("--after", type=str, default=None, help="只查詢 indexed_at >= 此時間（ISO 格式，UTC）")
+    parser.add_argument("--before", type=str, default=None, help="只查詢 indexed_at < 此時間（ISO 格式，UTC）")
+    parser.add_argument("--where", action="append", default=[], metavar="KEY=VALUE",
+                        help="metadata 等值條件，可重複指定")
     args = parser.parse_args()
 
     config = get_config()
@@ -32,6 +39,12 @@ def main():
         collection_name=collection_name,
         embedding_model=embedding_model,
         embedding_mode=embedding_mode,
+        search_engine=config.SEARCH_ENGINE,
+        nprobe=config.IVF_NPROBE,
+        quantization=config.QUANTIZATION,
+        rescore_k=config.RESCORE_K,
+        search_mode=args.mode or config.SEARCH_MODE,
+        search_threads=config.SEARCH_THREADS,
         **rag_kwargs
     )
 
@@ -39,7 +52,9 @@ def main():
         print("請輸入查詢文字")
         return
 
-    result = rag.query(args.query, top_k=top_k)
+    where = dict(item.split("=", 1) for item in args.where)
+    result = rag.query(args.query, top_k=top_k, path_prefix=args.path_prefix,
+                       indexed_after=args.after, indexed_before=args.before, where=where)
     print(f"[查詢] {result['query']}\n")
     print(f"[結果] 找到 {len(result['results'])} 張相關圖片 (查詢時間: {result['query_time']}秒)\n")
     for i, r in enumerate(result["results"], 1):
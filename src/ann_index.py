@@ -0,0 +1,135 @@
+"""
+純 NumPy 的 IVF（inverted file）近似最近鄰索引
+
+以 spherical k-means 產生 nlist 個粗分群中心，每筆向量歸入最接近的中心；
+查詢時只掃描與 query 最接近的 nprobe 個分群（nprobe 越大 recall 越高、延遲越高）。
+向量本體仍存放於 SimpleVectorDB，本模組只保存中心與每列所屬的分群。
+"""
+import logging
+from typing import Dict, Optional
+
+import numpy as np
+
+DEFAULT_NPROBE = 8
+MIN_TRAIN_ROWS = 1000  # 少於此筆數時 IVF 沒有意義，查詢退回精確搜尋
+RETRAIN_GROWTH = 4.0  # 資料量成長為訓練時的倍數後重新訓練
+SAMPLES_PER_LIST = 256  # 每個分群最多取的訓練樣本數
+
+
+def default_nlist(n: int) -> int:
+    """常用經驗值：約 4 * sqrt(n) 個分群，且每群平均至少 39 筆"""
+    return int(max(1, min(4 * np.sqrt(n), n // 39)))
+
+
+def _assign_chunked(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    out = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        out[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(
+    vectors: np.ndarray, k: int, iters: int = 20, max_samples: int = SAMPLES_PER_LIST, seed: int = 0
+) -> np.ndarray:
+    """在正規化向量上以內積做 k-means，回傳 (k, dim) 已正規化中心；最多取 k * max_samples 筆訓練"""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    sample_size = min(n, k * max_samples)
+    sample_idx = np.sort(rng.choice(n, size=sample_size, replace=False))
+    sample = np.asarray(vectors[sample_idx], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign_chunked(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # 空群以隨機樣本重新初始化
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """保存分群中心與每列（全域列序）的分群編號；倒排清單於查詢時延遲建立"""
+
+    MANIFEST_KEY = "ivf"
+
+    def __init__(self, centroids: np.ndarray, assign: Optional[np.ndarray] = None, trained_rows: int = 0):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self._assign = np.zeros(0, dtype=np.int32) if assign is None else np.asarray(assign, dtype=np.int32)
+        self.trained_rows = trained_rows or len(self._assign)
+        self._order = None  # 依分群排序後的列號
+        self._bounds = None  # 各分群在 _order 中的範圍
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def assign(self) -> np.ndarray:
+        return self._assign
+
+    @property
+    def row_data(self) -> np.ndarray:
+        return self._assign
+
+    def __len__(self) -> int:
+        return len(self._assign)
+
+    @classmethod
+    def train(cls, sample: np.ndarray, nlist: Optional[int] = None, trained_rows: int = 0,
+              seed: int = 0) -> "IVFIndex":
+        """以抽樣訓練分群中心（尚無任何列的分群編號，由呼叫端逐區塊 encode 後 extend）"""
+        n = trained_rows or sample.shape[0]
+        nlist = min(nlist or default_nlist(n), sample.shape[0])
+        logging.info(f"IVF 訓練: {n} 筆（樣本 {sample.shape[0]} 筆）, nlist={nlist}")
+        centroids = spherical_kmeans(sample, nlist, seed=seed)
+        return cls(centroids, trained_rows=n)
+
+    @classmethod
+    def from_model(cls, arrays: Dict[str, np.ndarray], info: Dict) -> "IVFIndex":
+        """由持久化的中心還原（分群編號另外逐 segment 載入）"""
+        return cls(arrays["centroids"], trained_rows=info.get("trained_rows", 0))
+
+    def model_arrays(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    def model_info(self) -> Dict:
+        return {"nlist": self.nlist, "trained_rows": self.trained_rows}
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """計算新列的分群編號（不修改索引）"""
+        return _assign_chunked(vectors, self.centroids)
+
+    def extend(self, new_assign: np.ndarray):
+        """附加接在現有列之後的新列分群編號"""
+        self._assign = np.concatenate([self._assign, np.asarray(new_assign, dtype=np.int32)])
+        self._order = None
+
+    def needs_retrain(self, n: int) -> bool:
+        return n > self.trained_rows * RETRAIN_GROWTH
+
+    def _build_lists(self):
+        self._order = np.argsort(self._assign, kind="stable")
+        counts = np.bincount(self._assign, minlength=self.nlist)
+        self._bounds = np.concatenate([[0], np.cumsum(counts)])
+
+    def candidates(self, query: np.ndarray, nprobe: int = DEFAULT_NPROBE) -> np.ndarray:
+        """回傳最接近的 nprobe 個分群內的所有列號（遞增排序）"""
+        if self._order is None:
+            self._build_lists()
+        nprobe = max(1, min(nprobe, self.nlist))
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.nlist)
+        parts = [self._order[self._bounds[c]:self._bounds[c + 1]] for c in probe]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
@@ -0,0 +1,255 @@
+"""
+以 OpenAI Batch API 離線生成 caption
+
+大量回填時，把每張圖片的 chat completions 請求寫成 Batch API 格式的 JSONL（單檔超過
+請求數或大小上限時切成多個 part），上傳並建立 batch 後輪詢至完成，再以串流方式讀回結果檔，
+組成與 VLMCaptioner.batch_generate 相同的 caption dict。
+
+每個 job 的狀態存於 {job_dir}/{job_id}.json，已取回的結果追加寫入 {job_id}.results.jsonl；
+中斷後以相同 job_id 呼叫 run() 即可從上次的進度續跑（未送出的 part 會補送，已取回的不會重抓）。
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from src.image_preprocess import iter_preprocessed
+from src.vlm_captioner import _caption_result
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Batch API 單一輸入檔上限為 50,000 個請求 / 200 MB，保留一些餘裕
+DEFAULT_MAX_REQUESTS = 50000
+DEFAULT_MAX_BYTES = 190 * 1024 * 1024
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def new_job_id() -> str:
+    """時間戳方便辨識；同一秒內建立的 job（例如 --workers 的各 shard）以隨機尾碼區分"""
+    return "capjob-" + datetime.utcnow().strftime("%Y%m%d-%H%M%S") + f"-{uuid.uuid4().hex[:8]}"
+
+
+class BatchCaptionJob:
+    """一個 batch caption job；captioner 提供 payload、model 與 caption 快取"""
+
+    def __init__(
+        self,
+        captioner,
+        job_dir: str = "data/batch_jobs",
+        job_id: Optional[str] = None,
+        poll_interval: float = 30.0,
+        max_requests: int = DEFAULT_MAX_REQUESTS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.captioner = captioner
+        self.client = captioner.client
+        self.job_dir = job_dir
+        self.job_id = job_id or new_job_id()
+        self.poll_interval = poll_interval
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        os.makedirs(job_dir, exist_ok=True)
+        self.state_path = os.path.join(job_dir, f"{self.job_id}.json")
+        self.results_path = os.path.join(job_dir, f"{self.job_id}.results.jsonl")
+        self.state: Optional[Dict] = None
+        self._on_result = None
+        self._emitted = set()  # 本次 run() 已經由 on_result 送出的輸入順序
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def _save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.state_path)
+
+    def run(self, image_paths: Optional[List[str]] = None, on_result=None) -> List[dict]:
+        """
+        建立（或續跑）job，等待全部 part 完成後回傳 caption dict（維持輸入順序）；
+        on_result(i, caption dict) 對每張圖片呼叫一次：取回的結果逐筆呼叫，其餘（快取命中、
+        先前已取回）於最後組裝時補上
+        """
+        self._on_result, self._emitted = on_result, set()
+        if self.state is None:
+            if not image_paths:
+                raise ValueError(f"找不到 batch job {self.job_id}，且未提供圖片清單")
+            self._prepare(image_paths)
+        else:
+            logging.info(f"續跑 batch job {self.job_id}")
+        self._submit_pending()
+        self._poll()
+        results = self._assemble()
+        if on_result is not None:
+            for i, result in enumerate(results):
+                if i not in self._emitted:
+                    on_result(i, result)
+        return results
+
+    # ---- 建立 ----
+
+    def _prepare(self, image_paths: List[str]):
+        """寫出 JSONL part；快取命中的圖片不送出"""
+        cap = self.captioner
+        self.state = {
+            "job_id": self.job_id,
+            "model": cap.model,
+            "created_at": datetime.utcnow().isoformat(),
+            "image_paths": list(image_paths),
+            "parts": [],
+        }
+        pending = [
+            (i, p) for i, p in enumerate(image_paths) if cap._cache_lookup(p, count=False)[1] is None
+        ]
+        logging.info(f"Batch job {self.job_id}: {len(pending)} / {len(image_paths)} 張需要送出")
+        if cap.max_side > 0:
+            prepared_iter = iter_preprocessed(
+                [p for _, p in pending], cap.max_side, cap.jpeg_quality, workers=cap.preprocess_workers
+            )
+        else:
+            prepared_iter = ((p, None) for _, p in pending)
+
+        part, f = None, None
+        try:
+            for (i, path), (_, prepared) in zip(pending, prepared_iter):
+                try:
+                    if isinstance(prepared, Exception):
+                        raise prepared
+                    body = cap._build_payload(path, cap._prepare(path, prepared))
+                except Exception as e:
+                    # 讀不到的圖片不送出，組裝結果時回報錯誤
+                    logging.error(f"Batch 請求建立失敗: {path} ({e})")
+                    continue
+                line = json.dumps(
+                    {"custom_id": f"img-{i}", "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+                    ensure_ascii=False,
+                ).encode("utf-8") + b"\n"
+                if part is None or part["requests"] >= self.max_requests or part["bytes"] + len(line) > self.max_bytes:
+                    if f is not None:
+                        f.close()
+                    part = {
+                        "input_path": os.path.join(self.job_dir, f"{self.job_id}.part{len(self.state['parts']):03d}.jsonl"),
+                        "requests": 0, "bytes": 0,
+                        "input_file_id": None, "batch_id": None, "status": None,
+                        "output_file_id": None, "error_file_id": None, "collected": False,
+                    }
+                    self.state["parts"].append(part)
+                    f = open(part["input_path"], "wb")
+                f.write(line)
+                part["requests"] += 1
+                part["bytes"] += len(line)
+        finally:
+            if f is not None:
+                f.close()
+            if hasattr(prepared_iter, "close"):
+                prepared_iter.close()
+        self._save_state()
+        logging.info(f"Batch job {self.job_id}: 共 {len(self.state['parts'])} 個 part，可用 job id 續跑")
+
+    def _submit_pending(self):
+        for part in self.state["parts"]:
+            if part["batch_id"]:
+                continue
+            if not part["input_file_id"]:
+                with open(part["input_path"], "rb") as f:
+                    uploaded = self.client.files.create(file=f, purpose="batch")
+                part["input_file_id"] = uploaded.id
+                self._save_state()
+            batch = self.client.batches.create(
+                input_file_id=part["input_file_id"],
+                endpoint=BATCH_ENDPOINT,
+                completion_window="24h",
+                metadata={"job_id": self.job_id},
+            )
+            part["batch_id"] = batch.id
+            part["status"] = batch.status
+            self._save_state()
+            logging.info(f"已送出 batch {batch.id}（{part['requests']} 個請求）")
+
+    # ---- 輪詢與取回 ----
+
+    def _poll(self):
+        while True:
+            waiting = 0
+            for part in self.state["parts"]:
+                if part["collected"]:
+                    continue
+                batch = self.client.batches.retrieve(part["batch_id"])
+                if batch.status != part["status"]:
+                    counts = batch.request_counts
+                    progress = f"{counts.completed}/{counts.total}" if counts else "-"
+                    logging.info(f"Batch {batch.id}: {batch.status}（{progress}）")
+                part["status"] = batch.status
+                part["output_file_id"] = batch.output_file_id
+                part["error_file_id"] = batch.error_file_id
+                if batch.status in TERMINAL_STATUSES:
+                    self._collect(part)
+                else:
+                    waiting += 1
+            self._save_state()
+            if not waiting:
+                return
+            time.sleep(self.poll_interval)
+
+    def _iter_file_lines(self, file_id: str):
+        with self.client.files.with_streaming_response.content(file_id) as response:
+            for line in response.iter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+    def _collect(self, part: Dict):
+        """串流讀取 output / error 檔，結果追加寫入 results.jsonl 並寫入 caption 快取"""
+        cap = self.captioner
+        paths = self.state["image_paths"]
+        n = 0
+        with open(self.results_path, "a", encoding="utf-8") as out:
+            for key in ("output_file_id", "error_file_id"):
+                if not part[key]:
+                    continue
+                for row in self._iter_file_lines(part[key]):
+                    custom_id = row["custom_id"]
+                    response = row.get("response") or {}
+                    body = response.get("body") or {}
+                    if response.get("status_code") == 200 and body.get("choices"):
+                        caption = (body["choices"][0].get("message", {}).get("content") or "").strip()
+                        caption = caption or "[ERROR] No caption returned"
+                    else:
+                        error = row.get("error") or body.get("error") or {}
+                        caption = f"[ERROR] {error.get('message', 'batch request failed')}"
+                    out.write(json.dumps({"custom_id": custom_id, "caption": caption}, ensure_ascii=False) + "\n")
+                    i = int(custom_id.split("-", 1)[1])
+                    image_hash = cap._cache_lookup(paths[i], count=False)[0]
+                    cap._cache_store(image_hash, caption)
+                    n += 1
+                    if self._on_result is not None and i not in self._emitted:
+                        # 先寫入 results.jsonl 再送出，呼叫端中斷時這筆仍可由 job 續跑取回
+                        out.flush()
+                        self._emitted.add(i)
+                        path = paths[i]
+                        self._on_result(i, _caption_result(os.path.splitext(os.path.basename(path))[0], path, caption))
+            out.flush()
+            os.fsync(out.fileno())
+        part["collected"] = True
+        logging.info(f"Batch {part['batch_id']}: 取回 {n} 筆結果")
+
+    def _assemble(self) -> List[dict]:
+        results: Dict[str, str] = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        row = json.loads(line)
+                        results[row["custom_id"]] = row["caption"]
+        cap = self.captioner
+        out = []
+        for i, path in enumerate(self.state["image_paths"]):
+            image_id = os.path.splitext(os.path.basename(path))[0]
+            caption = results.get(f"img-{i}")
+            if caption is None:
+                caption = cap._cache_lookup(path)[1] or "[ERROR] batch request missing"
+            out.append(_caption_result(image_id, path, caption))
+        return out
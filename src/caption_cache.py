@@ -0,0 +1,149 @@
+"""
+以內容定址的 caption 快取
+
+key 為 (圖片內容 sha256, VLM model, CAPTION_PROMPT 版本)，圖片內容或 prompt 改變時自動失效。
+資料存放於 SQLite（WAL 模式），並在記憶體中保留一份，命中時不需任何網路 I/O。
+檔案內容雜湊另以 (path, size, mtime) 記錄，未變動的檔案不必重新讀取計算。
+"[ERROR] ..." 描述一律不寫入快取。
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+CACHE_FILE = "captions.sqlite"
+ERROR_PREFIX = "[ERROR]"
+
+
+def prompt_version(prompt: str) -> str:
+    """prompt 內容的短雜湊，prompt 修改後舊快取即不再命中"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CaptionCache:
+    """SQLite 上的 caption 快取，附記憶體層"""
+
+    def __init__(self, cache_dir: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            " image_hash TEXT NOT NULL, model TEXT NOT NULL, prompt_version TEXT NOT NULL,"
+            " caption TEXT NOT NULL, created_at REAL NOT NULL,"
+            " PRIMARY KEY (image_hash, model, prompt_version))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sha256 TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._captions: Dict[Tuple[str, str, str], str] = {}
+        self._file_hashes: Dict[str, Tuple[int, int, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def image_hash(self, image_path: str) -> str:
+        """圖片內容雜湊；size 與 mtime 未變時直接沿用先前的結果"""
+        path = os.path.abspath(image_path)
+        st = os.stat(path)
+        known = self._file_hashes.get(path)
+        if known is None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?", (path,)
+                ).fetchone()
+            if row is not None:
+                known = tuple(row)
+                self._file_hashes[path] = known
+        if known is not None and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        sha = file_sha256(path)
+        self._file_hashes[path] = (st.st_size, st.st_mtime_ns, sha)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, sha),
+            )
+            self._conn.commit()
+        return sha
+
+    def get(self, image_hash: str, model: str, version: str, count: bool = True) -> Optional[str]:
+        """count=False 時只查詢、不計入命中統計（預先判斷哪些圖片需要送出時使用）"""
+        key = (image_hash, model, version)
+        caption = self._captions.get(key)
+        if caption is None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT caption FROM captions WHERE image_hash = ? AND model = ? AND prompt_version = ?", key
+                ).fetchone()
+            if row is not None:
+                caption = row[0]
+                self._captions[key] = caption
+        if count:
+            if caption is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return caption
+
+    def put(self, image_hash: str, model: str, version: str, caption: str) -> bool:
+        """寫入快取；錯誤或空白描述不寫入，回傳是否寫入"""
+        if not caption or caption.startswith(ERROR_PREFIX):
+            return False
+        key = (image_hash, model, version)
+        self._captions[key] = caption
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO captions (image_hash, model, prompt_version, caption, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (*key, caption, time.time()),
+            )
+            self._conn.commit()
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM captions").fetchone()[0]
+        return {"entries": count, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache: Optional[CaptionCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_caption_cache() -> Optional[CaptionCache]:
+    """依 Config 建立行程共用的快取；CAPTION_CACHE_DIR 為空時停用"""
+    global _default_cache
+    if _default_cache is not None:
+        return _default_cache
+    from src.config import get_config
+    config = get_config()
+    if not config.CAPTION_CACHE_DIR:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = CaptionCache(config.CAPTION_CACHE_DIR)
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"Caption 快取無法開啟，停用快取: {e}")
+                return None
+    return _default_cache
@@ -13,7 +13,44 @@ class Config:
     EMBEDDING_MODEL: str
     VLM_MODEL: str
     TOP_K: int
-    EMBEDDING_MODE: str  # "auto" or "manual"
+    EMBEDDING_MODE: str  # "auto"、"manual" 或 "server"（manual + 共用 embedding server）
+    OPENAI_BASE_URL: str = ""  # 相容 OpenAI 的服務位址，空字串使用官方 API
+    CAPTION_MODE: str = "sync"  # "sync" 逐張處理，"async" 並行 + token bucket 限流，"batch" 使用 Batch API
+    CAPTION_CONCURRENCY: int = 8  # async 模式最大並行請求數
+    VLM_RPM: int = 60  # async 模式每分鐘請求數上限，0 表示不限
+    VLM_TPM: int = 0  # async 模式每分鐘 token 數上限，0 表示不限
+    CAPTION_CACHE_DIR: str = "data/caption_cache"  # caption 快取目錄，空字串表示停用
+    BATCH_JOB_DIR: str = "data/batch_jobs"  # batch 模式的 JSONL 與 job 狀態目錄
+    BATCH_POLL_INTERVAL: float = 30.0  # batch 模式輪詢間隔（秒）
+    IMAGE_MAX_SIDE: int = 1024  # 上傳前縮圖的最長邊（像素），0 表示上傳原檔
+    IMAGE_JPEG_QUALITY: int = 85  # 縮圖後重新編碼的 JPEG 品質
+    PREPROCESS_WORKERS: int = 0  # 圖片前處理 process 數，0 表示使用 CPU 數
+    EMBEDDING_CACHE_DIR: str = "data/embedding_cache"  # 持久化 embedding 快取目錄，空字串表示停用
+    EMBEDDING_CACHE_MAX_MB: int = 1024  # 快取容量上限，超過時依 LRU 淘汰
+    EMBEDDING_SERVER_URL: str = "http://127.0.0.1:8010"  # server 模式的 embedding server 位址
+    EMBEDDING_SERVER_TIMEOUT: float = 60.0  # 每個 embedding 請求的逾時（秒）
+    EMBEDDING_SERVER_MAX_BATCH: int = 64  # server 合併並發請求時每批最多的文字數
+    EMBEDDING_SERVER_MAX_WAIT_MS: float = 5.0  # server 等待湊批的最長時間（毫秒）
+    EMBED_BATCH_SIZE: int = 32  # 索引時每次送入 embedding model 的 caption 數
+    DEDUP_METHOD: str = "none"  # caption 前的近似重複偵測: "none"、"dhash" 或 "phash"
+    DEDUP_MAX_DISTANCE: int = 4  # 感知雜湊漢明距離 <= 此值視為近似重複
+    PIPELINE_QUEUE_SIZE: int = 256  # 索引流程 stage 之間的 queue 容量（caption 筆數）
+    COMMIT_EVERY: int = 500  # 索引流程每寫入幾筆 commit 一次向量庫
+    COMMIT_INTERVAL: float = 60.0  # 索引流程 commit 的最長間隔（秒）
+    JOURNAL_FLUSH_EVERY: int = 100  # 索引 checkpoint journal 每累積幾筆寫入一次
+    JOURNAL_FLUSH_INTERVAL: float = 30.0  # journal 寫入的最長間隔（秒）
+    MAX_SEGMENTS: int = 16  # manual 向量庫 segment 數上限，超過時自動合併
+    TOMBSTONE_RATIO: float = 0.2  # 已刪除 / 被取代的列超過此比例時重寫向量庫
+    SEARCH_ENGINE: str = "exact"  # manual 模式搜尋引擎: "exact" 或 "ivf"
+    SEARCH_THREADS: int = 1  # 精確搜尋平行計分的執行緒數，1 表示不平行，0 表示 CPU 核心數
+    IVF_NLIST: int = 0  # IVF 分群數，0 表示依資料量自動決定
+    IVF_NPROBE: int = 8  # 查詢時掃描的分群數（越大 recall 越高、越慢）
+    QUANTIZATION: str = "none"  # 向量量化: "none"、"sq8"（int8）或 "pq"（product quantization）
+    PQ_M: int = 128  # PQ 子空間數，需整除 embedding 維度
+    RESCORE_K: int = 100  # 量化計分後以原始向量重算的候選數，0 表示不重算
+    LEXICAL_INDEX: bool = True  # 索引時為 caption 建立 BM25 倒排表（字元 bigram）
+    SEARCH_MODE: str = "vector"  # 查詢模式: "vector"、"lexical"（BM25）或 "hybrid"（RRF 合併）
+    STARTUP_BUDGET_MS: float = 500.0  # scripts/check_startup_time.py 檢查的 CLI 入口匯入時間上限（毫秒）
 
 def get_config() -> Config:
     return Config(
@@ -25,4 +62,41 @@ def get_config() -> Config:
         VLM_MODEL=os.getenv("VLM_MODEL", "gpt-4-vision-preview"),
         TOP_K=int(os.getenv("TOP_K", "5")),
         EMBEDDING_MODE=os.getenv("EMBEDDING_MODE", "auto"),  # 新增
+        OPENAI_BASE_URL=os.getenv("OPENAI_BASE_URL", ""),
+        CAPTION_MODE=os.getenv("CAPTION_MODE", "sync"),
+        CAPTION_CONCURRENCY=int(os.getenv("CAPTION_CONCURRENCY", "8")),
+        VLM_RPM=int(os.getenv("VLM_RPM", "60")),
+        VLM_TPM=int(os.getenv("VLM_TPM", "0")),
+        CAPTION_CACHE_DIR=os.getenv("CAPTION_CACHE_DIR", "data/caption_cache"),
+        BATCH_JOB_DIR=os.getenv("BATCH_JOB_DIR", "data/batch_jobs"),
+        BATCH_POLL_INTERVAL=float(os.getenv("BATCH_POLL_INTERVAL", "30")),
+        IMAGE_MAX_SIDE=int(os.getenv("IMAGE_MAX_SIDE", "1024")),
+        IMAGE_JPEG_QUALITY=int(os.getenv("IMAGE_JPEG_QUALITY", "85")),
+        PREPROCESS_WORKERS=int(os.getenv("PREPROCESS_WORKERS", "0")),
+        EMBEDDING_CACHE_DIR=os.getenv("EMBEDDING_CACHE_DIR", "data/embedding_cache"),
+        EMBEDDING_CACHE_MAX_MB=int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024")),
+        EMBEDDING_SERVER_URL=os.getenv("EMBEDDING_SERVER_URL", "http://127.0.0.1:8010"),
+        EMBEDDING_SERVER_TIMEOUT=float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "60")),
+        EMBEDDING_SERVER_MAX_BATCH=int(os.getenv("EMBEDDING_SERVER_MAX_BATCH", "64")),
+        EMBEDDING_SERVER_MAX_WAIT_MS=float(os.getenv("EMBEDDING_SERVER_MAX_WAIT_MS", "5")),
+        EMBED_BATCH_SIZE=int(os.getenv("EMBED_BATCH_SIZE", "32")),
+        DEDUP_METHOD=os.getenv("DEDUP_METHOD", "none"),
+        DEDUP_MAX_DISTANCE=int(os.getenv("DEDUP_MAX_DISTANCE", "4")),
+        PIPELINE_QUEUE_SIZE=int(os.getenv("PIPELINE_QUEUE_SIZE", "256")),
+        COMMIT_EVERY=int(os.getenv("COMMIT_EVERY", "500")),
+        COMMIT_INTERVAL=float(os.getenv("COMMIT_INTERVAL", "60")),
+        JOURNAL_FLUSH_EVERY=int(os.getenv("JOURNAL_FLUSH_EVERY", "100")),
+        JOURNAL_FLUSH_INTERVAL=float(os.getenv("JOURNAL_FLUSH_INTERVAL", "30")),
+        MAX_SEGMENTS=int(os.getenv("MAX_SEGMENTS", "16")),
+        TOMBSTONE_RATIO=float(os.getenv("TOMBSTONE_RATIO", "0.2")),
+        SEARCH_ENGINE=os.getenv("SEARCH_ENGINE", "exact"),
+        SEARCH_THREADS=int(os.getenv("SEARCH_THREADS", "1")),
+        IVF_NLIST=int(os.getenv("IVF_NLIST", "0")),
+        IVF_NPROBE=int(os.getenv("IVF_NPROBE", "8")),
+        QUANTIZATION=os.getenv("QUANTIZATION", "none"),
+        PQ_M=int(os.getenv("PQ_M", "128")),
+        RESCORE_K=int(os.getenv("RESCORE_K", "100")),
+        LEXICAL_INDEX=os.getenv("LEXICAL_INDEX", "true").lower() in ("1", "true", "yes"),
+        SEARCH_MODE=os.getenv("SEARCH_MODE", "vector"),
+        STARTUP_BUDGET_MS=float(os.getenv("STARTUP_BUDGET_MS", "500")),
     )
@@ -0,0 +1,225 @@
+"""
+持久化、以內容定址的 embedding 快取
+
+key 為 (embedding model, 正規化後文字的 sha256)，值為 float32 向量，存放於 SQLite
+（WAL 模式，多個行程可共用同一個檔案）。超過容量上限時依最後存取時間做 LRU 淘汰。
+重複的 caption 與熱門查詢不必再經過 model。
+
+向量總大小由 trigger 維護在 meta 表，寫入時不必 SUM 整張表；命中時的 last_access
+先記在記憶體，每 ACCESS_FLUSH_INTERVAL 秒（或下一次寫入、close 時）才批次寫回。
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+CACHE_FILE = "embeddings.sqlite"
+ACCESS_FLUSH_INTERVAL = 30.0  # 命中的 last_access 最多延遲多久寫回（秒）
+
+
+def normalize_text(text: str) -> str:
+    """NFKC 正規化、去除頭尾空白並合併連續空白"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def text_key(model_key: str, text: str) -> str:
+    return hashlib.sha256(f"{model_key}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite 上的 LRU 快取；max_bytes 為向量資料總量上限"""
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1024 * 1024 * 1024):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILE)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL,"
+            " nbytes INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._init_total()
+        self.hits = 0
+        self.misses = 0
+        self._touched: Dict[str, float] = {}  # 尚未寫回的 last_access
+        self._last_flush = time.monotonic()
+
+    def _init_total(self):
+        """建立 meta 表與維護 total_bytes 的 trigger；既有快取檔只在第一次開啟時 SUM 一次"""
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value)"
+                " SELECT 'total_bytes', COALESCE(SUM(nbytes), 0) FROM embeddings"
+            )
+            for name, event, delta in (
+                ("embeddings_total_insert", "INSERT", "NEW.nbytes"),
+                ("embeddings_total_delete", "DELETE", "-OLD.nbytes"),
+                ("embeddings_total_update", "UPDATE OF nbytes", "NEW.nbytes - OLD.nbytes"),
+            ):
+                self._conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON embeddings BEGIN"
+                    f" UPDATE meta SET value = value + {delta} WHERE key = 'total_bytes'; END"
+                )
+
+    def _total_bytes(self) -> int:
+        return self._conn.execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()[0]
+
+    def _flush_access(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()]
+            )
+            self._touched.clear()
+        self._last_flush = time.monotonic()
+
+    def get_many(self, model_key: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys = [text_key(model_key, t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                for key, blob in self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", chunk
+                ):
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._touched.update((k, now) for k in found)
+                if time.monotonic() - self._last_flush >= ACCESS_FLUSH_INTERVAL:
+                    self._flush_access()
+                    self._conn.commit()
+        out = [found.get(k) for k in keys]
+        hits = sum(v is not None for v in out)
+        self.hits += hits
+        self.misses += len(out) - hits
+        return out
+
+    def put_many(self, model_key: str, texts: Sequence[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        now = time.time()
+        rows = [
+            (text_key(model_key, t), model_key, v.tobytes(), v.nbytes, now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            # upsert（而非 INSERT OR REPLACE），讓 UPDATE trigger 維護 total_bytes
+            self._conn.executemany(
+                "INSERT INTO embeddings (key, model, vector, nbytes, last_access) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET model = excluded.model, vector = excluded.vector,"
+                " nbytes = excluded.nbytes, last_access = excluded.last_access",
+                rows,
+            )
+            self._flush_access()  # 淘汰前先寫回命中時間，LRU 順序才正確
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        # 一次淘汰到上限的 90%，避免每次寫入都觸發
+        target = total - int(self.max_bytes * 0.9)
+        freed, victims = 0, []
+        for key, nbytes in self._conn.execute("SELECT key, nbytes FROM embeddings ORDER BY last_access"):
+            victims.append((key,))
+            freed += nbytes
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        logging.info(f"Embedding 快取淘汰 {len(victims)} 筆（{freed / 1e6:.1f} MB）")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self._total_bytes()
+        return {"entries": count, "bytes": total, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
+
+
+class CachedEmbedder:
+    """
+    包裝 sentence-transformers 或 LlamaIndex embedder：先查快取，只把未命中的文字送進 model。
+    介面與被包裝的 embedder 相同（encode / get_text_embedding / get_text_embedding_batch）。
+    """
+
+    def __init__(self, embedder: Any, model_key: str, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.model_key = model_key
+        self.cache = cache
+
+    def _embed(self, texts: List[str], compute) -> np.ndarray:
+        cached = self.cache.get_many(self.model_key, texts)
+        miss_idx = [i for i, v in enumerate(cached) if v is None]
+        if miss_idx:
+            # 同一批中的重複文字只計算一次
+            unique = list(dict.fromkeys(texts[i] for i in miss_idx))
+            computed = np.asarray(compute(unique), dtype=np.float32).reshape(len(unique), -1)
+            self.cache.put_many(self.model_key, unique, computed)
+            by_text = dict(zip(unique, computed))
+            for i in miss_idx:
+                cached[i] = by_text[texts[i]]
+        return np.stack(cached) if cached else np.zeros((0, 0), dtype=np.float32)
+
+    def encode(self, sentences, **kwargs):
+        if isinstance(sentences, str):
+            return self._embed([sentences], lambda t: self.embedder.encode(t, **kwargs))[0]
+        return self._embed(list(sentences), lambda t: self.embedder.encode(t, **kwargs))
+
+    def get_text_embedding(self, text: str):
+        return self._embed([text], self.embedder.get_text_embedding_batch)[0].tolist()
+
+    def get_text_embedding_batch(self, texts: List[str], **kwargs):
+        return self._embed(list(texts), lambda t: self.embedder.get_text_embedding_batch(t, **kwargs)).tolist()
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[EmbeddingCache]:
+    """依 Config 建立行程共用的快取；EMBEDDING_CACHE_DIR 為空時停用"""
+    global _default_cache
+    if _default_cache is not None:
+        return _default_cache
+    from src.config import get_config
+    config = get_config()
+    if not config.EMBEDDING_CACHE_DIR:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache(
+                config.EMBEDDING_CACHE_DIR, max_bytes=config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+            )
+    return _default_cache
+
+
+def cached(embedder: Any, model_name: str, backend: str, cache: Optional[EmbeddingCache] = None) -> Any:
+    """以快取包裝 embedder；快取停用時原樣回傳"""
+    cache = cache or get_default_cache()
+    if cache is None or isinstance(embedder, CachedEmbedder):
+        return embedder
+    return CachedEmbedder(embedder, f"{backend}:{model_name}", cache)
@@ -0,0 +1,124 @@
+"""
+行程內共用的 embedding model 註冊表
+
+同一個 (model name, backend) 在一個行程中只載入一次，RAGIndexer、RAGQuery、
+SimpleVectorDB 與 Streamlit UI 都從這裡取得 embedder。bge-large 載入需要數秒、
+佔用 GB 等級記憶體，可在啟動時以 warmup() 預先載入，不再需要時以 release() 釋放。
+"""
+import gc
+import logging
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.utils import dynamic_import
+
+BACKEND_SENTENCE_TRANSFORMERS = "sentence_transformers"
+BACKEND_LLAMA_INDEX = "llama_index"
+BACKEND_SERVER = "server"
+
+
+def _load_sentence_transformers(model_name: str) -> Any:
+    SentenceTransformer = dynamic_import("sentence_transformers", "SentenceTransformer")
+    if SentenceTransformer is None:
+        raise ImportError("sentence-transformers 無法匯入，請檢查依賴版本")
+    return SentenceTransformer(model_name)
+
+
+def _load_llama_index(model_name: str) -> Any:
+    HuggingFaceEmbedding = dynamic_import("llama_index.embeddings.huggingface", "HuggingFaceEmbedding")
+    if HuggingFaceEmbedding is None:
+        raise ImportError("LlamaIndex HuggingFaceEmbedding 無法匯入，請檢查依賴版本")
+    return HuggingFaceEmbedding(model_name=model_name)
+
+
+def _load_server(model_name: str) -> Any:
+    """不在本行程載入 model，改連線到 EMBEDDING_SERVER_URL 的共用 embedding server"""
+    from src.config import get_config
+    from src.embedding_service import EmbeddingClient
+    config = get_config()
+    return EmbeddingClient(config.EMBEDDING_SERVER_URL, model_name, timeout=config.EMBEDDING_SERVER_TIMEOUT)
+
+
+_LOADERS: Dict[str, Callable[[str], Any]] = {
+    BACKEND_SENTENCE_TRANSFORMERS: _load_sentence_transformers,
+    BACKEND_LLAMA_INDEX: _load_llama_index,
+    BACKEND_SERVER: _load_server,
+}
+
+_models: Dict[Tuple[str, str], Any] = {}
+_lock = threading.Lock()
+_key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+
+def backend_for_mode(embedding_mode: str) -> str:
+    """
+    EMBEDDING_MODE 對應的 backend：auto 使用 LlamaIndex，manual 使用 sentence-transformers，
+    server 與 manual 相同但推論交給共用的 embedding server
+    """
+    if embedding_mode == "auto":
+        return BACKEND_LLAMA_INDEX
+    if embedding_mode == "manual":
+        return BACKEND_SENTENCE_TRANSFORMERS
+    if embedding_mode == "server":
+        return BACKEND_SERVER
+    raise ValueError("embedding_mode 必須為 'auto'、'manual' 或 'server'")
+
+
+def register_backend(backend: str, loader: Callable[[str], Any]):
+    """註冊額外的 backend（loader 接收 model name，回傳 embedder）"""
+    _LOADERS[backend] = loader
+
+
+def get_embedder(model_name: str, backend: str = BACKEND_SENTENCE_TRANSFORMERS) -> Any:
+    """取得共用 embedder；第一次呼叫時載入，並發呼叫只會載入一次"""
+    key = (model_name, backend)
+    embedder = _models.get(key)
+    if embedder is not None:
+        return embedder
+    if backend not in _LOADERS:
+        raise ValueError(f"未知的 embedding backend: {backend}")
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        embedder = _models.get(key)
+        if embedder is None:
+            t0 = time.time()
+            embedder = _LOADERS[backend](model_name)
+            _models[key] = embedder
+            logging.info(f"Embedding model 已載入: {model_name} ({backend}, {time.time() - t0:.1f}s)")
+    return embedder
+
+
+def warmup(model_name: str, backend: str = BACKEND_SENTENCE_TRANSFORMERS, sample_text: str = "warmup") -> Any:
+    """預先載入並執行一次推論，讓第一個真正的請求不必承擔載入與初始化成本"""
+    embedder = get_embedder(model_name, backend)
+    if hasattr(embedder, "encode"):
+        embedder.encode(sample_text)
+    elif hasattr(embedder, "get_text_embedding"):
+        embedder.get_text_embedding(sample_text)
+    return embedder
+
+
+def release(model_name: Optional[str] = None, backend: Optional[str] = None) -> int:
+    """釋放符合條件的 embedder（皆為 None 時全部釋放），回傳釋放數量"""
+    with _lock:
+        keys = [
+            key for key in _models
+            if (model_name is None or key[0] == model_name) and (backend is None or key[1] == backend)
+        ]
+        for key in keys:
+            del _models[key]
+    if keys:
+        gc.collect()
+        # 只有已載入 torch 時才清 GPU 快取，避免為此匯入 torch
+        torch_cuda = dynamic_import("torch", "cuda") if "torch" in sys.modules else None
+        if torch_cuda is not None and torch_cuda.is_available():
+            torch_cuda.empty_cache()
+        logging.info(f"已釋放 {len(keys)} 個 embedding model")
+    return len(keys)
+
+
+def loaded_models() -> List[Tuple[str, str]]:
+    return list(_models)
@@ -0,0 +1,255 @@
+"""
+本機共用的 embedding 推論服務（localhost HTTP）
+
+每個 Streamlit session、test_query.py 與評估腳本原本各自載入一份 bge-large（約 1.3 GB）。
+EMBEDDING_MODE=server 時改由一個常駐的 server 行程持有 model，其餘行程以 EmbeddingClient
+送出文字、取回向量：
+
+    python scripts/embedding_server.py --port 8010
+    EMBEDDING_MODE=server python scripts/test_query.py "查詢文字"
+
+server 以 MicroBatcher 合併同時到達的請求：第一個請求到達後最多再等 max_wait 秒，
+累積到 max_batch 筆文字就送進 model 一次推論，再把結果切回各請求。
+
+協定：
+    POST /embed   {"model": "...", "texts": ["...", ...]}
+                  -> 200 application/octet-stream，float32（little-endian）row-major，
+                     X-Embedding-Shape: "n,dim"
+    GET  /health  -> {"model", "requests", "texts", "batches", "max_batch_seen"}
+錯誤回傳 JSON {"error": "..."}。
+"""
+import http.client
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import numpy as np
+
+DEFAULT_URL = "http://127.0.0.1:8010"
+SHAPE_HEADER = "X-Embedding-Shape"
+
+
+class MicroBatcher:
+    """把並發的 encode 請求合併成批次，由單一執行緒依序送進 model"""
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch: int = 64, max_wait: float = 0.005):
+        self._encode = encode
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.max_batch_seen = 0
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        if not texts:
+            future.set_result(np.zeros((0, 0), dtype=np.float32))
+        else:
+            self._queue.put((list(texts), future))
+        return future
+
+    def encode(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        return self.submit(texts).result(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        """阻塞取得第一個請求，再於 max_wait 內盡量湊滿 max_batch 筆文字；收到 None 表示停止"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        pending, count = [first], len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # 先處理完手上的批次再停止
+                break
+            pending.append(item)
+            count += len(item[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            if pending is None:
+                return
+            texts = [t for item_texts, _ in pending for t in item_texts]
+            try:
+                vectors = np.asarray(self._encode(texts), dtype=np.float32).reshape(len(texts), -1)
+            except Exception as e:
+                logging.error(f"Embedding 批次失敗（{len(texts)} 筆）: {e}")
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            with self._lock:
+                self.requests += len(pending)
+                self.texts += len(texts)
+                self.batches += 1
+                self.max_batch_seen = max(self.max_batch_seen, len(texts))
+            start = 0
+            for item_texts, future in pending:
+                future.set_result(vectors[start:start + len(item_texts)])
+                start += len(item_texts)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "texts": self.texts,
+                "batches": self.batches,
+                "max_batch_seen": self.max_batch_seen,
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "EmbeddingServer"
+    protocol_version = "HTTP/1.1"  # keep-alive，client 沿用同一條連線
+
+    def log_message(self, fmt, *args):
+        logging.debug("embedding server: " + fmt % args)
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": f"unknown path: {self.path}"})
+            return
+        self._send_json(200, dict(model=self.server.model_name, **self.server.batcher.stats()))
+
+    def do_POST(self):
+        if self.path != "/embed":
+            self._send_json(404, {"error": f"unknown path: {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            texts = body["texts"]
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError("texts 必須為字串 list")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"無效的請求: {e}"})
+            return
+        model = body.get("model")
+        if model and model != self.server.model_name:
+            # 不同 model 的向量不可混用，直接拒絕
+            self._send_json(400, {"error": f"server 載入的是 {self.server.model_name}，不是 {model}"})
+            return
+        try:
+            vectors = self.server.batcher.encode(texts)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        self._send(200, vectors.tobytes(), "application/octet-stream",
+                   {SHAPE_HEADER: f"{vectors.shape[0]},{vectors.shape[1] if vectors.ndim == 2 else 0}"})
+
+
+class EmbeddingServer(ThreadingHTTPServer):
+    """每個連線一個執行緒接收請求，推論一律交給共用的 MicroBatcher"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, model_name: str, batcher: MicroBatcher):
+        super().__init__((host, port), _Handler)
+        self.model_name = model_name
+        self.batcher = batcher
+
+
+def create_server(model_name: str, host: str = "127.0.0.1", port: int = 8010,
+                  max_batch: int = 64, max_wait: float = 0.005) -> EmbeddingServer:
+    """載入（並 warmup）model，建立尚未開始服務的 server；呼叫端以 serve_forever() 啟動"""
+    from src import embedding_registry
+    backend = embedding_registry.BACKEND_SENTENCE_TRANSFORMERS
+    model = embedding_registry.warmup(model_name, backend)
+    batcher = MicroBatcher(lambda texts: model.encode(texts, batch_size=max_batch), max_batch, max_wait)
+    return EmbeddingServer(host, port, model_name, batcher)
+
+
+class EmbeddingClient:
+    """
+    sentence-transformers 相容的 encode()，推論交給 embedding server。
+    每個執行緒各自保有一條 keep-alive 連線；連線中斷時重連一次。
+    """
+
+    def __init__(self, url: str = DEFAULT_URL, model_name: Optional[str] = None, timeout: float = 60.0):
+        parts = urlsplit(url if "://" in url else f"http://{url}")
+        if parts.scheme != "http" or not parts.hostname:
+            raise ValueError(f"embedding server 位址必須為 http://host:port: {url}")
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.model_name = model_name
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None):
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                return resp, resp.read()
+            except (ConnectionError, http.client.HTTPException, OSError) as e:
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise ConnectionError(
+                        f"無法連線 embedding server {self.url}（請先執行 python scripts/embedding_server.py）: {e}"
+                    ) from e
+
+    def encode(self, sentences, batch_size: Optional[int] = None, **kwargs) -> np.ndarray:
+        """str 回傳 (dim,)，list 回傳 (n, dim)；batch_size 等參數由 server 決定，於此忽略"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        payload = json.dumps({"model": self.model_name, "texts": texts}, ensure_ascii=False).encode("utf-8")
+        resp, data = self._request("POST", "/embed", payload)
+        if resp.status != 200:
+            try:
+                message = json.loads(data).get("error", data)
+            except ValueError:
+                message = data
+            raise RuntimeError(f"embedding server 錯誤（HTTP {resp.status}）: {message}")
+        n, dim = (int(x) for x in resp.getheader(SHAPE_HEADER).split(","))
+        vectors = np.frombuffer(data, dtype="<f4").reshape(n, dim).astype(np.float32)
+        return vectors[0] if single else vectors
+
+    def health(self) -> Dict:
+        resp, data = self._request("GET", "/health")
+        return json.loads(data)
@@ -0,0 +1,148 @@
+"""
+增量索引用的檔案清單
+
+記錄每個已索引圖片的 (path, size, mtime, 內容 sha256) → image_id，存放於
+{chroma_db_dir}/{collection}_files.sqlite，隨向量庫一起刪除（--force）。
+
+scan() 只對每個檔案做一次 stat；size 與 mtime 都沒變的檔案直接視為未變動，
+有變動時才重新計算內容雜湊，內容相同（例如只是 touch）則只更新 mtime。
+因此沒有變動的 10 萬張圖片重跑只需要 stat 的時間。
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.caption_cache import file_sha256
+
+
+def get_file_manifest_path(chroma_db_dir: str, collection_name: str) -> str:
+    return os.path.join(chroma_db_dir, f"{collection_name}_files.sqlite")
+
+
+def image_id_for(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+@dataclass
+class FileEntry:
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    image_id: str
+
+
+@dataclass
+class ScanResult:
+    new: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)  # 內容改變，需要重新 caption
+    touched: List[str] = field(default_factory=list)  # 只有 mtime 改變，內容相同
+    unchanged: int = 0
+    deleted: List[FileEntry] = field(default_factory=list)
+    # 本次掃描得到的 絕對路徑 -> (size, mtime_ns, sha256)；未變動的檔案不會出現在這裡
+    file_info: Dict[str, Tuple[int, int, str]] = field(default_factory=dict)
+
+    @property
+    def to_index(self) -> List[str]:
+        return self.new + self.changed
+
+    def summary(self) -> str:
+        return (
+            f"新增 {len(self.new)}、變更 {len(self.changed)}、僅時間改變 {len(self.touched)}、"
+            f"未變動 {self.unchanged}、已刪除 {len(self.deleted)}"
+        )
+
+
+class FileManifest:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        # 索引流程在 persist 執行緒中登記，連線需可跨執行緒使用
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " sha256 TEXT NOT NULL, image_id TEXT NOT NULL, indexed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def open(cls, chroma_db_dir: str, collection_name: str) -> "FileManifest":
+        return cls(get_file_manifest_path(chroma_db_dir, collection_name))
+
+    def entries(self) -> Dict[str, FileEntry]:
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime_ns, sha256, image_id FROM files").fetchall()
+        return {row[0]: FileEntry(*row) for row in rows}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def scan(self, image_paths: Iterable[str], root: Optional[str] = None) -> ScanResult:
+        """
+        與目前的圖片清單比對。root 指定時，只有位於 root 之下、但已不在清單中的紀錄
+        才視為刪除（避免 --max 或只掃描子目錄時誤刪其他圖片）。
+        """
+        t0 = time.time()
+        known = self.entries()
+        result = ScanResult()
+        seen = set()
+        for original in image_paths:
+            # 清單以絕對路徑為 key，結果保留呼叫端傳入的路徑寫法
+            path = os.path.abspath(original)
+            seen.add(path)
+            st = os.stat(path)
+            entry = known.get(path)
+            if entry is not None and entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+                result.unchanged += 1
+                continue
+            sha = file_sha256(path)
+            result.file_info[path] = (st.st_size, st.st_mtime_ns, sha)
+            if entry is None:
+                result.new.append(original)
+            elif entry.sha256 != sha:
+                result.changed.append(original)
+            else:
+                result.touched.append(original)
+        root = os.path.abspath(root) + os.sep if root else None
+        for path, entry in known.items():
+            if path not in seen and (root is None or path.startswith(root)):
+                result.deleted.append(entry)
+        logging.info(f"檔案清單比對完成（{time.time() - t0:.2f}s）：{result.summary()}")
+        return result
+
+    def record(self, paths: Iterable[str], file_info: Dict[str, Tuple[int, int, str]]):
+        """登記已寫入向量庫的檔案（應在向量庫 commit 之後呼叫）"""
+        now = time.time()
+        rows = []
+        for path in paths:
+            path = os.path.abspath(path)
+            info = file_info.get(path)
+            if info is None:
+                st = os.stat(path)
+                info = (st.st_size, st.st_mtime_ns, file_sha256(path))
+            rows.append((path, info[0], info[1], info[2], image_id_for(path), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, image_id, indexed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def remove(self, paths: Iterable[str]):
+        rows = [(os.path.abspath(p),) for p in paths]
+        with self._lock:
+            self._conn.executemany("DELETE FROM files WHERE path = ?", rows)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,140 @@
+"""
+上傳前的圖片前處理
+
+送進 VLM 前把圖片縮到最長邊 max_side、以指定品質重新編碼為 JPEG 並去除 EXIF 等 metadata，
+降低上傳時間、請求大小與 vision token 成本。解碼與編碼是 CPU 密集工作，批次時在 process pool 中執行。
+"""
+import io
+import logging
+import os
+import signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Tuple
+
+from src.utils import load_image
+
+DEFAULT_MAX_SIDE = 1024
+DEFAULT_JPEG_QUALITY = 85
+# 可能帶有拍攝地點、裝置等資訊的欄位；原檔含任一項時一律上傳重新編碼（已去除 metadata）的版本
+_METADATA_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "comment", "icc_profile", "photoshop")
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    width: int
+    height: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+
+def _read_original(image_path: str) -> PreparedImage:
+    with open(image_path, "rb") as f:
+        data = f.read()
+    with load_image(image_path) as img:
+        mime_type = "image/png" if img.format == "PNG" else "image/jpeg"
+        width, height = img.size
+    return PreparedImage(data, mime_type, len(data), width, height)
+
+
+def _has_metadata(img) -> bool:
+    if any(key in img.info for key in _METADATA_KEYS) or len(img.getexif()):
+        return True
+    return bool(getattr(img, "text", None))  # PNG tEXt / iTXt
+
+
+def preprocess_image(
+    image_path: str,
+    max_side: int = DEFAULT_MAX_SIDE,
+    quality: int = DEFAULT_JPEG_QUALITY,
+) -> PreparedImage:
+    """
+    縮圖並重新編碼為 JPEG；max_side <= 0 時不處理。
+    未縮圖且重新編碼沒有變小時，只有原檔不含 metadata 才沿用原檔，否則仍送出重新編碼的版本。
+    """
+    if max_side <= 0:
+        return _read_original(image_path)
+    from PIL import Image, ImageOps
+    original_bytes = os.path.getsize(image_path)
+    with load_image(image_path) as img:
+        has_metadata = _has_metadata(img)
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            # JPEG 不支援透明，鋪在白底上
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.split()[-1])
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        resized = max(img.size) > max_side
+        if resized:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        buf = io.BytesIO()
+        # 不傳 exif / icc_profile，重新編碼即去除原檔 metadata
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+        width, height = img.size
+    data = buf.getvalue()
+    if not resized and not has_metadata and len(data) >= original_bytes:
+        return _read_original(image_path)
+    return PreparedImage(data, "image/jpeg", original_bytes, width, height)
+
+
+def ignore_sigint():
+    """process pool 的 initializer：Ctrl-C 只由主行程處理，子行程不各自拋出 KeyboardInterrupt"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _preprocess_safe(args: Tuple[str, int, int]):
+    image_path, max_side, quality = args
+    try:
+        return preprocess_image(image_path, max_side, quality)
+    except Exception as e:
+        return e
+
+
+def iter_preprocessed(
+    image_paths: Iterable[str],
+    max_side: int = DEFAULT_MAX_SIDE,
+    quality: int = DEFAULT_JPEG_QUALITY,
+    workers: int = 0,
+    window: Optional[int] = None,
+    executor: Optional[ProcessPoolExecutor] = None,
+) -> Iterator[Tuple[str, object]]:
+    """
+    依輸入順序產出 (path, PreparedImage 或 Exception)。
+    最多同時有 window 張在 process pool 中處理，記憶體不隨圖片數成長；workers=0 使用 CPU 數。
+    """
+    workers = workers or os.cpu_count() or 1
+    window = window or workers * 4
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=ignore_sigint)
+    pending = deque()
+    try:
+        for path in image_paths:
+            pending.append((path, executor.submit(_preprocess_safe, (path, max_side, quality))))
+            if len(pending) >= window:
+                path_done, future = pending.popleft()
+                yield path_done, future.result()
+        while pending:
+            path_done, future = pending.popleft()
+            yield path_done, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True)
+
+
+def log_savings(image_path: str, prepared: PreparedImage):
+    ratio = prepared.bytes_saved / prepared.original_bytes if prepared.original_bytes else 0.0
+    logging.info(
+        f"[PREPROCESS] {os.path.basename(image_path)}: {prepared.original_bytes / 1024:.0f} KB -> "
+        f"{len(prepared.data) / 1024:.0f} KB（節省 {prepared.bytes_saved / 1024:.0f} KB, {ratio:.0%}）"
+    )
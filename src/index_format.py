@@ -0,0 +1,223 @@
+"""
+SimpleVectorDB 的版本化、分段（segment）磁碟格式
+
+目錄結構（version 3）：
+    {collection}_vectors/
+    ├── manifest.json               # 格式名稱、版本、維度、存活中的 segment 清單
+    ├── seg-000001/
+    │   ├── vectors.npy             # (count, dim) float32，可直接 np.memmap（零複製）
+    │   └── meta.*                  # 欄式 metadata（見 metadata_columns）
+    └── seg-000002/ ...
+
+每個 segment 寫入後即不可變；新增資料只會寫一個新的 segment 並原子地
+替換 manifest，因此寫入成本只與新增量有關。合併（compaction）會把多個
+小 segment 重寫成一個，再更新 manifest 並刪除舊目錄。
+
+開啟索引只讀 manifest 與 .npy header，成本與資料量無關；向量與 metadata
+皆以 mmap 存取，同一台機器上的多個行程共用 page cache。
+"""
+import bisect
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from src import metadata_columns
+
+FORMAT_NAME = "simple-vector-db"
+FORMAT_VERSION = 3
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+
+
+class MetadataStore:
+    """可追加的 metadata 序列：依序串接各 segment 的唯讀 view，再接記憶體中新增的列"""
+
+    def __init__(self, bases: Optional[List[metadata_columns.ColumnarMetadataView]] = None):
+        self._bases: List[metadata_columns.ColumnarMetadataView] = []
+        self._starts: List[int] = []  # 各 base 的全域起始列
+        self._base_count = 0
+        self._tail: List[Dict] = []
+        for base in bases or []:
+            self.add_base(base)
+
+    def add_base(self, base: metadata_columns.ColumnarMetadataView):
+        self._bases.append(base)
+        self._starts.append(self._base_count)
+        self._base_count += len(base)
+
+    def seal_tail(self, base: metadata_columns.ColumnarMetadataView):
+        """tail 已寫成 segment：以磁碟 view 取代記憶體中的列"""
+        if len(base) != len(self._tail):
+            raise ValueError("segment 筆數與 tail 不一致")
+        self._tail = []
+        self.add_base(base)
+
+    def __len__(self) -> int:
+        return self._base_count + len(self._tail)
+
+    def __getitem__(self, i: int) -> Dict:
+        if i < 0:
+            i += len(self)
+        if i >= self._base_count:
+            return self._tail[i - self._base_count]
+        if i < 0:
+            raise IndexError("metadata index out of range")
+        b = bisect.bisect_right(self._starts, i) - 1
+        return self._bases[b][i - self._starts[b]]
+
+    def __iter__(self) -> Iterator[Dict]:
+        for base in self._bases:
+            yield from base
+        yield from self._tail
+
+    @property
+    def tail(self) -> List[Dict]:
+        return self._tail
+
+    def append(self, meta: Dict):
+        self._tail.append(meta)
+
+    def extend(self, metas: Iterable[Dict]):
+        self._tail.extend(metas)
+
+    def column(self, key: str) -> List:
+        """整欄的值（依全域列序）；欄式 segment 不需組裝每列的 dict"""
+        values = []
+        for base in self._bases:
+            values.extend(base.column(key))
+        values.extend(meta.get(key) for meta in self._tail)
+        return values
+
+
+@dataclass
+class Segment:
+    name: str
+    vectors: np.ndarray  # 唯讀 memmap
+    metadata: metadata_columns.ColumnarMetadataView
+
+    @property
+    def count(self) -> int:
+        return self.vectors.shape[0]
+
+
+def _fsync_replace(tmp_path: str, final_path: str):
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, final_path)
+
+
+def segment_name(seq: int) -> str:
+    return f"seg-{seq:06d}"
+
+
+def write_segment(path: str, name: str, vectors: np.ndarray, metadata: Iterable[Dict]) -> int:
+    """寫入一個新的不可變 segment（metadata 為欄式）；先寫入暫存目錄再 rename，回傳筆數"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count = vectors.shape[0]
+    final_dir = os.path.join(path, name)
+    tmp_dir = final_dir + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    with open(os.path.join(tmp_dir, VECTORS_FILE), "wb") as f:
+        np.save(f, vectors)
+        os.fsync(f.fileno())
+
+    written = metadata_columns.write_columns(tmp_dir, metadata)
+    if written != count:
+        shutil.rmtree(tmp_dir)
+        raise ValueError(f"向量數 {count} 與 metadata 數 {written} 不一致")
+
+    os.replace(tmp_dir, final_dir)
+    return count
+
+
+def write_array(path: str, fname: str, arr: np.ndarray):
+    """原子地寫入衍生陣列（如 ANN 分群編號）；path 可為向量庫根目錄或 segment 目錄"""
+    final_path = os.path.join(path, fname)
+    tmp = final_path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, np.ascontiguousarray(arr))
+    _fsync_replace(tmp, final_path)
+
+
+def load_array(path: str, fname: str, mmap_mode: Optional[str] = "r") -> Optional[np.ndarray]:
+    """讀取衍生陣列；檔案不存在時回傳 None"""
+    fpath = os.path.join(path, fname)
+    if not os.path.isfile(fpath):
+        return None
+    return np.load(fpath, mmap_mode=mmap_mode)
+
+
+def remove_stale(path: str, prefix: str, keep: Optional[str] = None):
+    """刪除 path 下以 prefix 開頭、且不是 keep 的檔案（舊版本的衍生陣列）"""
+    if not os.path.isdir(path):
+        return
+    for entry in os.listdir(path):
+        if entry.startswith(prefix) and entry != keep:
+            os.remove(os.path.join(path, entry))
+
+
+def open_segment(path: str, name: str) -> Segment:
+    seg_dir = os.path.join(path, name)
+    vectors = np.load(os.path.join(seg_dir, VECTORS_FILE), mmap_mode="r")
+    metadata = metadata_columns.ColumnarMetadataView(seg_dir)
+    if vectors.shape[0] != len(metadata):
+        raise ValueError(f"segment 檔案筆數不一致: {seg_dir}")
+    return Segment(name=name, vectors=vectors, metadata=metadata)
+
+
+def remove_segment(path: str, name: str):
+    shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def new_manifest(dim: int) -> Dict:
+    return {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "dim": int(dim),
+        "dtype": "float32",
+        "normalized": True,
+        "next_segment": 1,
+        "segments": [],
+    }
+
+
+def read_manifest(path: str) -> Optional[Dict]:
+    """讀取 manifest；不存在時回傳 None"""
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_NAME:
+        raise ValueError(f"未知的索引格式: {manifest.get('format')}")
+    version = manifest.get("version", 0)
+    if version > FORMAT_VERSION:
+        raise ValueError(f"索引格式版本 {version} 高於支援的 {FORMAT_VERSION}，請升級程式")
+    return manifest
+
+
+def write_manifest(path: str, manifest: Dict):
+    """原子地替換 manifest；讀者只會看到舊版或新版的完整 segment 清單"""
+    os.makedirs(path, exist_ok=True)
+    manifest = dict(manifest, format=FORMAT_NAME, version=FORMAT_VERSION)
+    manifest["count"] = int(sum(s["count"] for s in manifest["segments"]))
+    tmp = os.path.join(path, MANIFEST_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    _fsync_replace(tmp, os.path.join(path, MANIFEST_FILE))
+
+
+def remove_orphans(path: str, manifest: Dict):
+    """刪除 manifest 未列出的 segment 目錄（合併或覆寫後殘留的舊檔）"""
+    live = {s["name"] for s in manifest["segments"]}
+    for entry in os.listdir(path):
+        if entry.startswith("seg-") and entry not in live:
+            remove_segment(path, entry)
@@ -0,0 +1,135 @@
+"""
+索引流程的 append-only checkpoint journal
+
+索引過程中完成的 caption 與 embedding 先緩衝在記憶體，每 flush_every 筆或 flush_interval 秒
+寫成一個新的 checkpoint 檔（{collection}_journal/ckpt-NNNNNN.npz）：先寫暫存檔、fsync 後
+os.replace，讀者只會看到完整的檔案；既有檔案不會被修改。
+
+中斷後以 index_images.py --resume 重跑：journal 中已 embed 但尚未 commit 的項目直接寫入向量庫，
+只有 caption 的項目略過 VLM 直接 embed，其餘圖片照常處理。整個流程成功結束後清空 journal。
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+CHECKPOINT_PREFIX = "ckpt-"
+
+
+def get_journal_dir(chroma_db_dir: str, collection_name: str) -> str:
+    return os.path.join(chroma_db_dir, f"{collection_name}_journal")
+
+
+def _json_array(obj) -> np.ndarray:
+    return np.frombuffer(json.dumps(obj, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+
+
+def _from_json_array(arr: np.ndarray):
+    return json.loads(arr.tobytes().decode("utf-8"))
+
+
+class IngestJournal:
+    def __init__(self, path: str, flush_every: int = 100, flush_interval: float = 30.0):
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._captions: List[Dict] = []
+        self._embs: List[np.ndarray] = []
+        self._metas: List[Dict] = []
+        self._last_flush = time.time()
+        self._next = self._scan_next()
+
+    @classmethod
+    def open(cls, chroma_db_dir: str, collection_name: str, **kwargs) -> "IngestJournal":
+        return cls(get_journal_dir(chroma_db_dir, collection_name), **kwargs)
+
+    def _checkpoints(self) -> List[str]:
+        names = [n for n in os.listdir(self.path) if n.startswith(CHECKPOINT_PREFIX) and n.endswith(".npz")]
+        return sorted(os.path.join(self.path, n) for n in names)
+
+    def _scan_next(self) -> int:
+        files = self._checkpoints()
+        if not files:
+            return 1
+        return int(os.path.basename(files[-1])[len(CHECKPOINT_PREFIX):-len(".npz")]) + 1
+
+    def __len__(self) -> int:
+        return len(self._checkpoints())
+
+    # ---- 寫入 ----
+
+    def add_captions(self, captions: List[Dict]):
+        with self._lock:
+            self._captions.extend(captions)
+            self._maybe_flush()
+
+    def add_embedded(self, embs, metas: List[Dict]):
+        if not metas:
+            return
+        with self._lock:
+            self._embs.append(np.asarray(embs, dtype=np.float32).reshape(len(metas), -1))
+            self._metas.extend(metas)
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        pending = len(self._captions) + len(self._metas)
+        if pending >= self.flush_every or (pending and time.time() - self._last_flush >= self.flush_interval):
+            self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._captions and not self._metas:
+            return
+        name = f"{CHECKPOINT_PREFIX}{self._next:06d}.npz"
+        final_path = os.path.join(self.path, name)
+        tmp = final_path + ".tmp"
+        vectors = np.concatenate(self._embs) if self._embs else np.zeros((0, 0), dtype=np.float32)
+        with open(tmp, "wb") as f:
+            np.savez(f, vectors=vectors, metas=_json_array(self._metas), captions=_json_array(self._captions))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, final_path)
+        self._next += 1
+        self._captions, self._embs, self._metas = [], [], []
+        self._last_flush = time.time()
+
+    # ---- 讀取 / 清除 ----
+
+    def replay(self) -> Tuple[Dict[str, Dict], List[Tuple[np.ndarray, Dict]]]:
+        """
+        讀回所有 checkpoint：回傳 (image_path -> caption dict, [(vector, meta), ...])。
+        同一圖片出現多次時以最後一筆為準；寫到一半的暫存檔會被忽略。
+        """
+        captions: Dict[str, Dict] = {}
+        embedded: Dict[str, Tuple[np.ndarray, Dict]] = {}
+        for ckpt in self._checkpoints():
+            try:
+                with np.load(ckpt, allow_pickle=False) as data:
+                    vectors = data["vectors"]
+                    metas = _from_json_array(data["metas"])
+                    for caption in _from_json_array(data["captions"]):
+                        captions[caption["image_path"]] = caption
+            except Exception as e:
+                logging.warning(f"略過無法讀取的 checkpoint {ckpt}: {e}")
+                continue
+            for vec, meta in zip(vectors, metas):
+                embedded[meta["image_path"]] = (vec, meta)
+        return captions, list(embedded.values())
+
+    def clear(self):
+        """流程完成後清空 journal"""
+        with self._lock:
+            self._captions, self._embs, self._metas = [], [], []
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.makedirs(self.path, exist_ok=True)
+            self._next = 1
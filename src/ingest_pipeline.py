@@ -0,0 +1,286 @@
+"""
+串流式索引流程：caption → embed → persist
+
+三個 stage 各自在執行緒中同時運作，之間以有界 queue 相連（queue 滿時上游等待 = backpressure）：
+  1. caption：整批呼叫一次 VLMCaptioner.batch_generate（共用限流器、client 與 process pool），
+     每張圖片完成即經由回呼送出
+  2. embed：湊滿 embed_batch_size 筆（或上游暫時沒有新資料）就批次 embed
+  3. persist：寫入向量庫，每 commit_every 筆或 commit_interval 秒呼叫 RAGIndexer.persist()
+VLM 等待網路時 embedding 與寫入持續進行；中途中斷最多只損失最後一次 commit 之後的資料，
+已生成的 caption 也已在 caption 快取中，重跑時不會再送出。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from src.caption_cache import ERROR_PREFIX
+from src.rate_limit import RateLimiter
+
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    """單一 stage 的計數；busy 為實際工作時間，不含等待上下游"""
+    name: str
+    items: int = 0
+    busy: float = 0.0
+    started: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+    def throughput(self) -> float:
+        elapsed = (self.finished or time.time()) - self.started
+        return self.items / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> Dict:
+        return {
+            "items": self.items,
+            "busy_seconds": round(self.busy, 2),
+            "items_per_second": round(self.throughput(), 2),
+        }
+
+
+class _Stopped(Exception):
+    pass
+
+
+class IngestPipeline:
+    def __init__(
+        self,
+        captioner,
+        indexer,
+        caption_kwargs: Optional[Dict] = None,
+        queue_size: int = 256,
+        commit_every: int = 500,
+        commit_interval: float = 60.0,
+        report_interval: float = 30.0,
+        on_commit: Optional[Callable[[List[Dict]], None]] = None,
+        journal=None,
+        duplicates: Optional[Dict[str, List[str]]] = None,
+    ):
+        self.captioner = captioner
+        self.indexer = indexer
+        self.caption_kwargs = dict(caption_kwargs or {})
+        self.queue_size = max(1, queue_size)
+        self.commit_every = max(1, commit_every)
+        self.commit_interval = commit_interval
+        self.report_interval = report_interval
+        self.on_commit = on_commit  # 每次 commit 後以該次寫入的 metadata 呼叫（例如登記檔案清單）
+        self.journal = journal  # IngestJournal：caption 與 embedding 完成後即 checkpoint
+        # 代表圖 path -> 近似重複圖片；只有代表圖送進 caption，其餘沿用代表圖的 caption 與向量
+        self.duplicates = duplicates or {}
+        self.linked = 0
+        self.stats = {name: StageStats(name) for name in ("caption", "embed", "persist")}
+        self.caption_errors = 0
+        self.commits = 0
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+
+    # ---- queue 工具：等待時定期檢查是否有其他 stage 失敗 ----
+
+    def _put(self, q: queue.Queue, item):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue, timeout: Optional[float] = None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            wait = 0.2 if deadline is None else min(0.2, deadline - time.time())
+            if wait <= 0:
+                raise queue.Empty()
+            try:
+                return q.get(timeout=wait)
+            except queue.Empty:
+                continue
+
+    # ---- stages ----
+
+    def _caption_stage(self, image_paths: List[str], precaptioned: List[Dict], out: queue.Queue):
+        st = self.stats["caption"]
+        # 續跑時 journal 中已有的 caption 直接送出，不再呼叫 VLM
+        for result in precaptioned:
+            st.items += 1
+            self._put(out, result)
+        if not image_paths:
+            return
+        waited = 0.0
+
+        def on_result(_, result: Dict):
+            nonlocal waited
+            st.items += 1
+            if self.journal is not None and not result["caption"].startswith(ERROR_PREFIX):
+                self.journal.add_captions([result])
+            t0 = time.time()
+            self._put(out, result)
+            waited += time.time() - t0
+
+        kwargs = dict(self.caption_kwargs)
+        # 整個流程只有一個限流器：VLM_RPM / VLM_TPM 對整批生效，而不是每次呼叫重新計算
+        kwargs.setdefault("limiter", RateLimiter(kwargs.get("requests_per_minute", 0), kwargs.get("tokens_per_minute", 0)))
+        t0 = time.time()
+        self.captioner.batch_generate(image_paths, on_result=on_result, **kwargs)
+        st.busy += time.time() - t0 - waited
+
+    def _embed_stage(self, inp: queue.Queue, out: queue.Queue):
+        st = self.stats["embed"]
+        batch_size = self.indexer.embed_batch_size
+        pending: List[Dict] = []
+        done = False
+        while not done:
+            # 上游暫時沒有資料時先處理手上的，不等湊滿一批
+            try:
+                item = self._get(inp, timeout=None if not pending else 0.5)
+            except queue.Empty:
+                item = None
+            if item is _DONE:
+                done = True
+            elif item is not None:
+                if item["caption"].startswith(ERROR_PREFIX):
+                    self.caption_errors += 1
+                    logging.warning(f"略過 caption 失敗的圖片: {item['image_path']}")
+                else:
+                    pending.append(item)
+                if len(pending) < batch_size:
+                    continue
+            if pending:
+                t0 = time.time()
+                embs, metas = self._link_duplicates(*self.indexer.embed_chunk(pending))
+                if self.journal is not None:
+                    self.journal.add_embedded(embs, metas)
+                st.busy += time.time() - t0
+                st.items += len(metas)
+                pending = []
+                self._put(out, (embs, metas))
+
+    def _link_duplicates(self, embs, metas: List[Dict]):
+        """為代表圖的近似重複圖片複製一列（相同向量與 caption，記錄 duplicate_of）"""
+        if not self.duplicates or not metas:
+            return embs, metas
+        rows, out_metas = [], []
+        for i, meta in enumerate(metas):
+            rows.append(i)
+            out_metas.append(meta)
+            for dup in self.duplicates.get(meta["image_path"], ()):
+                rows.append(i)
+                out_metas.append(dict(
+                    meta,
+                    image_id=os.path.splitext(os.path.basename(dup))[0],
+                    image_path=dup,
+                    duplicate_of=meta["image_id"],
+                ))
+        self.linked += len(out_metas) - len(metas)
+        return np.asarray(embs)[rows], out_metas
+
+    def _persist_stage(self, inp: queue.Queue):
+        st = self.stats["persist"]
+        uncommitted: List[Dict] = []
+        last_commit = time.time()
+        while True:
+            item = self._get(inp)
+            if item is _DONE:
+                break
+            t0 = time.time()
+            self.indexer.add_embedded(*item)
+            uncommitted.extend(item[1])
+            if len(uncommitted) >= self.commit_every or (uncommitted and time.time() - last_commit >= self.commit_interval):
+                self._commit(uncommitted)
+                uncommitted, last_commit = [], time.time()
+            st.busy += time.time() - t0
+            st.items += len(item[1])
+        t0 = time.time()
+        self._commit(uncommitted)
+        st.busy += time.time() - t0
+
+    def _commit(self, metas: List[Dict]):
+        self.indexer.persist()
+        self.commits += 1
+        if metas:
+            if self.on_commit is not None:
+                self.on_commit(metas)
+            logging.info(f"[PIPELINE] commit #{self.commits}：寫入 {len(metas)} 筆")
+
+    # ---- 執行 ----
+
+    def _run_stage(self, name: str, fn, *args, downstream: Optional[queue.Queue] = None):
+        try:
+            fn(*args)
+            if downstream is not None:
+                self._put(downstream, _DONE)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            logging.error(f"[PIPELINE] {name} stage 失敗: {e}")
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            self.stats[name].finished = time.time()
+
+    def _report(self):
+        parts = [f"{s.name} {s.items} 筆 ({s.throughput():.1f}/s)" for s in self.stats.values()]
+        logging.info("[PIPELINE] " + " | ".join(parts))
+
+    def run(self, image_paths: List[str], precaptioned: Optional[List[Dict]] = None) -> Dict:
+        """
+        執行完整流程，回傳各 stage 計數；任一 stage 失敗（或 Ctrl-C）時停止其他 stage、
+        把 journal 緩衝寫入磁碟後拋出例外。precaptioned 為已有 caption、只需 embed 的項目。
+        """
+        precaptioned = list(precaptioned or [])
+        captions_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        # embed 後每個元素是一整批，容量以批數計
+        embedded_q: queue.Queue = queue.Queue(maxsize=max(1, self.queue_size // self.indexer.embed_batch_size))
+        t0 = time.time()
+        for st in self.stats.values():
+            st.started = t0
+        threads = [
+            threading.Thread(target=self._run_stage, name="ingest-caption",
+                             args=("caption", self._caption_stage, image_paths, precaptioned, captions_q),
+                             kwargs={"downstream": captions_q}),
+            threading.Thread(target=self._run_stage, name="ingest-embed",
+                             args=("embed", self._embed_stage, captions_q, embedded_q),
+                             kwargs={"downstream": embedded_q}),
+            threading.Thread(target=self._run_stage, name="ingest-persist",
+                             args=("persist", self._persist_stage, embedded_q)),
+        ]
+        for t in threads:
+            t.start()
+        last_report = time.time()
+        try:
+            while any(t.is_alive() for t in threads):
+                threads[-1].join(timeout=1.0)
+                if threads[-1].is_alive() and time.time() - last_report >= self.report_interval:
+                    self._report()
+                    last_report = time.time()
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            for t in threads:
+                t.join()
+            if self.journal is not None:
+                self.journal.flush()
+        self._report()
+        if self._errors:
+            raise self._errors[0]
+        return {
+            "total": len(image_paths) + len(precaptioned) + sum(len(v) for v in self.duplicates.values()),
+            "indexed": self.stats["persist"].items,
+            "caption_errors": self.caption_errors,
+            "linked_duplicates": self.linked,
+            "commits": self.commits,
+            "elapsed": round(time.time() - t0, 2),
+            "stages": {name: st.summary() for name, st in self.stats.items()},
+        }
@@ -0,0 +1,153 @@
+"""
+caption 的 BM25 倒排索引（中文字元 bigram）
+
+caption 為繁體中文，沒有斷詞：連續的中日韓文字切成字元 bigram（單一字元則保留 unigram），
+英數字則以整個單字為 token。查詢以同樣方式切分，因此「台北車站」會比對
+「台北」「北車」「車站」三個 bigram，不需要 embedding 也能找到包含該詞的圖片。
+
+索引隨 SimpleVectorDB 的 segment 存放（seg-xxxxxx/lexical.npz），segment 不可變，
+所以寫入後不需更新；查詢時跨 segment 合計 df 與平均文件長度再計分。
+"""
+import json
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+LEXICAL_FILE = "lexical.npz"
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """NFKC 正規化、轉小寫後切成英數單字與 CJK 字元 bigram"""
+    tokens = []
+    for run in _TOKEN_RE.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class LexicalSegment:
+    """單一 segment 的倒排表：依 term 排序的 (列號, tf)，加上每列的 token 數"""
+
+    def __init__(self, terms: List[str], offsets: np.ndarray, rows: np.ndarray, tfs: np.ndarray, doc_len: np.ndarray):
+        self.terms = terms
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_len = doc_len
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "LexicalSegment":
+        vocab = {}
+        rows, term_ids, tfs, doc_len = [], [], [], []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                rows.append(row)
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                tfs.append(tf)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")  # 同一 term 內維持列號遞增
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(vocab)))]).astype(np.int64)
+        return cls(
+            list(vocab),
+            offsets,
+            np.asarray(rows, dtype=np.int32)[order],
+            np.minimum(np.asarray(tfs, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16)[order],
+            np.asarray(doc_len, dtype=np.int32),
+        )
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        idx = self.vocab.get(term)
+        if idx is None:
+            return None
+        lo, hi = self.offsets[idx], self.offsets[idx + 1]
+        return self.rows[lo:hi], self.tfs[lo:hi]
+
+    def save(self, seg_dir: str):
+        path = os.path.join(seg_dir, LEXICAL_FILE)
+        tmp = path + ".tmp"
+        terms = np.frombuffer(json.dumps(self.terms, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+        with open(tmp, "wb") as f:
+            np.savez(f, terms=terms, offsets=self.offsets, rows=self.rows, tfs=self.tfs, doc_len=self.doc_len)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, seg_dir: str) -> Optional["LexicalSegment"]:
+        path = os.path.join(seg_dir, LEXICAL_FILE)
+        if not os.path.isfile(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            terms = json.loads(data["terms"].tobytes().decode("utf-8"))
+            return cls(terms, data["offsets"], data["rows"], data["tfs"], data["doc_len"])
+
+
+def bm25_search(
+    parts: Sequence[Tuple[int, LexicalSegment]],
+    query: str,
+    top_k: Optional[int],
+    dead: Optional[np.ndarray] = None,
+    k1: float = DEFAULT_K1,
+    b: float = DEFAULT_B,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    parts 為 (全域起始列, LexicalSegment)。回傳 (全域列號, BM25 分數)，由高到低；
+    只計分含有任一 query token 的列，dead 為 tombstone mask。
+    """
+    terms = Counter(tokenize(query))
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+    n_docs = sum(len(p) for _, p in parts)
+    if not terms or not n_docs or (top_k is not None and top_k <= 0):
+        return empty
+    avgdl = max(sum(int(p.doc_len.sum()) for _, p in parts) / n_docs, 1.0)
+    all_rows, all_scores = [], []
+    for term, qtf in terms.items():
+        hits = [(start, p, p.postings(term)) for start, p in parts]
+        hits = [(start, p, post) for start, p, post in hits if post is not None]
+        df = sum(len(post[0]) for _, _, post in hits)
+        if not df:
+            continue
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        for start, p, (rows, tfs) in hits:
+            tf = tfs.astype(np.float32)
+            norm = k1 * (1.0 - b + b * p.doc_len[rows] / avgdl)
+            all_rows.append(rows.astype(np.int64) + start)
+            all_scores.append((qtf * idf * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32))
+    if not all_rows:
+        return empty
+    rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+    if dead is not None:
+        live = ~dead[rows]
+        rows, scores = rows[live], scores[live]
+    if top_k is not None and top_k < len(scores):
+        idx = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        idx = np.arange(len(scores))
+    idx = idx[np.argsort(-scores[idx], kind="stable")]
+    return rows[idx], scores[idx]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """RRF：score = Σ 1 / (k + rank)，rank 由 1 起算；回傳 [(列號, 分數), ...] 由高到低"""
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, 1):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
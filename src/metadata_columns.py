@@ -0,0 +1,247 @@
+"""
+segment metadata 的欄式（columnar）儲存
+
+每列 metadata 原本是一個 dict（image_id、image_path、caption、ISO 字串的 indexed_at），
+在記憶體中每列有數百 bytes 的物件開銷。欄式格式改為：
+
+    meta.dirs.json                  # image_path 的目錄前綴（intern，每個目錄只存一次）
+    meta.dir.npy                    # (count,) int32，每列的目錄編號
+    meta.{name,image_id,caption,extra}.bin / .offsets.npy
+                                    # 各字串欄位串接成一個 UTF-8 buffer，offsets 為 (count + 1,) int64
+    meta.indexed_at.npy             # (count,) int64，epoch 微秒（UTC）
+    meta.flags.npy                  # (count,) uint8，各核心欄位是否存在
+
+其餘 key（如 duplicate_of）以 JSON 放在 extra 欄位；無法無損轉換的值（非字串、帶時區的時間）
+同樣放在 extra，讀回的 dict 與寫入時完全相同。所有檔案皆以 mmap 開啟，
+只有真正被取用的列（例如查詢的 top-k）才會組成 dict。
+"""
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+DIRS_FILE = "meta.dirs.json"
+DIR_FILE = "meta.dir.npy"
+INDEXED_AT_FILE = "meta.indexed_at.npy"
+FLAGS_FILE = "meta.flags.npy"
+STRING_COLUMNS = ("name", "image_id", "caption", "extra")
+COLUMN_FILES = (DIRS_FILE, DIR_FILE, INDEXED_AT_FILE, FLAGS_FILE) + tuple(
+    f"meta.{c}{suffix}" for c in STRING_COLUMNS for suffix in (".bin", ".offsets.npy")
+)
+
+_HAS_ID, _HAS_PATH, _HAS_CAPTION, _HAS_TIME = 1, 2, 4, 8
+_CORE_KEYS = ("image_id", "image_path", "caption", "indexed_at")
+_EPOCH = datetime(1970, 1, 1)
+MISSING_TIME = np.iinfo(np.int64).min
+
+
+def _iso(us: int) -> str:
+    return (_EPOCH + timedelta(microseconds=int(us))).isoformat()
+
+
+def _to_micros(value) -> Optional[int]:
+    """沒有時區的 ISO 字串轉 epoch 微秒；無法無損還原時回傳 None"""
+    if not isinstance(value, str):
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        return None
+    delta = dt - _EPOCH
+    us = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    return us if _iso(us) == value else None
+
+
+def _split_path(path: str):
+    cut = max(path.rfind("/"), path.rfind(os.sep)) + 1
+    return path[:cut], path[cut:]
+
+
+class _StringWriter:
+    def __init__(self, path: str):
+        self._f = open(path, "wb")
+        self.offsets = [0]
+
+    def add(self, text: str):
+        data = text.encode("utf-8")
+        self._f.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+
+
+def _save_npy(path: str, arr: np.ndarray):
+    with open(path, "wb") as f:
+        np.save(f, arr)
+        os.fsync(f.fileno())
+
+
+def write_columns(seg_dir: str, metadata: Iterable[Dict]) -> int:
+    """把 metadata dict 序列寫成欄式檔案（由 index_format.write_segment 在暫存目錄中呼叫），回傳筆數"""
+    dirs: Dict[str, int] = {}
+    dir_idx: List[int] = []
+    times: List[int] = []
+    flags: List[int] = []
+    writers = {c: _StringWriter(os.path.join(seg_dir, f"meta.{c}.bin")) for c in STRING_COLUMNS}
+    try:
+        for meta in metadata:
+            flag = 0
+            extra = {k: v for k, v in meta.items() if k not in _CORE_KEYS}
+            image_id, path, caption = meta.get("image_id"), meta.get("image_path"), meta.get("caption")
+            if isinstance(image_id, str):
+                flag |= _HAS_ID
+            elif "image_id" in meta:
+                extra["image_id"] = image_id
+            if isinstance(path, str):
+                flag |= _HAS_PATH
+                prefix, name = _split_path(path)
+            else:
+                prefix, name = "", ""
+                if "image_path" in meta:
+                    extra["image_path"] = path
+            if isinstance(caption, str):
+                flag |= _HAS_CAPTION
+            elif "caption" in meta:
+                extra["caption"] = caption
+            us = _to_micros(meta.get("indexed_at"))
+            if us is not None:
+                flag |= _HAS_TIME
+            elif "indexed_at" in meta:
+                extra["indexed_at"] = meta["indexed_at"]
+            dir_idx.append(dirs.setdefault(prefix, len(dirs)))
+            times.append(MISSING_TIME if us is None else us)
+            flags.append(flag)
+            writers["name"].add(name)
+            writers["image_id"].add(image_id if flag & _HAS_ID else "")
+            writers["caption"].add(caption if flag & _HAS_CAPTION else "")
+            writers["extra"].add(json.dumps(extra, ensure_ascii=False) if extra else "")
+    finally:
+        for w in writers.values():
+            w.close()
+    for c, w in writers.items():
+        _save_npy(os.path.join(seg_dir, f"meta.{c}.offsets.npy"), np.asarray(w.offsets, dtype=np.int64))
+    _save_npy(os.path.join(seg_dir, DIR_FILE), np.asarray(dir_idx, dtype=np.int32))
+    _save_npy(os.path.join(seg_dir, INDEXED_AT_FILE), np.asarray(times, dtype=np.int64))
+    _save_npy(os.path.join(seg_dir, FLAGS_FILE), np.asarray(flags, dtype=np.uint8))
+    with open(os.path.join(seg_dir, DIRS_FILE), "w", encoding="utf-8") as f:
+        json.dump(list(dirs), f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(flags)
+
+
+class _PackedStrings:
+    """mmap 的 UTF-8 buffer + offsets，只在取用時解碼單一字串"""
+
+    def __init__(self, seg_dir: str, column: str):
+        self.offsets = np.load(os.path.join(seg_dir, f"meta.{column}.offsets.npy"), mmap_mode="r")
+        path = os.path.join(seg_dir, f"meta.{column}.bin")
+        # 空檔案無法 mmap
+        self.data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.zeros(0, np.uint8)
+
+    def __getitem__(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.data[start:end].tobytes().decode("utf-8") if end > start else ""
+
+    def all(self) -> List[str]:
+        """整欄解碼（一次讀取整個 buffer，比逐列快）"""
+        blob = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+class ColumnarMetadataView:
+    """唯讀、延遲組裝的欄式 metadata 序列（len / 索引 / 迭代），另提供整欄存取"""
+
+    def __init__(self, seg_dir: str):
+        with open(os.path.join(seg_dir, DIRS_FILE), "r", encoding="utf-8") as f:
+            self.dirs: List[str] = json.load(f)
+        self.dir_idx = np.load(os.path.join(seg_dir, DIR_FILE), mmap_mode="r")
+        self.indexed_at_us = np.load(os.path.join(seg_dir, INDEXED_AT_FILE), mmap_mode="r")
+        self.flags = np.load(os.path.join(seg_dir, FLAGS_FILE), mmap_mode="r")
+        self._strings = {c: _PackedStrings(seg_dir, c) for c in STRING_COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def __getitem__(self, i: int) -> Dict:
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("metadata index out of range")
+        flag = int(self.flags[i])
+        meta = {}
+        if flag & _HAS_ID:
+            meta["image_id"] = self._strings["image_id"][i]
+        if flag & _HAS_PATH:
+            meta["image_path"] = self.dirs[int(self.dir_idx[i])] + self._strings["name"][i]
+        if flag & _HAS_CAPTION:
+            meta["caption"] = self._strings["caption"][i]
+        if flag & _HAS_TIME:
+            meta["indexed_at"] = _iso(self.indexed_at_us[i])
+        extra = self._strings["extra"][i]
+        if extra:
+            meta.update(json.loads(extra))
+            # 維持核心欄位在前的 key 順序
+            meta = {k: meta[k] for k in (*_CORE_KEYS, *meta) if k in meta}
+        return meta
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, key: str) -> List:
+        """整欄的值（不存在為 None），不組裝 dict"""
+        n = len(self)
+        if key == "image_path":
+            names = self._strings["name"].all()
+            dirs = self.dirs
+            values = [dirs[d] + name for d, name in zip(self.dir_idx.tolist(), names)]
+            mask = _HAS_PATH
+        elif key in ("image_id", "caption"):
+            values = self._strings[key].all()
+            mask = _HAS_ID if key == "image_id" else _HAS_CAPTION
+        elif key == "indexed_at":
+            values = [None if us == MISSING_TIME else _iso(us) for us in self.indexed_at_us.tolist()]
+            mask = _HAS_TIME
+        else:
+            return [self[i].get(key) if self._strings["extra"][i] else None for i in range(n)]
+        flags = self.flags
+        if not np.all(flags & mask):
+            return [self[i].get(key) if not flags[i] & mask else v for i, v in enumerate(values)]
+        return values
+
+    def epoch_seconds(self) -> np.ndarray:
+        """indexed_at 的 epoch 秒（float64），不存在或不是欄式時間者為 NaN"""
+        out = np.asarray(self.indexed_at_us, dtype=np.float64) / 1e6
+        out[np.asarray(self.indexed_at_us) == MISSING_TIME] = np.nan
+        return out
+
+    def path_prefix_rows(self, prefix: str) -> Optional[np.ndarray]:
+        """
+        image_path 以 prefix 開頭的列（遞增）。先比對 intern 後的目錄：目錄本身符合時整個目錄的列
+        都符合（向量化取出），只有 prefix 比目錄長時才檢查該目錄內的檔名。
+        有非字串 image_path 的列時回傳 None，由呼叫端改用一般路徑。
+        """
+        if not np.all(self.flags & _HAS_PATH):
+            return None
+        whole = [d for d, name in enumerate(self.dirs) if name.startswith(prefix)]
+        partial = [d for d, name in enumerate(self.dirs) if prefix.startswith(name) and not name.startswith(prefix)]
+        dir_idx = np.asarray(self.dir_idx)
+        rows = [np.flatnonzero(np.isin(dir_idx, whole))] if whole else []
+        names = self._strings["name"]
+        for d in partial:
+            rest = prefix[len(self.dirs[d]):]
+            cand = np.flatnonzero(dir_idx == d)
+            rows.append(np.asarray([r for r in cand.tolist() if names[r].startswith(rest)], dtype=np.int64))
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(rows)).astype(np.int64)
@@ -0,0 +1,155 @@
+"""
+metadata 的次要索引與查詢過濾條件
+
+每個 segment 一份（segment 不可變，建立後可一直沿用），各部分在第一次查詢用到時才建立：
+- image_path：欄式 segment 直接比對 intern 後的目錄；其他則為排序後的字串陣列，前綴查詢為兩次二分搜尋
+- indexed_at：排序後的 epoch 秒數，時間範圍查詢同樣為二分搜尋
+- 其他 key：值 -> 列號 的倒排表
+
+查詢時先由索引求出候選列，只對候選列計分，過濾條件越嚴格查詢越快。
+"""
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+TimeValue = Union[str, datetime, int, float, None]
+
+
+def to_epoch(value: TimeValue) -> float:
+    """ISO 字串 / datetime / 數字轉為 epoch 秒；沒有時區的時間視為 UTC（indexed_at 以 utcnow 產生）"""
+    if value is None or value == "":
+        return float("nan")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return float("nan")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _key(value: Any):
+    """metadata 值轉為可雜湊的 key（list / dict 以 JSON 表示）"""
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+@dataclass
+class MetadataFilter:
+    path_prefix: Optional[str] = None
+    indexed_after: TimeValue = None  # 含
+    indexed_before: TimeValue = None  # 不含
+    # key -> 值；值為 list / tuple / set 時表示任一相符
+    where: Dict[str, Any] = field(default_factory=dict)
+
+    def is_empty(self) -> bool:
+        return not self.path_prefix and self.indexed_after is None and self.indexed_before is None and not self.where
+
+
+def _column(metadata: Sequence[Dict], key: str) -> List:
+    """整欄的值；segment 的 metadata view 直接讀欄位，tail（dict 的 list）逐列取"""
+    column = getattr(metadata, "column", None)
+    return column(key) if column is not None else [meta.get(key) for meta in metadata]
+
+
+class SegmentMetadataIndex:
+    """單一 segment（或 tail）的次要索引；列號為 segment 內的 local 列號，各索引在第一次用到時建立"""
+
+    def __init__(self, metadata: Sequence[Dict]):
+        self._metadata = metadata
+        self._count = len(metadata)
+        self._paths: Optional[tuple] = None  # (排序順序, 排序後的 path)
+        self._times: Optional[tuple] = None  # (排序順序, 排序後的 epoch 秒)
+        self._values: Dict[str, Dict[Any, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def path_prefix(self, prefix: str) -> np.ndarray:
+        # 欄式 segment 可直接比對 intern 後的目錄，不需排序整欄 path
+        fast = getattr(self._metadata, "path_prefix_rows", None)
+        rows = fast(prefix) if fast is not None else None
+        if rows is not None:
+            return rows
+        if self._paths is None:
+            paths = np.asarray([p if isinstance(p, str) else "" for p in _column(self._metadata, "image_path")], dtype=object)
+            order = np.argsort(paths, kind="stable").astype(np.int64)
+            self._paths = (order, paths[order])
+        order, paths_sorted = self._paths
+        lo = np.searchsorted(paths_sorted, prefix, side="left")
+        hi = np.searchsorted(paths_sorted, prefix + "\U0010ffff", side="left")
+        return np.sort(order[lo:hi])
+
+    def _time_index(self) -> tuple:
+        if self._times is None:
+            epoch_seconds = getattr(self._metadata, "epoch_seconds", None)
+            if epoch_seconds is not None:
+                times = epoch_seconds()
+                # 欄式以外的時間（如帶時區）存在 extra，逐列補上
+                for row in np.flatnonzero(np.isnan(times)).tolist():
+                    times[row] = to_epoch(self._metadata[row].get("indexed_at"))
+            else:
+                times = np.asarray([to_epoch(t) for t in _column(self._metadata, "indexed_at")], dtype=np.float64)
+            order = np.argsort(times, kind="stable").astype(np.int64)  # NaN 排在最後
+            self._times = (order, times[order])
+        return self._times
+
+    def time_range(self, after: TimeValue = None, before: TimeValue = None) -> np.ndarray:
+        order, times_sorted = self._time_index()
+        lo = 0 if after is None else np.searchsorted(times_sorted, to_epoch(after), side="left")
+        valid = len(times_sorted) - int(np.isnan(times_sorted).sum())
+        hi = valid if before is None else min(valid, np.searchsorted(times_sorted, to_epoch(before), side="left"))
+        return np.sort(order[lo:hi])
+
+    def _value_index(self, key: str) -> Dict[Any, np.ndarray]:
+        index = self._values.get(key)
+        if index is None:
+            lists: Dict[Any, List[int]] = {}
+            for row, value in enumerate(_column(self._metadata, key)):
+                if value is not None:
+                    lists.setdefault(_key(value), []).append(row)
+            index = {value: np.asarray(rows, dtype=np.int64) for value, rows in lists.items()}
+            self._values[key] = index
+        return index
+
+    def equals(self, key: str, value: Any) -> np.ndarray:
+        index = self._value_index(key)
+        values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+        parts = [index.get(_key(v)) for v in values]
+        parts = [p for p in parts if p is not None]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+
+    def select(self, flt: MetadataFilter) -> np.ndarray:
+        """符合所有條件的 local 列號（遞增）"""
+        rows: Optional[np.ndarray] = None
+
+        def narrow(found: np.ndarray):
+            nonlocal rows
+            rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+
+        if flt.path_prefix:
+            narrow(self.path_prefix(flt.path_prefix))
+        if flt.indexed_after is not None or flt.indexed_before is not None:
+            narrow(self.time_range(flt.indexed_after, flt.indexed_before))
+        for key, value in flt.where.items():
+            if rows is not None and not len(rows):
+                break
+            narrow(self.equals(key, value))
+        return np.arange(len(self), dtype=np.int64) if rows is None else rows
+
+
+def select_rows(parts: Iterable, flt: MetadataFilter) -> np.ndarray:
+    """parts 為 (全域起始列, SegmentMetadataIndex)，回傳符合條件的全域列號（遞增）"""
+    found = [index.select(flt) + start for start, index in parts]
+    return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
@@ -0,0 +1,178 @@
+"""
+caption 前的近似重複圖片偵測
+
+以感知雜湊（dHash 或 pHash，64 bit）表示每張圖片，漢明距離 <= max_distance 視為近似重複。
+分組時依序處理：與既有代表圖距離夠近就掛在該代表之下，否則自己成為新的代表；
+只比對代表圖，不會因為 A≈B、B≈C 而把差異較大的 A、C 串成一組。
+
+查詢使用 multi-index hashing：64 bit 切成 max_distance + 1 段，依鴿籠原理，距離不超過
+max_distance 的兩個雜湊至少有一段完全相同，因此只需比對任一段相同的候選。
+"""
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from src.image_preprocess import ignore_sigint
+from src.utils import load_image
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+HASH_BITS = 64
+DEFAULT_MAX_DISTANCE = 4
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(img: "Image.Image", size: int = 8) -> int:
+    """difference hash：縮成 (size+1)×size 灰階，比較左右相鄰像素"""
+    from PIL import Image
+    gray = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+_DCT_CACHE: Dict[int, np.ndarray] = {}
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    mat = _DCT_CACHE.get(n)
+    if mat is None:
+        k = np.arange(n)[:, None]
+        i = np.arange(n)[None, :]
+        mat = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+        mat[0] /= np.sqrt(2.0)
+        _DCT_CACHE[n] = mat
+    return mat
+
+
+def phash(img: "Image.Image", size: int = 8, scale: int = 4) -> int:
+    """perceptual hash：32×32 灰階做 2D DCT，取左上 8×8 低頻係數與中位數比較"""
+    from PIL import Image
+    n = size * scale
+    gray = np.asarray(img.convert("L").resize((n, n), Image.LANCZOS), dtype=np.float64)
+    dct = _dct_matrix(n)
+    low = (dct @ gray @ dct.T)[:size, :size]
+    # 不含 DC 項計算中位數，避免整體亮度主導
+    median = np.median(low.ravel()[1:])
+    return _bits_to_int(low > median)
+
+
+_HASHERS = {"dhash": dhash, "phash": phash}
+
+
+def hash_image(args: Tuple[str, str]) -> Optional[int]:
+    image_path, method = args
+    try:
+        with load_image(image_path) as img:
+            return _HASHERS[method](img)
+    except Exception as e:
+        logging.warning(f"無法計算感知雜湊 {image_path}: {e}")
+        return None
+
+
+def compute_hashes(image_paths: List[str], method: str = "dhash", workers: int = 0) -> List[Optional[int]]:
+    """以 process pool 計算每張圖片的雜湊；無法讀取的圖片為 None（視為不重複）"""
+    if method not in _HASHERS:
+        raise ValueError(f"未知的感知雜湊方法: {method}（可用: {', '.join(_HASHERS)}）")
+    if not image_paths:
+        return []
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(image_paths) < 64:
+        return [hash_image((p, method)) for p in image_paths]
+    with ProcessPoolExecutor(max_workers=workers, initializer=ignore_sigint) as pool:
+        chunksize = max(1, len(image_paths) // (workers * 8))
+        return list(pool.map(hash_image, [(p, method) for p in image_paths], chunksize=chunksize))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class HammingIndex:
+    """multi-index hashing：max_distance + 1 個 band 各自一個 dict，查詢只比對 band 相同的候選"""
+
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.max_distance = max_distance
+        n_bands = min(max_distance + 1, HASH_BITS)
+        bounds = np.linspace(0, HASH_BITS, n_bands + 1).astype(int)
+        self._bands = [(int(lo), int(hi - lo)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        self._tables: List[Dict[int, List[int]]] = [defaultdict(list) for _ in self._bands]
+        self._hashes: List[int] = []
+
+    def _keys(self, h: int):
+        for shift, width in self._bands:
+            yield (h >> shift) & ((1 << width) - 1)
+
+    def add(self, h: int) -> int:
+        idx = len(self._hashes)
+        self._hashes.append(h)
+        for table, key in zip(self._tables, self._keys(h)):
+            table[key].append(idx)
+        return idx
+
+    def nearest(self, h: int) -> Optional[Tuple[int, int]]:
+        """回傳距離 <= max_distance 中最近的 (索引, 距離)，沒有則為 None"""
+        best = None
+        seen = set()
+        for table, key in zip(self._tables, self._keys(h)):
+            for idx in table.get(key, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                d = hamming(h, self._hashes[idx])
+                if d <= self.max_distance and (best is None or d < best[1]):
+                    best = (idx, d)
+        return best
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+
+@dataclass
+class DuplicateGroups:
+    representatives: List[str] = field(default_factory=list)
+    # 代表圖 -> 掛在其下的近似重複圖片
+    members: Dict[str, List[str]] = field(default_factory=dict)
+
+    @property
+    def duplicate_count(self) -> int:
+        return sum(len(v) for v in self.members.values())
+
+
+def group_near_duplicates(
+    image_paths: Iterable[str],
+    method: str = "dhash",
+    max_distance: int = DEFAULT_MAX_DISTANCE,
+    workers: int = 0,
+) -> DuplicateGroups:
+    """依輸入順序分組，每組第一張為代表圖"""
+    image_paths = list(image_paths)
+    hashes = compute_hashes(image_paths, method, workers)
+    index = HammingIndex(max_distance)
+    rep_paths: List[str] = []
+    groups = DuplicateGroups()
+    for path, h in zip(image_paths, hashes):
+        match = index.nearest(h) if h is not None else None
+        if match is None:
+            groups.representatives.append(path)
+            if h is not None:
+                index.add(h)
+                rep_paths.append(path)
+            continue
+        groups.members.setdefault(rep_paths[match[0]], []).append(path)
+    logging.info(
+        f"近似重複偵測（{method}, 距離 <= {max_distance}）：{len(image_paths)} 張中 "
+        f"{groups.duplicate_count} 張連結到 {len(groups.members)} 張代表圖"
+    )
+    return groups
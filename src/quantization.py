@@ -0,0 +1,223 @@
+"""
+向量量化 codec：int8 scalar quantization（SQ8）與 product quantization（PQ）
+
+兩者都以非對稱距離（ADC）計分：query 維持 float32，只有資料庫端為壓縮碼，
+因此查詢時不需解壓整個矩陣。量化碼是額外的衍生索引，不取代原始向量：
+各 segment 仍保留 float32 向量（mmap），供 SimpleVectorDB 的 rescore 對前幾名候選
+重新精確計分，磁碟用量因此是原本加上量化碼，而非縮小為量化碼的大小。
+
+codec 只以抽樣訓練（train 只估計模型參數），各列的量化碼由呼叫端逐區塊 encode。
+
+1024 維 float32 每筆 4 KB：SQ8 為 1 KB（4x），PQ(m=128) 為 128 bytes（32x）。
+"""
+import logging
+from typing import Dict, Optional
+
+import numpy as np
+
+MANIFEST_KEY = "quantizer"
+RETRAIN_GROWTH = 4.0
+SQ8_MIN_TRAIN_ROWS = 1000  # 逐維 min/max 需要足夠樣本，否則之後的資料大量被截斷
+PQ_MIN_TRAIN_ROWS = 1000
+SQ8_SAMPLE_ROWS = 262144
+PQ_SAMPLE_ROWS = 65536
+_CHUNK = 65536
+_SQ8_SCORE_BLOCK_BYTES = 1 << 20  # SQ8 計分時每次轉成 float32 的暫存大小
+
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    """歐氏距離 k-means（Lloyd），回傳 (k, d) 中心"""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(x.shape[0], size=k, replace=False)].copy()
+    for _ in range(iters):
+        # argmin ||x - c||^2 == argmax (x·c - ||c||^2 / 2)
+        assign = np.argmax(x @ centroids.T - 0.5 * np.sum(centroids ** 2, axis=1), axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = x[rng.choice(x.shape[0], size=int(empty.sum()))]
+            counts[empty] = 1
+        centroids = sums / counts[:, None]
+    return centroids.astype(np.float32)
+
+
+def _sample(vectors: np.ndarray, max_rows: int, seed: int = 0) -> np.ndarray:
+    n = vectors.shape[0]
+    if n <= max_rows:
+        return np.asarray(vectors, dtype=np.float32)
+    idx = np.sort(np.random.default_rng(seed).choice(n, size=max_rows, replace=False))
+    return np.asarray(vectors[idx], dtype=np.float32)
+
+
+class _Quantizer:
+    """共用部分：codes 為每列一筆、依全域列序排列"""
+
+    kind = ""
+
+    def __init__(self, codes: Optional[np.ndarray] = None, trained_rows: int = 0):
+        self._codes = codes
+        self.trained_rows = trained_rows
+
+    @property
+    def row_data(self) -> np.ndarray:
+        return self._codes
+
+    def __len__(self) -> int:
+        return 0 if self._codes is None else len(self._codes)
+
+    def extend(self, codes: np.ndarray):
+        codes = np.asarray(codes)
+        self._codes = codes if self._codes is None else np.concatenate([self._codes, codes])
+
+    def needs_retrain(self, n: int) -> bool:
+        return n > self.trained_rows * RETRAIN_GROWTH
+
+    def model_info(self) -> Dict:
+        return {"kind": self.kind, "trained_rows": self.trained_rows}
+
+    def score(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """ADC 近似內積；rows 為 None 時對全部列計分"""
+        n = len(self) if rows is None else len(rows)
+        out = np.empty(n, dtype=np.float32)
+        for start in range(0, n, _CHUNK):
+            sel = slice(start, start + _CHUNK)
+            codes = self._codes[sel] if rows is None else self._codes[rows[sel]]
+            out[sel] = self._score_codes(query, codes)
+        return out
+
+    def _score_codes(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class ScalarQuantizer(_Quantizer):
+    """
+    逐維 min/max 線性量化為 int8。
+    只用於 ADC 粗排：float32 原始向量仍留在各 segment 供 rescore，並未被量化碼取代。
+    """
+
+    kind = "sq8"
+
+    def __init__(self, vmin: np.ndarray, scale: np.ndarray, codes=None, trained_rows: int = 0):
+        super().__init__(codes, trained_rows)
+        self.vmin = np.asarray(vmin, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def train(cls, sample: np.ndarray, trained_rows: int = 0) -> "ScalarQuantizer":
+        sample = _sample(sample, SQ8_SAMPLE_ROWS)
+        vmin = sample.min(axis=0)
+        scale = (sample.max(axis=0) - vmin) / 255.0
+        scale[scale == 0] = 1.0
+        return cls(vmin, scale, trained_rows=trained_rows or sample.shape[0])
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        out = np.empty(vectors.shape, dtype=np.int8)
+        for start in range(0, vectors.shape[0], _CHUNK):
+            block = np.asarray(vectors[start:start + _CHUNK], dtype=np.float32)
+            levels = np.clip(np.rint((block - self.vmin) / self.scale), 0, 255)
+            out[start:start + _CHUNK] = (levels - 128).astype(np.int8)
+        return out
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return (codes.astype(np.float32) + 128.0) * self.scale + self.vmin
+
+    def _score_codes(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # q·x̂ = (q*scale)·code + q·(vmin + 128*scale)
+        # codes 逐小區塊轉為 float32 後相乘，暫存固定為 _SQ8_SCORE_BLOCK_BYTES，
+        # 不會產生整個 chunk 4 倍大小的 float32 副本
+        qs = (query * self.scale).astype(np.float32)
+        n, dim = codes.shape
+        out = np.empty(n, dtype=np.float32)
+        step = max(64, _SQ8_SCORE_BLOCK_BYTES // (4 * dim))
+        buf = np.empty((min(step, n), dim), dtype=np.float32)
+        for start in range(0, n, step):
+            block = codes[start:start + step]
+            tmp = buf[:block.shape[0]]
+            np.copyto(tmp, block)
+            np.dot(tmp, qs, out=out[start:start + block.shape[0]])
+        out += float(query @ (self.vmin + 128.0 * self.scale))
+        return out
+
+    def model_arrays(self) -> Dict[str, np.ndarray]:
+        return {"vmin": self.vmin, "scale": self.scale}
+
+
+class ProductQuantizer(_Quantizer):
+    """切成 m 個子空間，每個子空間以 256 個中心編碼為 1 byte"""
+
+    kind = "pq"
+
+    def __init__(self, codebooks: np.ndarray, codes=None, trained_rows: int = 0):
+        super().__init__(codes, trained_rows)
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)  # (m, ks, dsub)
+
+    @property
+    def m(self) -> int:
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def train(cls, sample: np.ndarray, m: int, trained_rows: int = 0) -> "ProductQuantizer":
+        n, dim = sample.shape
+        if dim % m:
+            raise ValueError(f"PQ 子空間數 {m} 必須整除向量維度 {dim}")
+        ks = min(256, n)
+        sample = _sample(sample, PQ_SAMPLE_ROWS)
+        dsub = dim // m
+        logging.info(f"PQ 訓練: {sample.shape[0]} 筆樣本, m={m}, ks={ks}")
+        codebooks = np.stack([
+            _kmeans(sample[:, j * dsub:(j + 1) * dsub], ks, seed=j) for j in range(m)
+        ])
+        return cls(codebooks, trained_rows=trained_rows or n)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        m, _, dsub = self.codebooks.shape
+        out = np.empty((vectors.shape[0], m), dtype=np.uint8)
+        half_norms = 0.5 * np.sum(self.codebooks ** 2, axis=2)
+        for start in range(0, vectors.shape[0], _CHUNK):
+            block = np.asarray(vectors[start:start + _CHUNK], dtype=np.float32)
+            for j in range(m):
+                sub = block[:, j * dsub:(j + 1) * dsub]
+                out[start:start + _CHUNK, j] = np.argmax(sub @ self.codebooks[j].T - half_norms[j], axis=1)
+        return out
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def _score_codes(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # 查表：lut[j, k] = q_j · codebook_j[k]，分數為各子空間查表值的總和
+        dsub = self.codebooks.shape[2]
+        lut = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.m, dsub))
+        return lut[np.arange(self.m), codes].sum(axis=1)
+
+    def model_arrays(self) -> Dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks}
+
+
+def train_quantizer(kind: str, sample: np.ndarray, pq_m: int = 128, trained_rows: int = 0) -> _Quantizer:
+    """以抽樣訓練 codec（尚無任何列的 codes）；trained_rows 為抽樣來源的總列數，供 needs_retrain 判斷"""
+    if kind == "sq8":
+        return ScalarQuantizer.train(sample, trained_rows)
+    if kind == "pq":
+        return ProductQuantizer.train(sample, pq_m, trained_rows)
+    raise ValueError("quantization 必須為 'none'、'sq8' 或 'pq'")
+
+
+def min_train_rows(kind: str) -> int:
+    return PQ_MIN_TRAIN_ROWS if kind == "pq" else SQ8_MIN_TRAIN_ROWS
+
+
+def train_sample_rows(kind: str) -> int:
+    """訓練時最多需要的樣本列數"""
+    return PQ_SAMPLE_ROWS if kind == "pq" else SQ8_SAMPLE_ROWS
+
+
+def from_model(arrays: Dict[str, np.ndarray], info: Dict) -> _Quantizer:
+    """由持久化的模型陣列還原 codec（codes 另外逐 segment 載入）"""
+    trained_rows = info.get("trained_rows", 0)
+    if info.get("kind") == "sq8":
+        return ScalarQuantizer(arrays["vmin"], arrays["scale"], trained_rows=trained_rows)
+    if info.get("kind") == "pq":
+        return ProductQuantizer(arrays["codebooks"], trained_rows=trained_rows)
+    raise ValueError(f"未知的量化格式: {info.get('kind')}")
@@ -1,82 +1,998 @@
 import logging
 from typing import List, Dict, Optional
 from datetime import datetime
-from src.utils import dynamic_import
+from src import embedding_cache
+from src import embedding_registry
+from src import index_format
+from src import ann_index
+from src import quantization
+from src import lexical_index
+from src import metadata_index
+from src.metadata_index import MetadataFilter
 import pickle
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # 新增: 向量庫 minimal 實作
 import numpy as np
 
+
+def get_vector_db_path(chroma_db_dir: str, collection_name: str) -> str:
+    """manual 模式向量庫的目錄路徑（版本化 mmap 格式）"""
+    return os.path.join(chroma_db_dir, f"{collection_name}_vectors")
+
+
+_SEARCH_POOLS: Dict[int, ThreadPoolExecutor] = {}
+_SEARCH_POOLS_LOCK = threading.Lock()
+
+
+def _get_search_pool(threads: int) -> ThreadPoolExecutor:
+    """同一行程共用的查詢 thread pool（依執行緒數各一個）"""
+    with _SEARCH_POOLS_LOCK:
+        pool = _SEARCH_POOLS.get(threads)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="vector-search")
+            _SEARCH_POOLS[threads] = pool
+        return pool
+
+
+def _path_key(image_path: str) -> str:
+    """向量庫中每列的識別鍵：絕對 image_path（與檔案清單、journal 的比對方式相同）"""
+    return os.path.abspath(image_path)
+
+
+def get_legacy_vector_db_path(chroma_db_dir: str, collection_name: str) -> str:
+    """舊版 pickle 向量庫路徑，僅供讀取遷移"""
+    return os.path.join(chroma_db_dir, f"{collection_name}_vectors.pkl")
+
+
 class SimpleVectorDB:
-    def __init__(self):
-        self.vectors = []
-        self.metadata = []
-        self.embedder = None  # 用於查詢時動態載入
+    """
+    minimal 向量庫：已持久化的資料為不可變、mmap 開啟的 segment，
+    尚未儲存的新增資料放在可成長的 float32 tail 矩陣；所有向量皆已 L2 正規化。
+
+    可另外掛上「衍生索引」（IVF 分群、量化碼）：模型存於根目錄，
+    每列的衍生資料隨各 segment 存放，因此追加 segment 時只需寫入新列的部分。
+
+    每列以 image_path（絕對路徑）識別：add_many 為 upsert，舊列與刪除的列一樣只標記為 tombstone
+    （全域列號存於根目錄 tombstones.vN.npy），計分時排除；tombstone 比例超過
+    tombstone_ratio 時由 maybe_compact 重寫為只含存活列的資料。
+    image_id（檔名主幹）不保證唯一：x.jpg 與 x.png 是兩筆不同的資料。
+
+    lexical=True 時每個寫入的 segment 另存 caption 的 BM25 倒排表（lexical_index），
+    供不需 embedding 的關鍵字查詢；缺少倒排表的 segment 查詢時於記憶體中建立。
+    """
+
+    _INITIAL_CAPACITY = 1024
+    DEFAULT_SMALL_SEGMENT_ROWS = 4096
+    DEFAULT_RESCORE_K = 100
+    DEFAULT_TOMBSTONE_RATIO = 0.2
+    TOMBSTONES_KEY = "tombstones"
+    # manifest key -> 由持久化模型還原的函式
+    _DERIVED_LOADERS = {
+        ann_index.IVFIndex.MANIFEST_KEY: ann_index.IVFIndex.from_model,
+        quantization.MANIFEST_KEY: quantization.from_model,
+    }
+
+    def __init__(self, embedding_model: Optional[str] = None):
+        self._segments: List[index_format.Segment] = []
+        self._segment_rows = 0
+        self._tail = None  # (capacity, dim) float32，尚未寫入磁碟的列
+        self._tail_size = 0
+        self.metadata = index_format.MetadataStore()
+        self.embedder = None  # 指定時優先使用，否則每次由 embedding_registry 取得共用 model
+        self.embedding_model = embedding_model  # None 表示使用 Config.EMBEDDING_MODEL
+        self.embedding_backend = embedding_registry.BACKEND_SENTENCE_TRANSFORMERS  # server 模式改為 BACKEND_SERVER
+        self._path = None  # 綁定的 segment 目錄（load 或第一次 save 後）
+        self._manifest = None
+        self._derived = {}  # manifest key -> IVFIndex / 量化 codec
+        self._derived_pending = set()  # 磁碟上有、但尚未載入的衍生索引（延遲到第一次需要時）
+        self.search_engine = "exact"  # "exact" 或 "ivf"
+        self.search_threads = 1  # 精確搜尋的執行緒數，0 表示 CPU 核心數
+        self.nprobe = ann_index.DEFAULT_NPROBE
+        self.use_quantizer = False  # True 時以量化碼做 ADC 計分
+        self.rescore_k = self.DEFAULT_RESCORE_K  # ADC 後以原始向量重新計分的候選數，0 表示不重算
+        self.tombstone_ratio = self.DEFAULT_TOMBSTONE_RATIO  # 超過此比例的列被刪除時重寫資料
+        self._tombstones = set()  # 已刪除（或被 upsert 取代）的全域列號
+        self._tombstones_dirty = False  # 記憶體中的 tombstone 尚未落盤
+        self._dead_cache = None  # (count, bool mask)，計分時排除 tombstone
+        self._path_rows = None  # 絕對 image_path -> 存活列號，第一次需要時才建立
+        self.lexical = False  # 寫入 segment 時一併建立 BM25 倒排表
+        self._lexical_parts = {}  # segment 名稱 -> LexicalSegment（segment 不可變，可一直沿用）
+        self._lexical_tail = None  # (tail 筆數, LexicalSegment)
+        self._meta_indexes = {}  # segment 名稱 -> SegmentMetadataIndex（查詢過濾用，第一次需要時建立）
+        self._meta_index_tail = None  # (tail 筆數, SegmentMetadataIndex)
+
+    @property
+    def dim(self) -> Optional[int]:
+        if self._segments:
+            return self._segments[0].vectors.shape[1]
+        return None if self._tail is None else self._tail.shape[1]
+
+    def _blocks(self) -> List[np.ndarray]:
+        """依全域列序排列的向量區塊：各 segment（mmap）+ tail"""
+        blocks = [seg.vectors for seg in self._segments]
+        if self._tail_size:
+            blocks.append(self._tail[:self._tail_size])
+        return blocks
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """所有向量；只有單一區塊時為 view，否則會串接複製"""
+        blocks = self._blocks()
+        if not blocks:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        if len(blocks) == 1:
+            return blocks[0]
+        return np.concatenate(blocks)
+
+    @staticmethod
+    def _normalize(mat: np.ndarray) -> np.ndarray:
+        mat = np.asarray(mat, dtype=np.float32)
+        norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return mat / norms
+
+    def _reserve(self, extra: int, dim: int):
+        """確保 tail 容量足以再放入 extra 列，不足時以倍數成長"""
+        if self.dim is not None and self.dim != dim:
+            raise ValueError(f"向量維度不符: 預期 {self.dim}，收到 {dim}")
+        if self._tail is None:
+            capacity = max(self._INITIAL_CAPACITY, extra)
+            self._tail = np.empty((capacity, dim), dtype=np.float32)
+            return
+        needed = self._tail_size + extra
+        if needed <= self._tail.shape[0]:
+            return
+        capacity = max(needed, self._tail.shape[0] * 2)
+        grown = np.empty((capacity, dim), dtype=np.float32)
+        grown[:self._tail_size] = self._tail[:self._tail_size]
+        self._tail = grown
 
     def add(self, vector, meta):
-        self.vectors.append(vector)
-        self.metadata.append(meta)
+        self.add_many([vector], [meta])
+
+    def add_many(self, vectors, metas: List[Dict]):
+        """追加或取代（upsert）：相同 image_path 已存在時舊列標記為 tombstone"""
+        mat = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if mat.shape[0] != len(metas):
+            raise ValueError("vectors 與 metas 數量不一致")
+        if mat.shape[0] == 0:
+            return
+        path_rows = self._path_index()
+        self._reserve(mat.shape[0], mat.shape[1])
+        normalized = self._normalize(mat)
+        start = self.count()
+        self._tail[self._tail_size:self._tail_size + mat.shape[0]] = normalized
+        self._tail_size += mat.shape[0]
+        self.metadata.extend(metas)
+        for derived in self._derived.values():
+            derived.extend(derived.encode(normalized))
+        for row, meta in enumerate(metas, start):
+            key = _path_key(meta.get("image_path"))
+            old = path_rows.get(key)
+            if old is not None:
+                self._tombstone(old)
+            path_rows[key] = row
 
     def count(self):
-        return len(self.vectors)
+        """實體列數（含 tombstone）"""
+        return self._segment_rows + self._tail_size
+
+    def live_count(self) -> int:
+        return self.count() - len(self._tombstones)
+
+    def live_rows(self) -> np.ndarray:
+        """存活列的全域列號（遞增）"""
+        dead = self._dead_mask()
+        rows = np.arange(self.count(), dtype=np.int64)
+        return rows if dead is None else rows[~dead]
+
+    def live_metadata(self):
+        """依列序逐筆輸出存活列的 metadata"""
+        for row in self.live_rows():
+            yield self.metadata[int(row)]
 
     def all(self):
-        return list(zip(self.vectors, self.metadata))
+        return [(self.vectors[row], self.metadata[int(row)]) for row in self.live_rows()]
+
+    # ---- image_path 索引與 tombstone ----
+
+    def _path_index(self) -> Dict[str, int]:
+        """
+        絕對 image_path -> 存活列號；第一次使用時掃描 metadata 建立，之後隨 add / delete 維護。
+        舊資料中重複的 image_path 只保留最後一列，較早的列標記為 tombstone。
+        """
+        if self._path_rows is None:
+            path_rows = {}
+            # 只讀 image_path 欄，不組裝每列的 dict
+            for row, image_path in enumerate(self.metadata.column("image_path")):
+                if row in self._tombstones:
+                    continue
+                key = _path_key(image_path)
+                old = path_rows.get(key)
+                if old is not None:
+                    self._tombstone(old)
+                path_rows[key] = row
+            self._path_rows = path_rows
+        return self._path_rows
+
+    def get_row(self, image_path: str) -> Optional[int]:
+        return self._path_index().get(_path_key(image_path))
+
+    def _tombstone(self, row: int):
+        self._tombstones.add(row)
+        self._tombstones_dirty = True
+        self._dead_cache = None
+
+    def _dead_mask(self) -> Optional[np.ndarray]:
+        """tombstone 的 bool mask（長度為 count）；沒有 tombstone 時為 None"""
+        if not self._tombstones:
+            return None
+        n = self.count()
+        if self._dead_cache is None or self._dead_cache[0] != n:
+            mask = np.zeros(n, dtype=bool)
+            mask[np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones))] = True
+            self._dead_cache = (n, mask)
+        return self._dead_cache[1]
+
+    def _tombstones_file(self, version: int) -> str:
+        return f"{self.TOMBSTONES_KEY}.v{version}.npy"
+
+    def _write_tombstones(self, path: str, manifest: Dict, previous: Optional[Dict] = None) -> Dict:
+        """把已落盤列的 tombstone 寫成新版本檔案，回傳更新後的 manifest（尚未寫入）"""
+        manifest = dict(manifest)
+        persisted = sorted(r for r in self._tombstones if r < sum(s["count"] for s in manifest["segments"]))
+        if not persisted:
+            manifest.pop(self.TOMBSTONES_KEY, None)
+            return manifest
+        version = ((previous or manifest).get(self.TOMBSTONES_KEY) or {}).get("version", 0) + 1
+        index_format.write_array(path, self._tombstones_file(version), np.asarray(persisted, dtype=np.int64))
+        manifest[self.TOMBSTONES_KEY] = {"version": version, "count": len(persisted)}
+        return manifest
+
+    def _load_tombstones(self, path: str, manifest: Dict):
+        self._tombstones = set()
+        self._tombstones_dirty = False
+        self._dead_cache = None
+        self._path_rows = None
+        info = manifest.get(self.TOMBSTONES_KEY)
+        if info:
+            rows = index_format.load_array(path, self._tombstones_file(info["version"]), mmap_mode=None)
+            if rows is not None:
+                self._tombstones = set(rows.tolist())
+
+    def _flush_tombstones(self):
+        """已綁定目錄時把 tombstone 落盤（manifest 原子替換後刪除舊版本檔）"""
+        if self._path is None or not self._tombstones_dirty:
+            return
+        manifest = self._write_tombstones(self._path, self._manifest)
+        index_format.write_manifest(self._path, manifest)
+        self._manifest = manifest
+        info = manifest.get(self.TOMBSTONES_KEY)
+        index_format.remove_stale(
+            self._path, f"{self.TOMBSTONES_KEY}.v", self._tombstones_file(info["version"]) if info else None
+        )
+        # tail 中的 tombstone 要等 tail 寫成 segment 後才能落盤
+        self._tombstones_dirty = any(r >= self._segment_rows for r in self._tombstones)
+
+    def delete(self, image_paths) -> int:
+        """以 tombstone 刪除指定 image_path（O(1)），已綁定目錄時立即落盤；回傳刪除筆數"""
+        path_rows = self._path_index()
+        removed = 0
+        for key in {_path_key(p) for p in image_paths}:
+            row = path_rows.pop(key, None)
+            if row is not None:
+                self._tombstone(row)
+                removed += 1
+        if removed:
+            self._flush_tombstones()
+            logging.info(f"已刪除 {removed} 筆向量（tombstone {len(self._tombstones)}/{self.count()}）")
+        return removed
+
+    def remove_paths(self, image_paths) -> int:
+        """刪除並在 tombstone 比例過高時立即重寫"""
+        removed = self.delete(image_paths)
+        if removed:
+            self.maybe_purge()
+        return removed
+
+    def segment_count(self) -> int:
+        return len(self._segments)
+
+    def _attach(self, path: str, manifest: Dict):
+        """綁定到 segment 目錄並以 mmap 開啟 manifest 列出的所有 segment"""
+        self._path = os.path.abspath(path)
+        self._manifest = manifest
+        self._segments = []
+        self._segment_rows = 0
+        self.metadata = index_format.MetadataStore()
+        for entry in manifest["segments"]:
+            seg = index_format.open_segment(path, entry["name"])
+            self._segments.append(seg)
+            self._segment_rows += seg.count
+            self.metadata.add_base(seg.metadata)
+        self._derived = {}
+        self._derived_pending = {key for key in self._DERIVED_LOADERS if manifest.get(key)}
+        self._load_tombstones(path, manifest)
+        self.lexical = self.lexical or bool(manifest.get("lexical"))
+        live = {seg.name for seg in self._segments}
+        self._lexical_parts = {k: v for k, v in self._lexical_parts.items() if k in live}
+        self._lexical_tail = None
+        self._meta_indexes = {k: v for k, v in self._meta_indexes.items() if k in live}
+        self._meta_index_tail = None
+
+    def _segment_dir(self, name: str) -> str:
+        return os.path.join(self._path, name)
+
+    @staticmethod
+    def _model_file(key: str, version: int) -> str:
+        return f"{key}.v{version}.npz"
+
+    @staticmethod
+    def _rows_file(key: str, version: int) -> str:
+        return f"{key}.v{version}.npy"
+
+    # ---- 衍生索引（IVF、量化碼） ----
+
+    def _ensure_derived(self, key: Optional[str] = None):
+        """載入磁碟上的衍生索引；缺少逐列檔的 segment 以現有模型即時計算"""
+        for k in [key] if key else list(self._derived_pending):
+            if k not in self._derived_pending:
+                continue
+            self._derived_pending.discard(k)
+            info = self._manifest[k]
+            model_path = os.path.join(self._path, self._model_file(k, info["version"]))
+            if not os.path.isfile(model_path):
+                logging.warning(f"找不到衍生索引模型檔 {model_path}，略過 {k}")
+                continue
+            with np.load(model_path) as arrays:
+                derived = self._DERIVED_LOADERS[k](dict(arrays), info)
+            fname = self._rows_file(k, info["version"])
+            for seg in self._segments:
+                rows = index_format.load_array(self._segment_dir(seg.name), fname)
+                if rows is None or len(rows) != seg.count:
+                    rows = derived.encode(seg.vectors)
+                derived.extend(rows)
+            if self._tail_size:
+                derived.extend(derived.encode(self._tail[:self._tail_size]))
+            self._derived[k] = derived
+
+    def _get_derived(self, key: str):
+        self._ensure_derived(key)
+        return self._derived.get(key)
+
+    @property
+    def ann(self) -> Optional[ann_index.IVFIndex]:
+        return self._get_derived(ann_index.IVFIndex.MANIFEST_KEY)
+
+    @property
+    def quantizer(self):
+        return self._get_derived(quantization.MANIFEST_KEY)
+
+    def _set_derived(self, key: str, derived):
+        """掛上新訓練的衍生索引；已綁定目錄時一併持久化（模型與各 segment 的逐列資料）"""
+        self._derived_pending.discard(key)
+        self._derived[key] = derived
+        if self._path is None:
+            return
+        manifest = dict(self._manifest)
+        version = (manifest.get(key) or {}).get("version", 0) + 1
+        self._write_derived_model(self._path, key, version, derived)
+        start = 0
+        for seg in self._segments:
+            index_format.write_array(
+                self._segment_dir(seg.name), self._rows_file(key, version),
+                derived.row_data[start:start + seg.count],
+            )
+            start += seg.count
+        manifest[key] = dict(derived.model_info(), version=version)
+        index_format.write_manifest(self._path, manifest)
+        self._manifest = manifest
+        self._remove_stale_derived()
+
+    def _write_derived_model(self, path: str, key: str, version: int, derived):
+        tmp = os.path.join(path, self._model_file(key, version) + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **derived.model_arrays())
+        os.replace(tmp, os.path.join(path, self._model_file(key, version)))
+
+    def _write_segment_derived(self, name: str, start: int, count: int):
+        """新寫入（或合併產生）的 segment 附上各衍生索引對應列的資料"""
+        for key in self._DERIVED_LOADERS:
+            info = self._manifest.get(key)
+            derived = self._get_derived(key) if info else None
+            if derived is not None:
+                index_format.write_array(
+                    self._segment_dir(name), self._rows_file(key, info["version"]),
+                    derived.row_data[start:start + count],
+                )
+
+    def _write_segment_lexical(self, path: str, name: str, captions, manifest: Dict):
+        """lexical 啟用時為新 segment 建立 BM25 倒排表，並在 manifest 記錄"""
+        if not self.lexical:
+            return
+        part = lexical_index.LexicalSegment.build(captions)
+        part.save(os.path.join(path, name))
+        self._lexical_parts[name] = part
+        manifest["lexical"] = True
+
+    def _lexical_segment(self, seg: index_format.Segment) -> lexical_index.LexicalSegment:
+        part = self._lexical_parts.get(seg.name)
+        if part is None:
+            part = lexical_index.LexicalSegment.load(self._segment_dir(seg.name))
+            if part is None:
+                # 舊 segment 沒有倒排表：只在記憶體中建立，不修改既有目錄
+                part = lexical_index.LexicalSegment.build(seg.metadata.column("caption"))
+            self._lexical_parts[seg.name] = part
+        return part
+
+    def _remove_stale_derived(self):
+        for key in self._DERIVED_LOADERS:
+            info = self._manifest.get(key)
+            if not info:
+                continue
+            index_format.remove_stale(self._path, f"{key}.v", self._model_file(key, info["version"]))
+            keep = self._rows_file(key, info["version"])
+            for seg in self._segments:
+                index_format.remove_stale(self._segment_dir(seg.name), f"{key}.v", keep)
+
+    def _training_sample(self, max_rows: int, seed: int = 0) -> np.ndarray:
+        """自存活列均勻抽樣最多 max_rows 筆訓練資料，逐 segment 只讀出被抽到的列（不串接整個 corpus）"""
+        rows = self.live_rows()
+        if len(rows) > max_rows:
+            rows = np.sort(np.random.default_rng(seed).choice(rows, size=max_rows, replace=False))
+        parts, start = [], 0
+        for block in self._blocks():
+            end = start + len(block)
+            lo, hi = np.searchsorted(rows, [start, end])
+            if hi > lo:
+                parts.append(np.asarray(block[rows[lo:hi] - start], dtype=np.float32))
+            start = end
+        if not parts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.concatenate(parts)
+
+    def _encode_blocks(self, derived):
+        """逐區塊（segment / tail）計算全部列的衍生資料"""
+        for block in self._blocks():
+            derived.extend(derived.encode(block))
+        return derived
+
+    def build_ann(self, nlist: Optional[int] = None):
+        """以存活列的抽樣訓練 IVF，再逐 segment 歸入分群並持久化"""
+        n = self.count()
+        nlist = min(nlist or ann_index.default_nlist(n), n)
+        sample = self._training_sample(nlist * ann_index.SAMPLES_PER_LIST)
+        ivf = ann_index.IVFIndex.train(sample, nlist, trained_rows=n)
+        self._set_derived(ann_index.IVFIndex.MANIFEST_KEY, self._encode_blocks(ivf))
+
+    def update_ann(self, nlist: Optional[int] = None):
+        """資料足夠時建立 IVF，資料量成長過多時重新訓練；新增列已於 add_many 時歸入分群"""
+        n = self.count()
+        ann = self.ann
+        if (ann is None and n >= ann_index.MIN_TRAIN_ROWS) or (ann is not None and ann.needs_retrain(n)):
+            self.build_ann(nlist)
+
+    def build_quantizer(self, kind: str, pq_m: int = 128):
+        """
+        以存活列的抽樣訓練量化 codec（"sq8" 或 "pq"），再逐 segment 編碼並持久化。
+        量化碼只用於 ADC 粗排；float32 原始向量仍保留在各 segment，供 rescore 精確重算。
+        """
+        sample = self._training_sample(quantization.train_sample_rows(kind))
+        quantizer = quantization.train_quantizer(kind, sample, pq_m, trained_rows=self.count())
+        self._set_derived(quantization.MANIFEST_KEY, self._encode_blocks(quantizer))
+
+    def update_quantizer(self, kind: str, pq_m: int = 128):
+        """與 update_ann 相同策略；codec 種類改變時重新訓練"""
+        n = self.count()
+        quantizer = self.quantizer
+        if quantizer is None or quantizer.kind != kind:
+            if n >= quantization.min_train_rows(kind):
+                self.build_quantizer(kind, pq_m)
+        elif quantizer.needs_retrain(n):
+            self.build_quantizer(kind, pq_m)
+
+    # ---- 持久化 ----
 
     def save(self, path):
-        with open(path, "wb") as f:
-            pickle.dump({"vectors": self.vectors, "metadata": self.metadata}, f)
+        """
+        持久化：已綁定同一目錄時只把 tail 寫成新的 segment（成本與新增量成正比）；
+        否則（新路徑、舊版 pickle）把全部資料寫成單一 segment。
+        """
+        path = os.path.abspath(path)
+        if self._path != path:
+            self._export(path)
+            return
+        if self._tail_size == 0:
+            return
+        manifest = dict(self._manifest)
+        name = index_format.segment_name(manifest["next_segment"])
+        index_format.write_segment(
+            path, name, self._tail[:self._tail_size],
+            self.metadata.tail,
+        )
+        self._write_segment_derived(name, self._segment_rows, self._tail_size)
+        self._write_segment_lexical(path, name, (m.get("caption") for m in self.metadata.tail), manifest)
+        manifest["next_segment"] += 1
+        manifest["dim"] = self.dim
+        manifest["segments"] = manifest["segments"] + [{"name": name, "count": self._tail_size}]
+        index_format.write_manifest(path, manifest)
+        seg = index_format.open_segment(path, name)
+        self._manifest = manifest
+        self._segments.append(seg)
+        self._segment_rows += seg.count
+        self.metadata.seal_tail(seg.metadata)
+        self._tail = None
+        self._tail_size = 0
+        self._flush_tombstones()
+
+    def _export(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self._ensure_derived()
+        previous = index_format.read_manifest(path) or {}
+        manifest = index_format.new_manifest(self.dim or 0)
+        manifest["next_segment"] = previous.get("next_segment", 1)
+        if self.count():
+            name = index_format.segment_name(manifest["next_segment"])
+            index_format.write_segment(path, name, self.vectors, self.metadata)
+            self._write_segment_lexical(path, name, self.metadata.column("caption"), manifest)
+            manifest["next_segment"] += 1
+            manifest["segments"].append({"name": name, "count": self.count()})
+            for key, derived in self._derived.items():
+                version = (previous.get(key) or {}).get("version", 0) + 1
+                self._write_derived_model(path, key, version, derived)
+                index_format.write_array(os.path.join(path, name), self._rows_file(key, version), derived.row_data)
+                manifest[key] = dict(derived.model_info(), version=version)
+            # 列序不變，tombstone 原樣寫出
+            manifest = self._write_tombstones(path, manifest, previous)
+        index_format.write_manifest(path, manifest)
+        index_format.remove_orphans(path, manifest)
+        info = manifest.get(self.TOMBSTONES_KEY)
+        index_format.remove_stale(path, f"{self.TOMBSTONES_KEY}.v", self._tombstones_file(info["version"]) if info else None)
+        derived, path_rows = self._derived, self._path_rows
+        self._tail = None
+        self._tail_size = 0
+        self._attach(path, manifest)
+        self._remove_stale_derived()
+        self._derived, self._derived_pending = derived, set()
+        self._path_rows = path_rows
+
+    def compact(self, small_segment_rows: Optional[int] = None, full: bool = False) -> int:
+        """
+        合併相鄰的小 segment（筆數 < small_segment_rows）；full=True 時合併為單一 segment。
+        合併保留原本的列序。回傳合併後減少的 segment 數。
+        """
+        if self._path is None or len(self._segments) < 2:
+            return 0
+        threshold = small_segment_rows or self.DEFAULT_SMALL_SEGMENT_ROWS
+        runs, run = [], []
+        for seg in self._segments:
+            if full or seg.count < threshold:
+                run.append(seg)
+                continue
+            if len(run) > 1:
+                runs.append(run)
+            run = []
+        if len(run) > 1:
+            runs.append(run)
+        if not runs:
+            return 0
+
+        self._ensure_derived()
+        manifest = dict(self._manifest)
+        merged_names = {}
+        starts, start = {}, 0
+        for seg in self._segments:
+            starts[seg.name] = start
+            start += seg.count
+        for run in runs:
+            name = index_format.segment_name(manifest["next_segment"])
+            manifest["next_segment"] += 1
+            vectors = np.concatenate([seg.vectors for seg in run])
+            metas = (meta for seg in run for meta in seg.metadata)
+            index_format.write_segment(self._path, name, vectors, metas)
+            self._write_segment_derived(name, starts[run[0].name], vectors.shape[0])
+            self._write_segment_lexical(
+                self._path, name, (c for seg in run for c in seg.metadata.column("caption")), manifest
+            )
+            merged_names[run[0].name] = (name, sum(seg.count for seg in run))
+            for seg in run[1:]:
+                merged_names[seg.name] = None
+
+        segments = []
+        for entry in manifest["segments"]:
+            if entry["name"] not in merged_names:
+                segments.append(entry)
+            elif merged_names[entry["name"]] is not None:
+                name, count = merged_names[entry["name"]]
+                segments.append({"name": name, "count": count})
+        manifest["segments"] = segments
+        index_format.write_manifest(self._path, manifest)
+        index_format.remove_orphans(self._path, manifest)
+
+        before = len(self._segments)
+        tail, tail_size, tail_meta = self._tail, self._tail_size, self.metadata.tail
+        derived = self._derived
+        tombstones, dirty, path_rows = self._tombstones, self._tombstones_dirty, self._path_rows
+        self._attach(self._path, manifest)
+        self._tail, self._tail_size = tail, tail_size
+        self.metadata.extend(tail_meta)
+        # 合併不改變列序，記憶體中的衍生索引、tombstone 與 image_path 索引仍然有效
+        self._derived, self._derived_pending = derived, set()
+        self._tombstones, self._tombstones_dirty, self._path_rows = tombstones, dirty, path_rows
+        logging.info(f"Segment 合併完成: {before} -> {len(self._segments)}")
+        return before - len(self._segments)
+
+    def purge(self) -> int:
+        """
+        以存活列重寫為單一 segment（衍生索引沿用既有模型、只過濾逐列資料），清除 tombstone；
+        已綁定目錄時立即落盤。回傳移除的列數。
+        """
+        removed = len(self._tombstones)
+        if not removed:
+            return 0
+        self._ensure_derived()
+        keep = self.live_rows()
+        vectors = self._gather(keep)
+        metas = [self.metadata[int(i)] for i in keep]
+        derived = {}
+        for key, old in self._derived.items():
+            info = old.model_info()
+            new = self._DERIVED_LOADERS[key](old.model_arrays(), info)
+            new.extend(old.row_data[keep])
+            derived[key] = new
+        path = self._path
+        self._segments, self._segment_rows = [], 0
+        self._tail, self._tail_size = None, 0
+        self.metadata = index_format.MetadataStore()
+        self._path, self._manifest = None, None
+        self._derived, self._derived_pending = {}, set()
+        self._tombstones, self._tombstones_dirty, self._dead_cache = set(), False, None
+        self._lexical_parts, self._lexical_tail = {}, None
+        self._meta_indexes, self._meta_index_tail = {}, None
+        if len(keep):
+            self._tail, self._tail_size = np.array(vectors, dtype=np.float32), len(keep)
+            self.metadata.extend(metas)
+        self._path_rows = {_path_key(meta.get("image_path")): row for row, meta in enumerate(metas)}
+        self._derived = derived
+        if path is not None:
+            self._export(path)
+        logging.info(f"已重寫向量庫，移除 {removed} 筆 tombstone")
+        return removed
+
+    def maybe_purge(self) -> int:
+        """tombstone 比例超過 tombstone_ratio 時重寫"""
+        if self._tombstones and len(self._tombstones) > self.tombstone_ratio * self.count():
+            return self.purge()
+        return 0
+
+    def maybe_compact(self, max_segments: int, small_segment_rows: Optional[int] = None) -> int:
+        """tombstone 過多時先重寫；segment 數超過 max_segments 時合併小 segment，仍超過則全部合併"""
+        self.maybe_purge()
+        if len(self._segments) <= max_segments:
+            return 0
+        merged = self.compact(small_segment_rows)
+        if len(self._segments) > max_segments:
+            merged += self.compact(full=True)
+        return merged
 
     @classmethod
     def load(cls, path):
+        """開啟向量庫：目錄為 segment 格式（mmap，O(1) 開啟），檔案則視為舊版 pickle"""
         db = cls()
+        if os.path.isdir(path):
+            manifest = index_format.read_manifest(path)
+            if manifest is not None:
+                db._attach(path, manifest)
+            return db
         if not os.path.isfile(path):
             return db
         with open(path, "rb") as f:
             data = pickle.load(f)
-            db.vectors = data.get("vectors", [])
-            db.metadata = data.get("metadata", [])
+        vectors = data.get("vectors", [])
+        metadata = data.get("metadata", [])
+        if len(metadata):
+            # 舊格式為 list of arrays，逐列正規化後放入矩陣
+            db.add_many(np.asarray(vectors, dtype=np.float32), list(metadata))
         return db
 
+    @classmethod
+    def open(cls, chroma_db_dir: str, collection_name: str):
+        """依 collection 開啟向量庫；新格式不存在時讀取舊版 pickle"""
+        path = get_vector_db_path(chroma_db_dir, collection_name)
+        if not os.path.isdir(path):
+            legacy = get_legacy_vector_db_path(chroma_db_dir, collection_name)
+            if os.path.isfile(legacy):
+                logging.info(f"讀取舊版 pickle 向量庫: {legacy}（下次儲存將轉為新格式）")
+                return cls.load(legacy)
+        return cls.load(path)
+
     def embed(self, text):
-        from src.utils import dynamic_import
-        if self.embedder is None:
-            SentenceTransformer = dynamic_import("sentence_transformers", "SentenceTransformer")
-            self.embedder = SentenceTransformer("BAAI/bge-large-zh-v1.5")  # 可根據 config 調整
-        return self.embedder.encode(text)
-
-    def similarity(self, query_vec):
-        scores = []
-        for v, meta in zip(self.vectors, self.metadata):
-            score = float(np.dot(query_vec, v) / (np.linalg.norm(query_vec) * np.linalg.norm(v)))
-            scores.append((score, meta))
-        scores.sort(reverse=True, key=lambda x: x[0])
-        return scores
+        embedder = self.embedder
+        if embedder is None:
+            # 不在此快取，registry.release() 後 model 才能真正釋放
+            model_name = self.embedding_model
+            if model_name is None:
+                from src.config import get_config
+                model_name = get_config().EMBEDDING_MODEL
+            backend = self.embedding_backend
+            embedder = embedding_cache.cached(embedding_registry.get_embedder(model_name, backend), model_name, backend)
+        return embedder.encode(text)
+
+    # ---- 搜尋 ----
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: Optional[int]) -> np.ndarray:
+        """回傳分數由高到低的前 top_k 個索引；top_k 較小時以 argpartition 避免全排序"""
+        n = scores.shape[0]
+        if top_k is None or top_k >= n:
+            return np.argsort(-scores, kind="stable")
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64)
+        idx = np.argpartition(-scores, top_k - 1)[:top_k]
+        return idx[np.argsort(-scores[idx], kind="stable")]
+
+    def _gather(self, rows: np.ndarray) -> np.ndarray:
+        """依遞增排序的全域列號取出向量（跨 segment 與 tail）"""
+        blocks = self._blocks()
+        if len(blocks) == 1:
+            return np.asarray(blocks[0][rows])
+        bounds = np.cumsum([0] + [b.shape[0] for b in blocks])
+        cuts = np.searchsorted(rows, bounds)
+        parts = [
+            blocks[i][rows[cuts[i]:cuts[i + 1]] - bounds[i]]
+            for i in range(len(blocks)) if cuts[i + 1] > cuts[i]
+        ]
+        return np.concatenate(parts) if parts else np.zeros((0, self.dim or 0), dtype=np.float32)
+
+    # 平行精確搜尋每個 chunk 的大小（約 8 MB 向量），chunk 數少於此值時不平行
+    _SEARCH_CHUNK_BYTES = 8 * 1024 * 1024
+    _MIN_PARALLEL_CHUNKS = 4
+
+    def _search_workers(self) -> int:
+        return self.search_threads or os.cpu_count() or 1
+
+    def _use_parallel(self, top_k: Optional[int]) -> bool:
+        """需要 top-k、多執行緒且資料至少切得出 _MIN_PARALLEL_CHUNKS 個 chunk 時才平行"""
+        if top_k is None or top_k <= 0 or self._search_workers() < 2:
+            return False
+        rows_per_chunk = max(256, self._SEARCH_CHUNK_BYTES // (4 * (self.dim or 1)))
+        return self.count() >= rows_per_chunk * self._MIN_PARALLEL_CHUNKS
+
+    def _score_chunks(self) -> List[tuple]:
+        """把各區塊切成 (全域起始列, 向量 view)；memmap 切片不複製"""
+        rows_per_chunk = max(256, self._SEARCH_CHUNK_BYTES // (4 * (self.dim or 1)))
+        chunks, start = [], 0
+        for block in self._blocks():
+            for lo in range(0, block.shape[0], rows_per_chunk):
+                chunks.append((start + lo, block[lo:lo + rows_per_chunk]))
+            start += block.shape[0]
+        return chunks
+
+    def _parallel_top_k(self, queries: np.ndarray, top_k: int):
+        """
+        平行精確搜尋：各 chunk 在 thread pool 上計分（BLAS 會釋放 GIL）並保留 local top-k，
+        最後合併。queries 為 (nq, dim)，回傳每個 query 的 (全域列號, 分數)。
+        """
+        workers = self._search_workers()
+        chunks = self._score_chunks()
+        dead = self._dead_mask()
+
+        def score(chunk):
+            start, vectors = chunk
+            scores = queries @ vectors.T  # (nq, rows)
+            if dead is not None:
+                scores[:, dead[start:start + vectors.shape[0]]] = -np.inf
+            k = min(top_k, scores.shape[1])
+            idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            return idx + start, np.take_along_axis(scores, idx, axis=1)
+
+        parts = list(_get_search_pool(workers).map(score, chunks))
+        rows = np.concatenate([p[0] for p in parts], axis=1)
+        scores = np.concatenate([p[1] for p in parts], axis=1)
+        out = []
+        for row_ids, row_scores in zip(rows, scores):
+            idx = self._top_k(row_scores, top_k)
+            idx = idx[np.isfinite(row_scores[idx])]
+            out.append((row_ids[idx], row_scores[idx]))
+        return out
+
+    def _exact_scores(self, q: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        if rows is not None:
+            return self._gather(rows) @ q
+        blocks = self._blocks()
+        return np.concatenate([b @ q for b in blocks]) if len(blocks) > 1 else blocks[0] @ q
+
+    def _search(self, q: np.ndarray, top_k: Optional[int], nprobe: Optional[int],
+                candidates: Optional[np.ndarray] = None):
+        """
+        回傳 (全域列號, 分數)，依分數由高到低。
+        candidates 為過濾後的存活列（遞增）時只對這些列計分，不經 IVF（候選集合已縮小，且不漏失）。
+        """
+        if candidates is not None:
+            rows, dead = candidates, None
+            if not len(rows):
+                return rows, np.empty(0, dtype=np.float32)
+        else:
+            rows = None  # None 表示全部列
+            dead = self._dead_mask()
+        if candidates is None and self.search_engine == "ivf" and self.ann is not None:
+            rows = self.ann.candidates(q, nprobe or self.nprobe)
+            if dead is not None:
+                rows = rows[~dead[rows]]
+        quantizer = self.quantizer if self.use_quantizer else None
+        if quantizer is None and rows is None and self._use_parallel(top_k):
+            return self._parallel_top_k(q[None, :], top_k)[0]
+        if quantizer is None:
+            scores = self._exact_scores(q, rows)
+        else:
+            scores = quantizer.score(q, rows)
+            if self.rescore_k:
+                # 以 ADC 分數取較多候選，再用原始 float32 向量精確重算
+                if rows is None and dead is not None:
+                    scores[dead] = -np.inf
+                keep = self._top_k(scores, max(self.rescore_k, top_k or 0))
+                cand = np.sort(keep if rows is None else rows[keep])
+                if dead is not None:
+                    cand = cand[~dead[cand]]
+                rows, scores = cand, self._exact_scores(q, cand)
+        if rows is None and dead is not None:
+            # 全表計分時 tombstone 以 -inf 排除
+            scores[dead] = -np.inf
+            idx = self._top_k(scores, top_k)
+            idx = idx[~dead[idx]]
+            return idx, scores[idx]
+        idx = self._top_k(scores, top_k)
+        return (idx if rows is None else rows[idx]), scores[idx]
+
+    def search_rows(self, query_vec, top_k: Optional[int] = None, nprobe: Optional[int] = None,
+                    filter: Optional[MetadataFilter] = None):
+        """與 similarity 相同，但回傳 (全域列號, 分數)，供混合排序使用"""
+        if not self.live_count():
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        q = self._normalize(np.asarray(query_vec, dtype=np.float32).reshape(-1))
+        return self._search(q, top_k, nprobe, self.filter_rows(filter))
+
+    def _metadata_index(self, seg: index_format.Segment) -> metadata_index.SegmentMetadataIndex:
+        index = self._meta_indexes.get(seg.name)
+        if index is None:
+            index = metadata_index.SegmentMetadataIndex(seg.metadata)
+            self._meta_indexes[seg.name] = index
+        return index
+
+    def filter_rows(self, filter: Optional[MetadataFilter]) -> Optional[np.ndarray]:
+        """符合過濾條件的存活列（遞增）；沒有條件時回傳 None（表示全部列）"""
+        if filter is None or filter.is_empty():
+            return None
+        parts, start = [], 0
+        for seg in self._segments:
+            parts.append((start, self._metadata_index(seg)))
+            start += seg.count
+        if self._tail_size:
+            if self._meta_index_tail is None or self._meta_index_tail[0] != self._tail_size:
+                self._meta_index_tail = (self._tail_size, metadata_index.SegmentMetadataIndex(list(self.metadata.tail)))
+            parts.append((start, self._meta_index_tail[1]))
+        rows = metadata_index.select_rows(parts, filter)
+        dead = self._dead_mask()
+        return rows if dead is None else rows[~dead[rows]]
+
+    def lexical_search(self, text: str, top_k: Optional[int] = None, filter: Optional[MetadataFilter] = None):
+        """以 caption 的 BM25（字元 bigram）查詢，不需 embedding；回傳 (全域列號, 分數)"""
+        parts, start = [], 0
+        for seg in self._segments:
+            parts.append((start, self._lexical_segment(seg)))
+            start += seg.count
+        if self._tail_size:
+            if self._lexical_tail is None or self._lexical_tail[0] != self._tail_size:
+                tail = lexical_index.LexicalSegment.build(m.get("caption") for m in self.metadata.tail)
+                self._lexical_tail = (self._tail_size, tail)
+            parts.append((start, self._lexical_tail[1]))
+        exclude = self._dead_mask()
+        candidates = self.filter_rows(filter)
+        if candidates is not None:
+            exclude = np.ones(self.count(), dtype=bool)
+            exclude[candidates] = False
+        return lexical_index.bm25_search(parts, text, top_k, exclude)
+
+    # 批次查詢時單次分數矩陣的元素上限（float32，約 256 MB）
+    _MAX_SCORE_ELEMENTS = 64 * 1024 * 1024
+
+    def similarity(self, query_vec, top_k: Optional[int] = None, nprobe: Optional[int] = None,
+                   filter: Optional[MetadataFilter] = None):
+        """
+        計算 cosine 相似度，回傳 [(score, meta), ...]（由高到低）。
+        預設為精確掃描（每個 segment 一次矩陣-向量乘積；search_threads > 1 時切成 chunk
+        在 thread pool 上平行計分）；search_engine 為 "ivf"
+        時只掃描最接近的 nprobe 個分群；use_quantizer 時以量化碼 ADC 計分並可重算前幾名。
+        指定 filter 時先以次要索引求出候選列，只對候選列計分。
+        """
+        if not self.live_count():
+            return []
+        q = self._normalize(np.asarray(query_vec, dtype=np.float32).reshape(-1))
+        rows, scores = self._search(q, top_k, nprobe, self.filter_rows(filter))
+        return [(float(score), self.metadata[int(row)]) for row, score in zip(rows, scores)]
+
+    def similarity_many(self, query_vecs, top_k: Optional[int] = None, nprobe: Optional[int] = None,
+                        filter: Optional[MetadataFilter] = None):
+        """
+        批次版 similarity，回傳每個 query 的 [(score, meta), ...]。
+        精確搜尋時以矩陣-矩陣乘積一次計分（query 依記憶體上限分塊）；
+        IVF / 量化路徑的候選集合因 query 而異，逐筆處理。
+        """
+        queries = np.atleast_2d(np.asarray(query_vecs, dtype=np.float32))
+        if not self.live_count() or queries.shape[0] == 0:
+            return [[] for _ in range(queries.shape[0])]
+        queries = self._normalize(queries)
+        candidates = self.filter_rows(filter)
+        if candidates is not None or (self.search_engine == "ivf" and self.ann is not None) or (self.use_quantizer and self.quantizer is not None):
+            return [
+                [(float(score), self.metadata[int(row)]) for row, score in zip(*self._search(q, top_k, nprobe, candidates))]
+                for q in queries
+            ]
+        blocks = self._blocks()
+        dead = self._dead_mask()
+        chunk = max(1, self._MAX_SCORE_ELEMENTS // self.count())
+        out = []
+        if self._use_parallel(top_k):
+            for start in range(0, queries.shape[0], chunk):
+                out.extend(
+                    [(float(score), self.metadata[int(row)]) for row, score in zip(rows, scores)]
+                    for rows, scores in self._parallel_top_k(queries[start:start + chunk], top_k)
+                )
+            return out
+        for start in range(0, queries.shape[0], chunk):
+            qs = queries[start:start + chunk]
+            scores = np.concatenate([qs @ b.T for b in blocks], axis=1) if len(blocks) > 1 else qs @ blocks[0].T
+            if dead is not None:
+                scores[:, dead] = -np.inf
+            for row_scores in scores:
+                idx = self._top_k(row_scores, top_k)
+                if dead is not None:
+                    idx = idx[~dead[idx]]
+                out.append([(float(row_scores[i]), self.metadata[int(i)]) for i in idx])
+        return out
 
 class RAGIndexer:
-    def __init__(self, chroma_db_dir: str, collection_name: str, embedding_model: str, embedding_mode: str = "auto", vector_db_path: str = None):
+    def __init__(self, chroma_db_dir: str, collection_name: str, embedding_model: str, embedding_mode: str = "auto", vector_db_path: str = None, max_segments: int = 16,
+                 search_engine: str = "exact", ivf_nlist: int = 0, quantization: str = "none", pq_m: int = 128,
+                 embed_batch_size: int = 32, tombstone_ratio: float = SimpleVectorDB.DEFAULT_TOMBSTONE_RATIO,
+                 lexical_index: bool = True):
         self.chroma_db_dir = chroma_db_dir
         self.collection_name = collection_name
         self.embedding_model = embedding_model
         self.embedding_mode = "manual"  # 強制手動 embedding，避免 llamaindex auto embedding 相依問題
         self.embedder = None
-        self.vector_db_path = vector_db_path or os.path.join(chroma_db_dir, f"{collection_name}_vectors.pkl")
+        self.vector_db_path = vector_db_path or get_vector_db_path(chroma_db_dir, collection_name)
+        self.max_segments = max_segments
+        self.search_engine = search_engine
+        self.ivf_nlist = ivf_nlist
+        self.quantization = quantization
+        self.pq_m = pq_m
+        self.embed_batch_size = max(1, embed_batch_size)
 
+        # embedder 由 registry 共用（同一行程內相同 model 只載入一次），並經過持久化 embedding 快取
         if embedding_mode == "auto":
-            HuggingFaceEmbedding = dynamic_import("llama_index.embeddings.huggingface", "HuggingFaceEmbedding")
-            if HuggingFaceEmbedding is None:
-                raise ImportError("LlamaIndex HuggingFaceEmbedding 無法匯入，請檢查依賴版本")
-            self.embedder = HuggingFaceEmbedding(model_name=embedding_model)
+            backend = embedding_registry.BACKEND_LLAMA_INDEX
+            self.embedder = embedding_cache.cached(embedding_registry.get_embedder(embedding_model, backend), embedding_model, backend)
             self.vector_db = None
-        elif embedding_mode == "manual":
-            SentenceTransformer = dynamic_import("sentence_transformers", "SentenceTransformer")
-            if SentenceTransformer is None:
-                raise ImportError("sentence-transformers 無法匯入，請檢查依賴版本")
-            self.embedder = SentenceTransformer(embedding_model)
-            self.vector_db = SimpleVectorDB()
+        elif embedding_mode in ("manual", "server"):
+            # server：向量庫與 manual 相同，embedding 改由共用的 embedding server 計算
+            backend = embedding_registry.backend_for_mode(embedding_mode)
+            self.embedder = embedding_cache.cached(embedding_registry.get_embedder(embedding_model, backend), embedding_model, backend)
+            # 開啟既有向量庫（mmap），batch_index 只追加新 segment
+            if vector_db_path:
+                self.vector_db = SimpleVectorDB.load(vector_db_path)
+            else:
+                self.vector_db = SimpleVectorDB.open(chroma_db_dir, collection_name)
+            self.vector_db.embedding_model = embedding_model
+            self.vector_db.embedding_backend = backend
+            self.vector_db.tombstone_ratio = tombstone_ratio
+            # 每個新 segment 一併寫入 caption 的 BM25 倒排表，供 RAGQuery 關鍵字 / hybrid 查詢
+            self.vector_db.lexical = lexical_index
         else:
-            raise ValueError("embedding_mode 必須為 'auto' 或 'manual'")
+            raise ValueError("embedding_mode 必須為 'auto'、'manual' 或 'server'")
 
     def embed(self, text: str):
         if self.embedding_mode == "auto":
@@ -86,6 +1002,24 @@ class RAGIndexer:
         else:
             raise RuntimeError("未知 embedding_mode")
 
+    def embed_many(self, texts: List[str]):
+        """一次 embed 多段文字，回傳 (n, dim) 向量"""
+        if self.embedding_mode == "auto":
+            return np.asarray(self.embedder.get_text_embedding_batch(texts), dtype=np.float32)
+        elif self.embedding_mode == "manual":
+            return self.embedder.encode(texts, batch_size=len(texts))
+        else:
+            raise RuntimeError("未知 embedding_mode")
+
+    @staticmethod
+    def _make_meta(caption_data: Dict) -> Dict:
+        return {
+            "image_id": caption_data["image_id"],
+            "image_path": caption_data["image_path"],
+            "caption": caption_data["caption"],
+            "indexed_at": datetime.utcnow().isoformat()
+        }
+
     def index_caption(self, caption_data: Dict) -> bool:
         try:
             emb = self.embed(caption_data["caption"])
@@ -97,30 +1031,78 @@ class RAGIndexer:
             # TODO: LlamaIndex pipeline 寫入
             logging.info(f"[AUTO] Index: {caption_data['image_id']} | emb shape: {getattr(emb, 'shape', None) or len(emb)}")
         elif self.embedding_mode == "manual":
-            meta = {
-                "image_id": caption_data["image_id"],
-                "image_path": caption_data["image_path"],
-                "caption": caption_data["caption"],
-                "indexed_at": datetime.utcnow().isoformat()
-            }
-            self.vector_db.add(emb, meta)
+            self.vector_db.add(emb, self._make_meta(caption_data))
             logging.info(f"[MANUAL] Index: {caption_data['image_id']} | emb shape: {getattr(emb, 'shape', None) or len(emb)}")
         return True
 
+    def embed_chunk(self, chunk: List[Dict]):
+        """批次 embed 一組 caption，回傳 (embs, metas)；批次失敗時退回逐筆，略過仍失敗的項目"""
+        try:
+            embs = np.asarray(self.embed_many([c["caption"] for c in chunk]), dtype=np.float32)
+            return embs, [self._make_meta(c) for c in chunk]
+        except Exception as e:
+            logging.warning(f"批次 embedding 失敗（{len(chunk)} 筆），改為逐筆處理: {e}")
+        embs, metas = [], []
+        for c in chunk:
+            try:
+                embs.append(np.asarray(self.embed(c["caption"]), dtype=np.float32))
+                metas.append(self._make_meta(c))
+            except Exception as e:
+                logging.error(f"Embedding 失敗: {e}")
+        return (np.stack(embs) if embs else np.zeros((0, 0), dtype=np.float32)), metas
+
+    def add_embedded(self, embs, metas: List[Dict]) -> int:
+        """把已 embed 的一批寫入向量庫（記憶體中，persist() 時落盤），回傳筆數"""
+        if not metas:
+            return 0
+        if self.embedding_mode == "auto":
+            # TODO: LlamaIndex pipeline 寫入
+            logging.info(f"[AUTO] Index: {len(metas)} 筆 | emb shape: {np.shape(embs)}")
+        elif self.embedding_mode == "manual":
+            self.vector_db.add_many(embs, metas)
+            logging.info(f"[MANUAL] Index: {len(metas)} 筆 | emb shape: {np.shape(embs)}")
+        return len(metas)
+
+    def index_chunk(self, chunk: List[Dict]) -> int:
+        """批次 embed 一組 caption 並整批寫入向量庫；批次失敗時退回逐筆處理。回傳成功筆數"""
+        return self.add_embedded(*self.embed_chunk(chunk))
+
+    def persist(self):
+        """持久化 minimal 路徑：更新衍生索引、寫入新 segment、必要時合併"""
+        if self.embedding_mode != "manual":
+            return
+        os.makedirs(self.chroma_db_dir, exist_ok=True)
+        if self.search_engine == "ivf":
+            self.vector_db.update_ann(self.ivf_nlist or None)
+        if self.quantization != "none":
+            self.vector_db.update_quantizer(self.quantization, self.pq_m)
+        self.vector_db.save(self.vector_db_path)
+        self.vector_db.maybe_compact(self.max_segments)
+
+    def remove_images(self, image_paths) -> int:
+        """從向量庫刪除指定 image_path 的項目（tombstone，立即落盤），回傳刪除筆數"""
+        if self.embedding_mode == "manual":
+            return self.vector_db.remove_paths(image_paths)
+        # TODO: LlamaIndex pipeline 刪除
+        return 0
+
+    def indexed_paths(self) -> List[str]:
+        """向量庫中所有項目的 image_path"""
+        if self.embedding_mode == "manual":
+            paths = self.vector_db.metadata.column("image_path")
+            return [paths[row] for row in self.vector_db.live_rows().tolist()]
+        return []
+
     def batch_index(self, caption_list: List[Dict]) -> int:
         success = 0
-        for c in caption_list:
-            if self.index_caption(c):
-                success += 1
-        # 持久化 minimal 路徑
-        if self.embedding_mode == "manual":
-            os.makedirs(self.chroma_db_dir, exist_ok=True)
-            self.vector_db.save(self.vector_db_path)
+        for start in range(0, len(caption_list), self.embed_batch_size):
+            success += self.index_chunk(caption_list[start:start + self.embed_batch_size])
+        self.persist()
         return success
 
     def get_collection_stats(self) -> dict:
         if self.embedding_mode == "manual":
-            return {"count": self.vector_db.count(), "last_indexed": None}
+            return {"count": self.vector_db.live_count(), "last_indexed": None}
         else:
             # TODO: LlamaIndex pipeline 統計
             return {"count": 0, "last_indexed": None}
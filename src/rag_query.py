@@ -2,6 +2,30 @@ import logging
 import time
 from typing import List, Dict, Optional
 from src.utils import dynamic_import
+from src import embedding_cache
+from src import embedding_registry
+from src.lexical_index import reciprocal_rank_fusion
+from src.metadata_index import MetadataFilter
+
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+# 使用 SimpleVectorDB 的 embedding_mode；server 只是把 embedding 交給共用的 embedding server
+VECTOR_DB_MODES = ("manual", "server")
+
+
+def _format_hits(sims) -> List[Dict]:
+    return [
+        {
+            "image_id": meta["image_id"],
+            "image_path": meta["image_path"],
+            "caption": meta["caption"],
+            "score": float(score),
+        }
+        for score, meta in sims
+    ]
+
+
+def _hits_for_rows(vector_db, rows, scores) -> List[Dict]:
+    return _format_hits((score, vector_db.metadata[int(row)]) for row, score in zip(rows, scores))
 
 class RAGQuery:
     def __init__(
@@ -13,6 +37,13 @@ class RAGQuery:
         vector_db=None,
         chroma_http_host: Optional[str] = None,
         chroma_http_port: Optional[str] = None,
+        search_engine: str = "exact",
+        nprobe: Optional[int] = None,
+        quantization: str = "none",
+        rescore_k: Optional[int] = None,
+        search_mode: str = "vector",
+        rrf_k: int = 60,
+        search_threads: int = 1,
     ):
         self.chroma_db_dir = chroma_db_dir
         self.collection_name = collection_name
@@ -21,6 +52,11 @@ class RAGQuery:
         self.vector_db = vector_db
         self.chroma_http_host = chroma_http_host
         self.chroma_http_port = chroma_http_port
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"search_mode 必須為 {', '.join(SEARCH_MODES)} 之一")
+        # lexical：只用 caption 的 BM25（不需 embedding）；hybrid：向量與 BM25 以 RRF 合併
+        self.search_mode = search_mode
+        self.rrf_k = rrf_k
 
         if embedding_mode == "auto":
             # 支援 docker http chromadb
@@ -40,22 +76,67 @@ class RAGQuery:
                 collection_name=collection_name,
                 **chroma_kwargs
             )
-            HuggingFaceEmbedding = dynamic_import("llama_index.embeddings.huggingface", "HuggingFaceEmbedding")
-            if HuggingFaceEmbedding is None:
-                raise ImportError("LlamaIndex HuggingFaceEmbedding 無法匯入，請檢查依賴版本")
-            self.embedder = HuggingFaceEmbedding(model_name=embedding_model)
-        elif embedding_mode == "manual":
+            backend = embedding_registry.BACKEND_LLAMA_INDEX
+            self.embedder = embedding_cache.cached(embedding_registry.get_embedder(embedding_model, backend), embedding_model, backend)
+        elif embedding_mode in VECTOR_DB_MODES:
             from src.rag_indexer import SimpleVectorDB
-            import os
-            vector_db_path = os.path.join(chroma_db_dir, f"{collection_name}_vectors.pkl")
-            self.vector_db = SimpleVectorDB.load(vector_db_path)
-            self.embedder = None  # minimal 路徑由 vector_db 提供
+            # mmap 開啟，成本與資料量無關
+            self.vector_db = SimpleVectorDB.open(chroma_db_dir, collection_name)
+            self.vector_db.embedding_model = embedding_model
+            self.vector_db.embedding_backend = embedding_registry.backend_for_mode(embedding_mode)
+            # "ivf" 需由 RAGIndexer 以相同設定建立索引，否則退回精確搜尋
+            self.vector_db.search_engine = search_engine
+            # 預設單執行緒：多個呼叫端共用同一行程（Streamlit、server）時不會各自佔滿所有核心；
+            # CLI 與 app 入口由 Config.SEARCH_THREADS 決定是否平行
+            self.vector_db.search_threads = search_threads
+            if nprobe:
+                self.vector_db.nprobe = nprobe
+            # 量化碼同樣由 RAGIndexer 建立；rescore_k=0 表示只用 ADC 分數
+            self.vector_db.use_quantizer = quantization != "none"
+            if rescore_k is not None:
+                self.vector_db.rescore_k = rescore_k
+            self.embedder = None  # minimal 路徑由 vector_db 經 embedding_registry 與快取提供
         else:
-            raise ValueError("embedding_mode 必須為 'auto' 或 'manual'")
+            raise ValueError("embedding_mode 必須為 'auto'、'manual' 或 'server'")
+
+    # hybrid 模式兩路各取的候選數下限
+    HYBRID_DEPTH = 50
 
-    def query(self, query_text: str, top_k: int = 5) -> Dict:
+    def _manual_hits(self, query_text: str, top_k: int, mode: str, flt: Optional[MetadataFilter]) -> List[Dict]:
+        db = self.vector_db
+        if mode == "lexical":
+            return _hits_for_rows(db, *db.lexical_search(query_text, top_k=top_k, filter=flt))
+        if mode == "hybrid":
+            depth = max(top_k, self.HYBRID_DEPTH)
+            lexical_rows, _ = db.lexical_search(query_text, top_k=depth, filter=flt)
+            vector_rows, _ = db.search_rows(db.embed(query_text), top_k=depth, filter=flt)
+            fused = reciprocal_rank_fusion([vector_rows, lexical_rows], k=self.rrf_k)[:top_k]
+            return _hits_for_rows(db, [row for row, _ in fused], [score for _, score in fused])
+        return _format_hits(db.similarity(db.embed(query_text), top_k=top_k, filter=flt))
+
+    def query(
+        self,
+        query_text: str,
+        top_k: int = 5,
+        mode: Optional[str] = None,
+        path_prefix: Optional[str] = None,
+        indexed_after=None,
+        indexed_before=None,
+        where: Optional[Dict] = None,
+    ) -> Dict:
+        """
+        mode 未指定時使用 search_mode；auto（Chroma）模式只支援向量查詢。
+        過濾條件（manual 模式）：image_path 前綴、indexed_at 範圍（after 含、before 不含，
+        ISO 字串或 datetime）、where 為 metadata key -> 值（list 表示任一相符）。
+        """
         t0 = time.time()
+        mode = mode or self.search_mode
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"mode 必須為 {', '.join(SEARCH_MODES)} 之一")
+        flt = MetadataFilter(path_prefix, indexed_after, indexed_before, dict(where or {}))
         if self.embedding_mode == "auto":
+            if not flt.is_empty():
+                logging.warning("auto 模式不支援過濾條件，將忽略")
             query_vec = self.embedder.get_text_embedding(query_text)
             results = self.chroma_vs.similarity_search(query_vec, top_k=top_k)
             out = []
@@ -66,20 +147,11 @@ class RAGQuery:
                     "caption": r.metadata.get("caption"),
                     "score": r.score,
                 })
-        elif self.embedding_mode == "manual":
+        elif self.embedding_mode in VECTOR_DB_MODES:
             # minimal 路徑
             if not self.vector_db:
                 return {"query": query_text, "results": [], "query_time": 0}
-            query_vec = self.vector_db.embed(query_text)
-            sims = self.vector_db.similarity(query_vec)
-            out = []
-            for idx, (score, meta) in enumerate(sims[:top_k]):
-                out.append({
-                    "image_id": meta["image_id"],
-                    "image_path": meta["image_path"],
-                    "caption": meta["caption"],
-                    "score": float(score),
-                })
+            out = self._manual_hits(query_text, top_k, mode, flt)
         else:
             out = []
         t1 = time.time()
@@ -88,3 +160,39 @@ class RAGQuery:
             "results": out,
             "query_time": round(t1 - t0, 3)
         }
+
+    def query_many(self, query_texts: List[str], top_k: int = 5) -> Dict:
+        """
+        批次查詢：manual 模式一次 embed 全部文字，並以單次矩陣-矩陣乘積計分。
+        每筆 query_time 為批次 embed 與計分時間平均分攤後的值。
+        """
+        t0 = time.time()
+        if not query_texts:
+            return {"queries": [], "embed_time": 0, "search_time": 0, "total_time": 0, "avg_query_time": 0}
+        if self.embedding_mode not in VECTOR_DB_MODES or self.search_mode != "vector":
+            per_query = [self.query(text, top_k=top_k) for text in query_texts]
+            total = time.time() - t0
+            return {
+                "queries": per_query,
+                "embed_time": None,
+                "search_time": None,
+                "total_time": round(total, 3),
+                "avg_query_time": round(total / len(query_texts), 4),
+            }
+
+        query_vecs = self.vector_db.embed(list(query_texts))
+        t1 = time.time()
+        all_sims = self.vector_db.similarity_many(query_vecs, top_k=top_k)
+        t2 = time.time()
+        per_query_time = (t2 - t0) / len(query_texts)
+        queries = [
+            {"query": text, "results": _format_hits(sims), "query_time": round(per_query_time, 4)}
+            for text, sims in zip(query_texts, all_sims)
+        ]
+        return {
+            "queries": queries,
+            "embed_time": round(t1 - t0, 3),
+            "search_time": round(t2 - t1, 3),
+            "total_time": round(t2 - t0, 3),
+            "avg_query_time": round(per_query_time, 4),
+        }
@@ -0,0 +1,68 @@
+"""
+asyncio token bucket 限流
+
+以每分鐘請求數（RPM）與每分鐘 token 數（TPM）兩個 bucket 取代固定 sleep：
+額度足夠時立即放行，不足時只等待到額度補足為止。
+
+bucket 只用 threading.Lock 與 monotonic clock，不綁定任何 event loop：
+同一個 RateLimiter 可跨多次 asyncio.run（例如 IngestPipeline 的每個 chunk）與多個執行緒共用。
+"""
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class AsyncTokenBucket:
+    """容量 capacity、每秒補充 rate 的 token bucket；rate <= 0 表示不限流"""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(per_minute, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self, amount: float) -> float:
+        """先扣除額度（可暫時為負），回傳需等待的秒數；依呼叫順序排隊，不需在鎖內等待"""
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self, amount: float = 1.0):
+        if self.rate <= 0:
+            return
+        # 單次需求超過容量時以容量計，避免永遠等不到
+        wait = self._reserve(min(amount, self.capacity))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def adjust(self, delta: float):
+        """依實際用量修正（delta > 0 為補扣，< 0 為退還）；可暫時為負，之後的請求會等待"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - delta)
+
+
+class RateLimiter:
+    """同時套用 RPM 與 TPM 限制"""
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests = AsyncTokenBucket(requests_per_minute)
+        self.tokens = AsyncTokenBucket(tokens_per_minute)
+
+    async def acquire(self, estimated_tokens: int):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        if actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
@@ -0,0 +1,236 @@
+"""
+分片索引與合併
+
+圖片依相對於圖片目錄的路徑做穩定雜湊後分配到 N 個 shard，同一份清單在任何機器上
+分配結果都相同。每個 shard 寫入自己的 collection（{collection}.shard-i-of-N），
+包含向量庫、檔案清單與 journal；最後以 merge_shards() 合併回原本的 collection。
+
+合併時以 image_path 識別圖片（與 SimpleVectorDB 相同，各列以絕對路徑識別）：
+- 同一路徑出現在兩個 shard 中是衝突：依路徑分片時不可能發生，表示 shard 切分不一致
+  或混入了舊的 shard。預設中止且不寫入任何資料，on_conflict="keep_newer" 時保留 indexed_at 較新者。
+- shard 與目標庫既有資料路徑相同則是重新索引的結果，以 indexed_at 較新的一份為準。
+image_id 相同但路徑不同（例如 x.jpg 與 x.png）是兩張不同的圖片，兩者都保留。
+
+replace=True 時先在同目錄的暫存 collection 建好完整的向量庫與檔案清單，再以 rename 換上，
+合併途中失敗不會留下半個 collection，原本的資料也仍在。
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.file_manifest import FileManifest, get_file_manifest_path
+from src.rag_indexer import SimpleVectorDB, get_vector_db_path
+
+_SHARD_RE = re.compile(r"^(\d+)/(\d+)$")
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """解析 "i/N"（0 <= i < N）"""
+    m = _SHARD_RE.match(spec.strip())
+    if not m:
+        raise ValueError(f"shard 格式應為 i/N，例如 0/4: {spec}")
+    index, count = int(m.group(1)), int(m.group(2))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"shard 編號需滿足 0 <= i < N: {spec}")
+    return index, count
+
+
+def shard_of(image_path: str, num_shards: int, root: Optional[str] = None) -> int:
+    """穩定分配：以相對路徑（統一為 / 分隔）的 sha1 決定 shard，與機器和清單順序無關"""
+    rel = os.path.relpath(image_path, root) if root else image_path
+    digest = hashlib.sha1(rel.replace(os.sep, "/").encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def select_shard(image_paths: Sequence[str], index: int, num_shards: int, root: Optional[str] = None) -> List[str]:
+    return [p for p in image_paths if shard_of(p, num_shards, root) == index]
+
+
+def shard_collection(collection_name: str, index: int, num_shards: int) -> str:
+    return f"{collection_name}.shard-{index}-of-{num_shards}"
+
+
+@dataclass
+class MergeReport:
+    merged: int = 0
+    duplicates: int = 0  # 與目標庫既有資料相同 image_path，以較新者為準
+    conflicts: List[Tuple[str, str, str]] = field(default_factory=list)  # (image_path, 先出現的 shard, 衝突的 shard)
+
+
+class ShardConflictError(RuntimeError):
+    def __init__(self, conflicts: List[Tuple[str, str, str]]):
+        self.conflicts = conflicts
+        sample = "; ".join(f"{p}: {a} <-> {b}" for p, a, b in conflicts[:5])
+        super().__init__(
+            f"{len(conflicts)} 張圖片同時出現在多個 shard（{sample}{' ...' if len(conflicts) > 5 else ''}）"
+        )
+
+
+def _plan(target: SimpleVectorDB, sources: List[SimpleVectorDB], source_paths: List[str], report: MergeReport):
+    """
+    決定每個來源要保留的列（只看存活列）。同一路徑重複時保留 indexed_at 較新的一筆，
+    寫入時由 add_many 的 upsert 取代目標庫的舊列；shard 之間的重複記錄在 report.conflicts。
+    """
+    # 絕對 image_path -> (indexed_at, 是否為目標庫既有資料, 來源序號, 列號)
+    owner: Dict[str, Tuple] = {
+        os.path.abspath(m["image_path"]): (m.get("indexed_at", ""), True, -1, -1) for m in target.live_metadata()
+    }
+    keep = [set() for _ in sources]
+    for s, src in enumerate(sources):
+        for row in src.live_rows().tolist():
+            meta = src.metadata[row]
+            key = os.path.abspath(meta["image_path"])
+            existing = owner.get(key)
+            if existing is None:
+                owner[key] = (meta.get("indexed_at", ""), False, s, row)
+                keep[s].add(row)
+                continue
+            if existing[1]:
+                report.duplicates += 1
+            else:
+                report.conflicts.append((key, source_paths[existing[2]], source_paths[s]))
+            if meta.get("indexed_at", "") > existing[0]:
+                if not existing[1]:
+                    keep[existing[2]].discard(existing[3])
+                owner[key] = (meta.get("indexed_at", ""), existing[1], s, row)
+                keep[s].add(row)
+    return [np.asarray(sorted(rows), dtype=np.int64) for rows in keep]
+
+
+def _staging_collection(collection_name: str) -> str:
+    return f"{collection_name}.merging"
+
+
+def _remove_collection_files(chroma_db_dir: str, collection_name: str):
+    """刪除 collection 的向量庫目錄與檔案清單（含 sqlite 的 -wal / -shm）"""
+    shutil.rmtree(get_vector_db_path(chroma_db_dir, collection_name), ignore_errors=True)
+    manifest_path = get_file_manifest_path(chroma_db_dir, collection_name)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(manifest_path + suffix):
+            os.remove(manifest_path + suffix)
+
+
+def _swap_in(chroma_db_dir: str, staging: str, collection_name: str):
+    """把建好的暫存 collection 換成 collection_name；舊資料在新資料就位後才刪除"""
+    target_path = get_vector_db_path(chroma_db_dir, collection_name)
+    old_path = target_path + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.isdir(target_path):
+        os.rename(target_path, old_path)
+    os.rename(get_vector_db_path(chroma_db_dir, staging), target_path)
+    manifest_path = get_file_manifest_path(chroma_db_dir, collection_name)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(manifest_path + suffix):
+            os.remove(manifest_path + suffix)
+    os.replace(get_file_manifest_path(chroma_db_dir, staging), manifest_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def merge_shards(
+    source_paths: List[str],
+    chroma_db_dir: str,
+    collection_name: str,
+    on_conflict: str = "error",
+    max_segments: int = 16,
+    search_engine: str = "exact",
+    ivf_nlist: int = 0,
+    quantization: str = "none",
+    pq_m: int = 128,
+    replace: bool = False,
+) -> MergeReport:
+    """
+    把多個 shard 向量庫（目錄）合併到 collection_name。
+    同一圖片出現在多個 shard 時，on_conflict="error" 拋出 ShardConflictError 且不寫入任何資料；
+    "keep_newer" 時保留 indexed_at 較新者。
+    衍生索引依 search_engine / quantization 於合併後更新（與 RAGIndexer.persist 相同）。
+    各 shard 的檔案清單一併合併，之後可在合併後的 collection 上繼續增量索引。
+    replace=True 時以 shard 內容重建目標 collection（shard 中已刪除的圖片也會從目標移除）；
+    否則追加到既有資料，同一圖片以 indexed_at 較新者為準。
+    """
+    if on_conflict not in ("error", "keep_newer"):
+        raise ValueError("on_conflict 必須為 'error' 或 'keep_newer'")
+    target = SimpleVectorDB() if replace else SimpleVectorDB.open(chroma_db_dir, collection_name)
+    sources = [SimpleVectorDB.load(p) for p in source_paths]
+    # shard 有 BM25 倒排表時，合併後的 segment 也建立
+    target.lexical = target.lexical or any(src.lexical for src in sources)
+    report = MergeReport()
+    keep_rows = _plan(target, sources, source_paths, report)
+    if report.conflicts:
+        for image_path, a, b in report.conflicts[:20]:
+            logging.warning(f"圖片同時出現在多個 shard: {image_path}: {a} <-> {b}")
+        if on_conflict == "error":
+            raise ShardConflictError(report.conflicts)
+
+    # replace 時寫入暫存 collection，完成後才換上；否則直接追加到目標
+    written = _staging_collection(collection_name) if replace else collection_name
+    if replace:
+        _remove_collection_files(chroma_db_dir, written)
+    target_path = get_vector_db_path(chroma_db_dir, written)
+    try:
+        accepted_paths = set()
+        for path, src, keep in zip(source_paths, sources, keep_rows):
+            if not len(keep):
+                continue
+            # 每個 shard 寫成一個新 segment；只取保留的列，不串接整個 shard
+            target.add_many(src._gather(keep), [src.metadata[int(i)] for i in keep])
+            target.save(target_path)
+            report.merged += len(keep)
+            accepted_paths.update(os.path.abspath(src.metadata[int(i)]["image_path"]) for i in keep)
+            logging.info(f"已合併 {path}: {len(keep)} 筆")
+        if replace and not report.merged:
+            target.save(target_path)  # 全部 shard 皆為空時仍換上一個空的 collection
+        if search_engine == "ivf":
+            target.update_ann(ivf_nlist or None)
+        if quantization != "none":
+            target.update_quantizer(quantization, pq_m)
+        target.maybe_compact(max_segments)
+
+        manifest = FileManifest.open(chroma_db_dir, written)
+        for path in source_paths:
+            shard_manifest = _manifest_for(path)
+            if shard_manifest is None:
+                continue
+            entries = [e for e in shard_manifest.entries().values() if e.path in accepted_paths]
+            manifest.record([e.path for e in entries], {e.path: (e.size, e.mtime_ns, e.sha256) for e in entries})
+            shard_manifest.close()
+        manifest.close()
+    except BaseException:
+        if replace:
+            _remove_collection_files(chroma_db_dir, written)
+        raise
+    if replace:
+        _swap_in(chroma_db_dir, written, collection_name)
+    logging.info(
+        f"合併完成: {report.merged} 筆寫入 {collection_name}，重複 {report.duplicates}、衝突 {len(report.conflicts)}"
+    )
+    return report
+
+
+def _manifest_for(vector_db_path: str) -> Optional[FileManifest]:
+    """由 shard 向量庫目錄推得同一 collection 的檔案清單"""
+    vector_db_path = os.path.abspath(vector_db_path).rstrip(os.sep)
+    suffix = "_vectors"
+    if not vector_db_path.endswith(suffix):
+        return None
+    chroma_db_dir = os.path.dirname(vector_db_path)
+    collection = os.path.basename(vector_db_path)[:-len(suffix)]
+    path = get_file_manifest_path(chroma_db_dir, collection)
+    return FileManifest(path) if os.path.isfile(path) else None
+
+
+def find_shards(chroma_db_dir: str, collection_name: str, num_shards: int) -> List[str]:
+    """目錄中 collection 的各 shard 向量庫路徑（缺少的 shard 會記錄警告）"""
+    paths = []
+    for i in range(num_shards):
+        path = get_vector_db_path(chroma_db_dir, shard_collection(collection_name, i, num_shards))
+        if os.path.isdir(path):
+            paths.append(path)
+        else:
+            logging.warning(f"找不到 shard {i}/{num_shards}: {path}")
+    return paths
@@ -1,8 +1,10 @@
 import importlib
 import logging
 import os
-from typing import Any, List
-from PIL import Image
+from typing import TYPE_CHECKING, Any, List
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 def dynamic_import(module_name: str, class_name: str) -> Any:
     """動態匯入指定模組與類別，若失敗回傳 None。"""
@@ -23,8 +25,9 @@ def get_image_list(image_dir: str) -> List[str]:
             files.append(os.path.join(image_dir, f))
     return sorted(files)
 
-def load_image(image_path: str) -> Image.Image:
+def load_image(image_path: str) -> "Image.Image":
     """載入圖片，支援 JPG/PNG，錯誤時拋出例外"""
+    from PIL import Image  # 只有讀圖的路徑才匯入 PIL
     if not os.path.isfile(image_path):
         raise FileNotFoundError(f"Image not found: {image_path}")
     try:
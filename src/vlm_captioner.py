@@ -1,11 +1,21 @@
 import os
 import time
 import base64
-from typing import List, Dict
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Callable, List, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from openai import OpenAI, OpenAIError
-from tqdm import tqdm
 import imghdr
+from src.rate_limit import RateLimiter
+from src.caption_cache import CaptionCache, get_default_caption_cache, prompt_version
+from src.image_preprocess import (
+    DEFAULT_JPEG_QUALITY, DEFAULT_MAX_SIDE, PreparedImage,
+    ignore_sigint, iter_preprocessed, log_savings, preprocess_image,
+)
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 CAPTION_PROMPT = (
     "請用一句話描述這張圖片的主要內容，包括：\n"
@@ -14,89 +24,311 @@ CAPTION_PROMPT = (
     "3. 場景特徵（室內/室外、時間、地點）\n\n"
     "請用繁體中文回答，50字以內。"
 )
+# 修改 CAPTION_PROMPT 後版本隨之改變，舊的 caption 快取不再命中
+CAPTION_PROMPT_VERSION = prompt_version(CAPTION_PROMPT)
+
+# 每張圖片完成時的回呼：(輸入順序, caption dict)
+ResultCallback = Callable[[int, dict], None]
+
+# 非同步模式下每個請求預估的 token 數（圖片 + prompt + 輸出），實際用量回來後修正
+ESTIMATED_TOKENS_PER_REQUEST = 1000
+
+
+def _caption_result(image_id: str, image_path: str, caption: str) -> dict:
+    return {
+        "image_id": image_id,
+        "image_path": image_path,
+        "caption": caption,
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z"
+    }
+
 
 class VLMCaptioner:
-    def __init__(self, api_key: str, model: str):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        base_url: Optional[str] = None,
+        cache: Optional[CaptionCache] = None,
+        max_side: int = DEFAULT_MAX_SIDE,
+        jpeg_quality: int = DEFAULT_JPEG_QUALITY,
+        preprocess_workers: int = 0,
+    ):
+        # base_url 可指向相容 OpenAI 的服務或本機 stub（scripts/stub_vlm_server.py）
+        self.api_key = api_key
+        self.base_url = base_url or None
+        self._client = None
         self.model = model
+        # 未指定時使用 Config.CAPTION_CACHE_DIR 的共用快取（可能為 None = 停用）
+        self.cache = cache or get_default_caption_cache()
+        # 上傳前縮圖 / 重新編碼（max_side <= 0 表示上傳原檔）；批次時在 process pool 執行
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.preprocess_workers = preprocess_workers
+        self.bytes_saved = 0
+
+    @property
+    def client(self):
+        """同步 OpenAI client；第一次真正呼叫 API 時才匯入 openai（全部命中快取時不需要）"""
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        return self._client
+
+    def _cache_lookup(self, image_path: str, count: bool = True):
+        """回傳 (圖片雜湊, 快取 caption)；快取停用或無法讀檔時為 (None, None)"""
+        if self.cache is None:
+            return None, None
+        try:
+            image_hash = self.cache.image_hash(image_path)
+        except OSError:
+            return None, None
+        return image_hash, self.cache.get(image_hash, self.model, CAPTION_PROMPT_VERSION, count=count)
+
+    def _cache_store(self, image_hash: Optional[str], caption: str):
+        if self.cache is not None and image_hash is not None:
+            self.cache.put(image_hash, self.model, CAPTION_PROMPT_VERSION, caption)
+
+    def _prepare(self, image_path: str, prepared: Optional[PreparedImage] = None) -> Optional[PreparedImage]:
+        """每張圖片只呼叫一次（在重試迴圈之外），節省量才不會隨重試重複計入；不縮圖時回傳 None"""
+        if prepared is None:
+            if self.max_side <= 0:
+                return None
+            prepared = preprocess_image(image_path, self.max_side, self.jpeg_quality)
+        self.bytes_saved += prepared.bytes_saved
+        if self.max_side > 0:
+            log_savings(image_path, prepared)
+        return prepared
+
+    def _build_payload(self, image_path: str, prepared: Optional[PreparedImage] = None) -> dict:
+        """prepared 為 _prepare 的結果；None 時直接送出原檔"""
+        if prepared is not None:
+            img_base64 = base64.b64encode(prepared.data).decode("utf-8")
+            mime_type = prepared.mime_type
+        else:
+            with open(image_path, "rb") as img_file:
+                img_bytes = img_file.read()
+                img_base64 = base64.b64encode(img_bytes).decode("utf-8")
+            img_type = imghdr.what(image_path)
+            if img_type == "png":
+                mime_type = "image/png"
+            else:
+                mime_type = "image/jpeg"
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": CAPTION_PROMPT},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime_type};base64,{img_base64}"
+                            }
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": 100,
+            "temperature": 0.2,
+        }
+
+    @staticmethod
+    def _extract_caption(response) -> str:
+        message = response.choices[0].message
+        if message and message.content:
+            return message.content.strip()
+        return "[ERROR] No caption returned"
 
     def generate_caption(self, image_path: str) -> dict:
+        return self._generate(image_path)[0]
+
+    def _generate(self, image_path: str, prepared: Optional[PreparedImage] = None):
+        """回傳 (結果, 是否來自快取)；prepared 為預先在 process pool 處理好的圖片"""
         image_id = os.path.splitext(os.path.basename(image_path))[0]
+        image_hash, cached = self._cache_lookup(image_path)
+        if cached is not None:
+            return _caption_result(image_id, image_path, cached), True
+        try:
+            prepared = self._prepare(image_path, prepared)
+        except Exception as e:
+            # 讀不到或無法解碼的圖片重試也不會成功
+            return _caption_result(image_id, image_path, f"[ERROR] {e}"), False
         for attempt in range(3):
             try:
-                with open(image_path, "rb") as img_file:
-                    img_bytes = img_file.read()
-                    img_base64 = base64.b64encode(img_bytes).decode("utf-8")
-                img_type = imghdr.what(image_path)
-                if img_type == "png":
-                    mime_type = "image/png"
-                else:
-                    mime_type = "image/jpeg"
-                payload = {
-                    "model": self.model,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": CAPTION_PROMPT},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:{mime_type};base64,{img_base64}"
-                                    }
-                                }
-                            ]
-                        }
-                    ],
-                    "max_tokens": 100,
-                    "temperature": 0.2,
-                }
+                payload = self._build_payload(image_path, prepared)
                 response = self.client.chat.completions.create(**payload)
                 print("[DEBUG] OpenAI response:", response)
-                message = response.choices[0].message
-                if message and message.content:
-                    caption = message.content.strip()
-                else:
-                    caption = "[ERROR] No caption returned"
-                return {
-                    "image_id": image_id,
-                    "image_path": image_path,
-                    "caption": caption,
-                    "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z"
-                }
-            except OpenAIError as e:
-                if attempt < 2:
-                    time.sleep(2)
-                else:
-                    return {
-                        "image_id": image_id,
-                        "image_path": image_path,
-                        "caption": f"[ERROR] {e}",
-                        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z"
-                    }
+                caption = self._extract_caption(response)
+                self._cache_store(image_hash, caption)
+                return _caption_result(image_id, image_path, caption), False
             except Exception as e:
                 if attempt < 2:
                     time.sleep(2)
                 else:
-                    return {
-                        "image_id": image_id,
-                        "image_path": image_path,
-                        "caption": f"[ERROR] {e}",
-                        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z"
-                    }
+                    return _caption_result(image_id, image_path, f"[ERROR] {e}"), False
             time.sleep(1.5)  # Rate limiting
 
         # Fallback if all retries fail (should not reach here)
-        return {
-            "image_id": image_id,
-            "image_path": image_path,
-            "caption": "[ERROR] Unknown error",
-            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z"
-        }
+        return _caption_result(image_id, image_path, "[ERROR] Unknown error"), False
 
-    def batch_generate(self, image_paths: List[str]) -> List[dict]:
+    def batch_generate(
+        self,
+        image_paths: List[str],
+        mode: str = "sync",
+        concurrency: int = 8,
+        requests_per_minute: float = 60,
+        tokens_per_minute: float = 0,
+        job_id: Optional[str] = None,
+        job_dir: str = "data/batch_jobs",
+        poll_interval: float = 30.0,
+        limiter: Optional[RateLimiter] = None,
+        on_result: Optional[ResultCallback] = None,
+    ) -> List[dict]:
+        """
+        mode="async" 時以並行請求 + token bucket 限流取代逐張處理與固定 sleep；
+        mode="batch" 時經由 OpenAI Batch API 離線處理，可用 job_id 續跑中斷的 job。結果皆維持輸入順序。
+        on_result 在每張圖片完成時呼叫（完成順序），供呼叫端串流處理；
+        limiter 為 async 模式共用的限流器，未指定時依 requests/tokens_per_minute 建立。
+        """
+        if mode == "batch":
+            from src.batch_captioner import BatchCaptionJob
+            job = BatchCaptionJob(self, job_dir=job_dir, job_id=job_id, poll_interval=poll_interval)
+            results = job.run(image_paths, on_result=on_result)
+            self._log_summary()
+            return results
+        if mode == "async":
+            return asyncio.run(self.abatch_generate(
+                image_paths, concurrency=concurrency,
+                requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+                limiter=limiter, on_result=on_result,
+            ))
+        # 只有快取未命中的圖片需要前處理，在背景 process pool 中領先處理
+        needs_upload = [self._cache_lookup(p, count=False)[1] is None for p in image_paths]
+        prepared_iter = None
+        if self.max_side > 0 and any(needs_upload):
+            prepared_iter = iter_preprocessed(
+                [p for p, n in zip(image_paths, needs_upload) if n],
+                self.max_side, self.jpeg_quality, workers=self.preprocess_workers,
+            )
+        from tqdm import tqdm
         results = []
-        for path in tqdm(image_paths, desc="生成描述"):
-            results.append(self.generate_caption(path))
-            time.sleep(1.5)  # Rate limiting
+        try:
+            for i, (path, needed) in enumerate(zip(tqdm(image_paths, desc="生成描述"), needs_upload)):
+                prepared = None
+                if needed and prepared_iter is not None:
+                    _, prepared = next(prepared_iter)
+                    if isinstance(prepared, Exception):
+                        prepared = None  # 交給 _generate 重試並回報錯誤
+                result, from_cache = self._generate(path, prepared)
+                results.append(result)
+                if on_result is not None:
+                    on_result(i, result)
+                if not from_cache:  # 快取命中不經過 API，不需要限流等待
+                    time.sleep(1.5)  # Rate limiting
+        finally:
+            if prepared_iter is not None:
+                prepared_iter.close()
+        self._log_summary()
+        return results
+
+    def _log_summary(self):
+        if self.cache is not None:
+            stats = self.cache.stats()
+            logging.info(f"Caption 快取: 命中 {stats['hits']}、未命中 {stats['misses']}")
+        if self.max_side > 0:
+            logging.info(f"圖片前處理共節省 {self.bytes_saved / 1024 / 1024:.1f} MB 上傳量")
+
+    async def agenerate_caption(
+        self,
+        image_path: str,
+        client: "AsyncOpenAI",
+        limiter: RateLimiter,
+        executor: Optional[ProcessPoolExecutor] = None,
+    ) -> dict:
+        """非同步版 generate_caption：限流由 limiter 負責，429 與暫時性錯誤以指數退避重試"""
+        from openai import RateLimitError
+        image_id = os.path.splitext(os.path.basename(image_path))[0]
+        image_hash, cached = await asyncio.to_thread(self._cache_lookup, image_path)
+        if cached is not None:
+            return _caption_result(image_id, image_path, cached)
+        prepared = None
+        if executor is not None:
+            try:
+                prepared = await asyncio.get_running_loop().run_in_executor(
+                    executor, preprocess_image, image_path, self.max_side, self.jpeg_quality
+                )
+            except Exception:
+                prepared = None  # 交給下方的 _prepare 再試一次並回報錯誤
+        try:
+            prepared = await asyncio.to_thread(self._prepare, image_path, prepared)
+            payload = await asyncio.to_thread(self._build_payload, image_path, prepared)
+        except Exception as e:
+            logging.error(f"Caption 失敗: {image_path} ({e})")
+            return _caption_result(image_id, image_path, f"[ERROR] {e}")
+        last_error = "Unknown error"
+        for attempt in range(3):
+            # 只有 API 呼叫本身會重試；限流器的例外直接往上拋，不會在沒有取得額度時送出請求
+            await limiter.acquire(ESTIMATED_TOKENS_PER_REQUEST)
+            try:
+                response = await client.chat.completions.create(**payload)
+            except RateLimitError as e:
+                last_error = e
+                await asyncio.sleep(2 ** (attempt + 1))
+                continue
+            except Exception as e:
+                last_error = e
+                if attempt < 2:
+                    await asyncio.sleep(2)
+                continue
+            usage = getattr(response, "usage", None)
+            limiter.record_usage(ESTIMATED_TOKENS_PER_REQUEST, getattr(usage, "total_tokens", None))
+            caption = self._extract_caption(response)
+            await asyncio.to_thread(self._cache_store, image_hash, caption)
+            return _caption_result(image_id, image_path, caption)
+        logging.error(f"Caption 失敗: {image_path} ({last_error})")
+        return _caption_result(image_id, image_path, f"[ERROR] {last_error}")
+
+    async def abatch_generate(
+        self,
+        image_paths: List[str],
+        concurrency: int = 8,
+        requests_per_minute: float = 60,
+        tokens_per_minute: float = 0,
+        limiter: Optional[RateLimiter] = None,
+        on_result: Optional[ResultCallback] = None,
+    ) -> List[dict]:
+        """
+        以 concurrency 個 worker 並行生成描述；requests/tokens_per_minute 為 0 表示不限。
+        整批共用一個限流器、HTTP client 與前處理 process pool。
+        """
+        from openai import AsyncOpenAI
+        from tqdm import tqdm
+        limiter = limiter or RateLimiter(requests_per_minute, tokens_per_minute)
+        results: List[Optional[dict]] = [None] * len(image_paths)
+        progress = tqdm(total=len(image_paths), desc="生成描述")
+        todo = iter(enumerate(image_paths))
+
+        executor = None
+        if self.max_side > 0:
+            executor = ProcessPoolExecutor(max_workers=self.preprocess_workers or os.cpu_count() or 1,
+                                           initializer=ignore_sigint)
+
+        async def worker(client: "AsyncOpenAI"):
+            # 固定數量的 worker 依序領取圖片，不必為每張圖片各建一個 task
+            for i, path in todo:
+                results[i] = await self.agenerate_caption(path, client, limiter, executor)
+                progress.update(1)
+                if on_result is not None:
+                    on_result(i, results[i])
+
+        try:
+            async with AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0) as client:
+                await asyncio.gather(*(worker(client) for _ in range(max(1, concurrency))))
+        finally:
+            progress.close()
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+        self._log_summary()
         return results
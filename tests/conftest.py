@@ -0,0 +1,85 @@
+"""
+測試共用的 fixture：本機 stub VLM server、測試圖片、以 caption 雜湊產生向量的假 embedder
+
+執行（專案根目錄）：python -m pytest -q
+"""
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from scripts import stub_vlm_server  # noqa: E402
+from src import embedding_cache, embedding_registry, vlm_captioner  # noqa: E402
+
+EMBEDDING_DIM = 16
+FAKE_MODEL = "fake-embedding-model"
+
+
+class HashEmbedder:
+    """sentence-transformers 相容的 encode()：相同文字永遠得到相同的向量"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.calls = 0
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big")
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+
+    def encode(self, sentences, **kwargs):
+        self.calls += 1
+        if isinstance(sentences, str):
+            return self._vector(sentences)
+        return np.stack([self._vector(t) for t in sentences])
+
+
+@pytest.fixture(autouse=True)
+def no_shared_caches(monkeypatch):
+    """測試不讀寫 data/ 下的共用 caption / embedding 快取"""
+    monkeypatch.setattr(vlm_captioner, "get_default_caption_cache", lambda: None)
+    monkeypatch.setattr(embedding_cache, "get_default_cache", lambda: None)
+
+
+@pytest.fixture
+def fake_embedder(monkeypatch):
+    """以 HashEmbedder 取代 manual 模式的 sentence-transformers model（model 名稱為 FAKE_MODEL）"""
+    embedder = HashEmbedder()
+    key = (FAKE_MODEL, embedding_registry.BACKEND_SENTENCE_TRANSFORMERS)
+    monkeypatch.setitem(embedding_registry._models, key, embedder)
+    return embedder
+
+
+@pytest.fixture
+def stub_server():
+    """在背景執行緒啟動 stub（隨機 port），server.state 可查詢請求數與 batch"""
+    server = stub_vlm_server.serve(port=0, delay=0.0, batch_delay=0.1)
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    """12 張內容互不相同的小圖"""
+    from PIL import Image
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    paths = []
+    for i in range(12):
+        path = image_dir / f"img{i:02d}.png"
+        Image.new("RGB", (64, 48), (i * 20, 255 - i * 20, (i * 53) % 256)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def make_captioner(server, **kwargs) -> vlm_captioner.VLMCaptioner:
+    kwargs.setdefault("max_side", 0)
+    kwargs.setdefault("model", "stub-model")
+    return vlm_captioner.VLMCaptioner(api_key="stub", base_url=server.base_url, **kwargs)
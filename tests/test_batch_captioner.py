@@ -0,0 +1,60 @@
+"""BatchCaptionJob 對 scripts/stub_vlm_server.py 的 Files / Batches API 完整走一次，並以 job id 續跑"""
+import json
+import os
+
+from conftest import make_captioner
+from src.batch_captioner import BatchCaptionJob, new_job_id
+from src.vlm_captioner import DEFAULT_MAX_SIDE
+
+
+def test_batch_job_matches_online_captions(tmp_path, stub_server, image_paths):
+    # 與線上模式相同的前處理與 payload，stub 依圖片內容產生的 caption 應一致
+    captioner = make_captioner(stub_server, max_side=DEFAULT_MAX_SIDE, preprocess_workers=1)
+    online = captioner.batch_generate(image_paths, mode="async", concurrency=4, requests_per_minute=0)
+    requests_before = stub_server.state.requests
+
+    job_dir = tmp_path / "batch_jobs"
+    seen = {}
+    job = BatchCaptionJob(captioner, job_dir=str(job_dir), poll_interval=0.05, max_requests=5)
+    results = job.run(image_paths, on_result=lambda i, r: seen.setdefault(i, []).append(r["caption"]))
+
+    assert [r["image_path"] for r in results] == image_paths
+    assert [r["caption"] for r in results] == [r["caption"] for r in online]
+    assert not any(r["caption"].startswith("[ERROR]") for r in results)
+    # 每張圖片恰好回呼一次
+    assert sorted(seen) == list(range(len(image_paths)))
+    assert all(len(v) == 1 for v in seen.values())
+    # 12 個請求、每個 part 最多 5 個：3 個 batch
+    assert len(stub_server.state.batches) == 3
+    assert stub_server.state.requests - requests_before == len(image_paths)
+
+    with open(job_dir / f"{job.job_id}.json", encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["image_paths"] == image_paths
+    assert all(part["collected"] for part in state["parts"])
+
+    # 以相同 job id 續跑：直接由結果檔組裝，不再建立 batch 或送出請求
+    resumed = BatchCaptionJob(captioner, job_dir=str(job_dir), job_id=job.job_id, poll_interval=0.05).run()
+    assert [(r["image_path"], r["caption"]) for r in resumed] == [(r["image_path"], r["caption"]) for r in results]
+    assert len(stub_server.state.batches) == 3
+    assert stub_server.state.requests - requests_before == len(image_paths)
+
+
+def test_batch_job_reports_failed_requests(tmp_path, stub_server, image_paths):
+    stub_server.state.fail_every = 4
+    captioner = make_captioner(stub_server)
+    results = captioner.batch_generate(
+        image_paths, mode="batch", job_dir=str(tmp_path / "batch_jobs"), poll_interval=0.05
+    )
+
+    errors = [r for r in results if r["caption"].startswith("[ERROR]")]
+    assert len(errors) == len(image_paths) // 4
+    assert all("stub failure" in r["caption"] for r in errors)
+    assert [r["image_path"] for r in results] == image_paths
+    assert os.listdir(tmp_path / "batch_jobs")
+
+
+def test_job_ids_unique_within_one_second():
+    # 同時啟動的多個 shard 不可共用狀態檔
+    ids = {new_job_id() for _ in range(200)}
+    assert len(ids) == 200
@@ -0,0 +1,51 @@
+"""VLMCaptioner：以內容定址的 caption 快取"""
+import shutil
+
+from PIL import Image
+
+from conftest import make_captioner
+from src import vlm_captioner
+from src.caption_cache import CaptionCache
+
+ASYNC = {"mode": "async", "concurrency": 4, "requests_per_minute": 0}
+
+
+def test_caption_cache_skips_unchanged_images(tmp_path, stub_server, image_paths):
+    cache = CaptionCache(str(tmp_path / "cache"))
+    captioner = make_captioner(stub_server, cache=cache)
+    first = captioner.batch_generate(image_paths, **ASYNC)
+    assert stub_server.state.requests == len(image_paths)
+
+    # 再跑一次全部命中，不送出任何請求；複製到其他路徑的相同內容也命中
+    copy = str(tmp_path / "copy.png")
+    shutil.copy(image_paths[0], copy)
+    second = make_captioner(stub_server, cache=CaptionCache(str(tmp_path / "cache"))).batch_generate(
+        image_paths + [copy], **ASYNC
+    )
+    assert stub_server.state.requests == len(image_paths)
+    assert [r["caption"] for r in second] == [r["caption"] for r in first] + [first[0]["caption"]]
+
+    # 圖片內容改變後失效
+    Image.new("RGB", (64, 48), (1, 2, 3)).save(image_paths[1])
+    captioner.batch_generate(image_paths[:2], **ASYNC)
+    assert stub_server.state.requests == len(image_paths) + 1
+
+
+def test_caption_cache_keyed_on_model_and_prompt(tmp_path, stub_server, image_paths, monkeypatch):
+    cache = CaptionCache(str(tmp_path / "cache"))
+    make_captioner(stub_server, cache=cache).batch_generate(image_paths[:3], **ASYNC)
+    make_captioner(stub_server, cache=cache, model="other-model").batch_generate(image_paths[:3], **ASYNC)
+    assert stub_server.state.requests == 6
+
+    monkeypatch.setattr(vlm_captioner, "CAPTION_PROMPT_VERSION", "changed")
+    make_captioner(stub_server, cache=cache).batch_generate(image_paths[:3], **ASYNC)
+    assert stub_server.state.requests == 9
+
+
+def test_error_captions_are_not_cached(tmp_path):
+    cache = CaptionCache(str(tmp_path))
+    assert not cache.put("hash", "model", "v1", "[ERROR] timeout")
+    assert cache.get("hash", "model", "v1") is None
+    assert cache.put("hash", "model", "v1", "海邊的夕陽")
+    cache.close()
+    assert CaptionCache(str(tmp_path)).get("hash", "model", "v1") == "海邊的夕陽"
@@ -0,0 +1,66 @@
+"""embedding 快取：只計算未命中的文字、LRU 淘汰保留最近用過的項目、大小統計正確"""
+import itertools
+
+import numpy as np
+
+from conftest import HashEmbedder
+from src import embedding_cache
+from src.embedding_cache import CachedEmbedder, EmbeddingCache
+
+MODEL_KEY = "sentence_transformers:fake"
+VECTOR_BYTES = 16 * 4
+
+
+def _table_bytes(cache: EmbeddingCache) -> int:
+    return cache._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+
+
+def test_cached_embedder_computes_only_misses(tmp_path):
+    model = HashEmbedder()
+    embedder = CachedEmbedder(model, MODEL_KEY, EmbeddingCache(str(tmp_path)))
+    first = embedder.encode(["海邊", "夕陽", "海邊"])
+    assert model.calls == 1
+    np.testing.assert_array_equal(first, np.stack([model.encode(t) for t in ["海邊", "夕陽", "海邊"]]))
+
+    # 正規化後相同的文字視為命中；只有新文字送進 model
+    calls = model.calls
+    second = embedder.encode(["  海邊 ", "夕陽", "黑貓"])
+    assert model.calls == calls + 1
+    np.testing.assert_array_equal(second[:2], first[:2])
+    assert embedder.cache.stats()["hits"] == 2
+
+    # 重新開啟同一個快取檔仍命中
+    embedder.cache.close()
+    reopened = CachedEmbedder(model, MODEL_KEY, EmbeddingCache(str(tmp_path)))
+    calls = model.calls
+    np.testing.assert_array_equal(reopened.encode("黑貓"), second[2])
+    assert model.calls == calls
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: float(next(clock)))
+    cache = EmbeddingCache(str(tmp_path), max_bytes=10 * VECTOR_BYTES)
+    model = HashEmbedder()
+    texts = [f"caption {i}" for i in range(10)]
+    cache.put_many(MODEL_KEY, texts, model.encode(texts))
+    hot = texts[:3]
+    assert all(v is not None for v in cache.get_many(MODEL_KEY, hot))
+
+    more = [f"caption {i}" for i in range(10, 15)]
+    cache.put_many(MODEL_KEY, more, model.encode(more))
+    # 超過上限時淘汰到 90% 以下：最舊、且沒有再被讀取的 caption 3..8 被淘汰
+    stats = cache.stats()
+    assert stats["bytes"] <= 10 * VECTOR_BYTES
+    assert stats["bytes"] == _table_bytes(cache) == stats["entries"] * VECTOR_BYTES
+    present = [t for t, v in zip(texts + more, cache.get_many(MODEL_KEY, texts + more)) if v is not None]
+    assert present == hot + ["caption 9"] + more
+
+
+def test_total_bytes_follows_replacements(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    cache.put_many(MODEL_KEY, ["a", "b"], np.ones((2, 16), dtype=np.float32))
+    cache.put_many(MODEL_KEY, ["a"], np.ones((1, 32), dtype=np.float32))
+    assert cache.stats()["bytes"] == _table_bytes(cache) == 16 * 4 + 32 * 4
+    cache.close()
+    assert EmbeddingCache(str(tmp_path)).stats()["bytes"] == 16 * 4 + 32 * 4
@@ -0,0 +1,132 @@
+"""共用 embedding server：並發請求合併成批次、結果與直接推論一致，server 模式查詢與 manual 相同"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from conftest import FAKE_MODEL, HashEmbedder
+from src import embedding_registry
+from src.embedding_service import EmbeddingClient, EmbeddingServer, MicroBatcher
+from src.rag_indexer import RAGIndexer
+from src.rag_query import RAGQuery
+
+
+class _SlowEmbedder(HashEmbedder):
+    """每次推論固定耗時，讓推論期間到達的請求在佇列中累積；記錄每批的文字數"""
+
+    def __init__(self, delay: float = 0.05):
+        super().__init__()
+        self.delay = delay
+        self.batch_sizes = []
+
+    def encode(self, sentences, **kwargs):
+        self.batch_sizes.append(len(sentences))
+        time.sleep(self.delay)
+        return super().encode(sentences)
+
+
+def _serve(embedder, max_batch: int = 64, max_wait: float = 0.02) -> EmbeddingServer:
+    server = EmbeddingServer("127.0.0.1", 0, FAKE_MODEL, MicroBatcher(embedder.encode, max_batch, max_wait))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    return server
+
+
+@pytest.fixture
+def server():
+    embedder = _SlowEmbedder()
+    server = _serve(embedder)
+    server.embedder = embedder
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.batcher.close()
+
+
+def test_concurrent_requests_are_batched(server):
+    client = EmbeddingClient(server.url, FAKE_MODEL)
+    requests = [[f"請求 {i} 文字 {j}" for j in range(i % 3 + 1)] for i in range(16)]
+    results = [None] * len(requests)
+    start = threading.Barrier(len(requests))
+
+    def worker(i):
+        start.wait()
+        results[i] = client.encode(requests[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(requests))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    reference = HashEmbedder()
+    for texts, vectors in zip(requests, results):
+        np.testing.assert_array_equal(vectors, reference.encode(texts))
+
+    stats = client.health()
+    n_texts = sum(len(texts) for texts in requests)
+    assert stats["model"] == FAKE_MODEL
+    assert stats["requests"] == len(requests)
+    assert stats["texts"] == n_texts == sum(server.embedder.batch_sizes)
+    # 16 個並發請求只推論了少數幾批
+    assert stats["batches"] == len(server.embedder.batch_sizes) < len(requests)
+    assert stats["max_batch_seen"] > 3
+
+
+def test_batches_respect_max_batch():
+    embedder = _SlowEmbedder(delay=0.01)
+    batcher = MicroBatcher(embedder.encode, max_batch=5, max_wait=0.05)
+    try:
+        futures = [batcher.submit([f"t{i}-{j}" for j in range(2)]) for i in range(10)]
+        vectors = [f.result(timeout=5) for f in futures]
+    finally:
+        batcher.close()
+    assert all(v.shape == (2, embedder.dim) for v in vectors)
+    # 一個請求不會被拆開，因此每批最多 max_batch + 請求大小 - 1 筆
+    assert max(embedder.batch_sizes) <= 6
+    assert sum(embedder.batch_sizes) == 20
+
+
+def test_single_text_and_errors(server):
+    client = EmbeddingClient(server.url, FAKE_MODEL)
+    np.testing.assert_array_equal(client.encode("海邊"), HashEmbedder().encode("海邊"))
+    assert client.encode([]).shape == (0, 0)
+    with pytest.raises(RuntimeError, match="HTTP 400"):
+        EmbeddingClient(server.url, "other-model").encode(["海邊"])
+
+
+def test_encode_failure_reaches_every_waiting_request():
+    def broken(texts):
+        time.sleep(0.02)
+        raise RuntimeError("CUDA out of memory")
+
+    batcher = MicroBatcher(broken, max_batch=64, max_wait=0.05)
+    try:
+        futures = [batcher.submit([f"t{i}"]) for i in range(4)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="out of memory"):
+                future.result(timeout=5)
+    finally:
+        batcher.close()
+
+
+def test_server_mode_query_matches_manual(tmp_path, fake_embedder, monkeypatch):
+    server = _serve(HashEmbedder())
+    monkeypatch.setenv("EMBEDDING_SERVER_URL", server.url)
+    try:
+        chroma_dir = str(tmp_path / "chroma")
+        captions = [{"image_id": f"img{i}", "image_path": f"/photos/img{i}.jpg", "caption": c}
+                    for i, c in enumerate(["海邊的夕陽", "公園裡的小狗", "桌上的咖啡", "黑貓睡在沙發上"])]
+        assert RAGIndexer(chroma_dir, "images", FAKE_MODEL, "server").batch_index(captions) == len(captions)
+        calls = fake_embedder.calls
+        via_server = RAGQuery(chroma_dir, "images", FAKE_MODEL, "server").query("小狗", top_k=2)
+        manual = RAGQuery(chroma_dir, "images", FAKE_MODEL, "manual").query("小狗", top_k=2)
+        assert via_server["results"] == manual["results"]
+        # 索引與 server 模式查詢都不在本行程推論（本行程只有 manual 查詢用到 fake_embedder）
+        assert fake_embedder.calls - calls == 1
+    finally:
+        embedding_registry.release(FAKE_MODEL, embedding_registry.BACKEND_SERVER)
+        server.shutdown()
+        server.server_close()
+        server.batcher.close()
@@ -0,0 +1,51 @@
+"""增量索引的檔案清單：新增、內容變更、只改時間與刪除的判斷"""
+import os
+
+from PIL import Image
+
+from src.file_manifest import FileManifest
+
+
+def _touch_later(path: str):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+def test_scan_classifies_changes(tmp_path, image_paths):
+    manifest = FileManifest.open(str(tmp_path / "chroma"), "test_images")
+    first = manifest.scan(image_paths, root=str(tmp_path / "images"))
+    assert first.new == image_paths and first.to_index == image_paths
+    manifest.record(first.new, first.file_info)
+    assert len(manifest) == len(image_paths)
+
+    # 沒有變動：只 stat，不重新計算雜湊
+    again = manifest.scan(image_paths, root=str(tmp_path / "images"))
+    assert again.unchanged == len(image_paths) and not again.to_index and not again.file_info
+
+    _touch_later(image_paths[0])
+    Image.new("RGB", (64, 48), (1, 2, 3)).save(image_paths[1])
+    _touch_later(image_paths[1])
+    os.remove(image_paths[2])
+    remaining = [p for p in image_paths if p != image_paths[2]]
+    scan = manifest.scan(remaining, root=str(tmp_path / "images"))
+    assert scan.touched == [image_paths[0]]
+    assert scan.changed == [image_paths[1]]
+    assert scan.new == []
+    assert [e.path for e in scan.deleted] == [os.path.abspath(image_paths[2])]
+    assert scan.unchanged == len(image_paths) - 3
+
+
+def test_deletions_limited_to_root(tmp_path, image_paths):
+    manifest = FileManifest.open(str(tmp_path / "chroma"), "test_images")
+    manifest.record(image_paths, {})
+    # 只掃描其他目錄（例如 --max 或子目錄）時，不把 root 之外的紀錄當成刪除
+    other = tmp_path / "other"
+    other.mkdir()
+    extra = str(other / "extra.png")
+    Image.new("RGB", (8, 8)).save(extra)
+    scan = manifest.scan([extra], root=str(other))
+    assert scan.new == [extra] and scan.deleted == []
+
+    manifest.remove(image_paths[:4])
+    manifest.close()
+    assert len(FileManifest.open(str(tmp_path / "chroma"), "test_images")) == len(image_paths) - 4
@@ -0,0 +1,69 @@
+"""上傳前處理：縮圖、去除 metadata，以及重試時節省量只計一次"""
+import io
+
+import numpy as np
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from conftest import make_captioner
+from src.image_preprocess import preprocess_image
+
+
+def _noise(width: int, height: int, seed: int = 0) -> Image.Image:
+    pixels = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def _gps_exif() -> Image.Exif:
+    exif = Image.Exif()
+    exif[0x010F] = "TestCamera"  # Make
+    exif[0x8825] = {1: "N", 2: (25.0, 2.0, 0.0)}  # GPSInfo
+    return exif
+
+
+def test_large_image_is_downscaled_and_stripped(tmp_path):
+    path = str(tmp_path / "big.jpg")
+    _noise(800, 600).save(path, quality=95, exif=_gps_exif())
+    prepared = preprocess_image(path, max_side=256, quality=80)
+    assert prepared.mime_type == "image/jpeg"
+    assert (prepared.width, prepared.height) == (256, 192)
+    assert prepared.bytes_saved > 0
+    with Image.open(io.BytesIO(prepared.data)) as out:
+        assert out.size == (256, 192)
+        assert not len(out.getexif())
+
+
+def test_small_original_kept_only_without_metadata(tmp_path):
+    # 小張 PNG 重新編碼為 JPEG 反而變大：不含 metadata 時沿用原檔
+    plain = str(tmp_path / "plain.png")
+    Image.new("RGB", (64, 48), (10, 20, 30)).save(plain)
+    prepared = preprocess_image(plain, max_side=1024)
+    with open(plain, "rb") as f:
+        assert prepared.data == f.read()
+    assert prepared.mime_type == "image/png"
+
+    # 同樣不會變小，但原檔帶有 EXIF / GPS：仍送出去除 metadata 的版本
+    tagged = str(tmp_path / "tagged.jpg")
+    _noise(64, 48).save(tagged, quality=30, exif=_gps_exif())
+    prepared = preprocess_image(tagged, max_side=1024, quality=95)
+    assert prepared.bytes_saved < 0
+    with Image.open(io.BytesIO(prepared.data)) as out:
+        assert not len(out.getexif())
+        assert "exif" not in out.info
+
+    texted = str(tmp_path / "texted.png")
+    info = PngInfo()
+    info.add_text("Location", "25.03N 121.56E")
+    Image.new("RGB", (64, 48), (10, 20, 30)).save(texted, pnginfo=info)
+    prepared = preprocess_image(texted, max_side=1024)
+    assert prepared.mime_type == "image/jpeg"
+
+
+def test_savings_counted_once_per_image_under_retries(stub_server, image_paths):
+    stub_server.state.fail_every = 2
+    captioner = make_captioner(stub_server, max_side=32, preprocess_workers=1)
+    paths = image_paths[:4]
+    results = captioner.batch_generate(paths, mode="async", concurrency=4, requests_per_minute=0)
+    assert not any(r["caption"].startswith("[ERROR]") for r in results)
+    assert stub_server.state.requests > len(paths)
+    assert captioner.bytes_saved == sum(preprocess_image(p, 32).bytes_saved for p in paths)
@@ -0,0 +1,167 @@
+"""索引流程：caption → embed → persist 串流寫入、中斷後以 journal 續跑、限流對整個流程（跨多次呼叫）生效"""
+import os
+import time
+
+import numpy as np
+import pytest
+
+from conftest import FAKE_MODEL, make_captioner
+from src import ingest_pipeline
+from src.ingest_journal import IngestJournal
+from src.ingest_pipeline import IngestPipeline
+from src.rag_indexer import RAGIndexer, SimpleVectorDB
+from src.rate_limit import AsyncTokenBucket, RateLimiter
+
+COLLECTION = "test_images"
+
+
+def db_rows(chroma_dir):
+    return sorted(m["image_path"] for m in SimpleVectorDB.open(str(chroma_dir), COLLECTION).live_metadata())
+
+
+def _indexer(chroma_dir) -> RAGIndexer:
+    return RAGIndexer(str(chroma_dir), COLLECTION, FAKE_MODEL, "manual", embed_batch_size=4, lexical_index=False)
+
+
+class _BurstLimiter(RateLimiter):
+    """RPM bucket 容量只有 burst，讓少量請求就能觀察到限流；grants 記錄每次放行的時間"""
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0, burst: float = 2):
+        super().__init__(requests_per_minute, tokens_per_minute)
+        self.requests = AsyncTokenBucket(requests_per_minute, capacity=burst)
+        self.burst = burst
+        self.grants = []
+        self.errors = []  # acquire 拋出的例外，呼叫端不可吞掉後重試
+
+    async def acquire(self, estimated_tokens: int):
+        try:
+            await super().acquire(estimated_tokens)
+        except Exception as e:
+            self.errors.append(e)
+            raise
+        self.grants.append(time.monotonic())
+
+    def assert_paced(self):
+        """任一段時間內的放行數不超過 burst + rate * 經過時間（跨多次呼叫也成立）"""
+        grants = sorted(self.grants)
+        for i in range(len(grants)):
+            for j in range(i, len(grants)):
+                assert j - i + 1 <= self.burst + self.requests.rate * (grants[j] - grants[i]) + 0.25
+
+
+def test_journal_replay_after_interrupt(tmp_path, stub_server, image_paths, fake_embedder):
+    chroma_dir = tmp_path / "chroma"
+    stub_server.state.delay = 0.05
+    captioner = make_captioner(stub_server)
+    caption_kwargs = {"mode": "async", "concurrency": 1, "requests_per_minute": 0}
+
+    indexer = _indexer(chroma_dir)
+
+    def interrupted_persist():
+        raise KeyboardInterrupt()
+
+    indexer.persist = interrupted_persist
+    journal = IngestJournal.open(str(chroma_dir), COLLECTION, flush_every=1)
+    pipeline = IngestPipeline(captioner, indexer, caption_kwargs, commit_every=4, journal=journal)
+    with pytest.raises(KeyboardInterrupt):
+        pipeline.run(image_paths)
+
+    # 中斷前沒有 commit，向量庫仍是空的；journal 保留已完成的 caption 與 embedding
+    assert SimpleVectorDB.open(str(chroma_dir), COLLECTION).count() == 0
+    journal = IngestJournal.open(str(chroma_dir), COLLECTION)
+    captions, embedded = journal.replay()
+    embedded_paths = {meta["image_path"] for _, meta in embedded}
+    assert 0 < len(captions) < len(image_paths)
+    assert len(embedded) >= 4
+    assert embedded_paths <= set(captions)
+    for vec, meta in embedded:
+        np.testing.assert_allclose(vec, fake_embedder.encode(meta["caption"]), rtol=1e-6)
+
+    # 續跑（與 index_images.py --resume 相同）：已 embed 的直接寫入，只有 caption 的不再呼叫 VLM
+    indexer = _indexer(chroma_dir)
+    indexer.add_embedded(np.stack([vec for vec, _ in embedded]), [meta for _, meta in embedded])
+    indexer.persist()
+    precaptioned = [c for path, c in captions.items() if path not in embedded_paths]
+    remaining = [p for p in image_paths if p not in captions]
+    requests_before = stub_server.state.requests
+    stats = IngestPipeline(captioner, indexer, caption_kwargs, commit_every=4, journal=journal).run(
+        remaining, precaptioned=precaptioned
+    )
+    journal.clear()
+
+    assert stub_server.state.requests - requests_before == len(remaining)
+    assert stats["indexed"] == len(image_paths) - len(embedded)
+    assert db_rows(chroma_dir) == sorted(image_paths)
+    assert len(IngestJournal.open(str(chroma_dir), COLLECTION)) == 0
+
+
+def test_pipeline_shares_one_rate_limiter(tmp_path, stub_server, image_paths, fake_embedder, monkeypatch):
+    created = []
+
+    def limiter_factory(*args):
+        created.append(_BurstLimiter(*args))
+        return created[-1]
+
+    monkeypatch.setattr(ingest_pipeline, "RateLimiter", limiter_factory)
+    captioner = make_captioner(stub_server)
+    # 300 RPM = 每秒 5 個請求，bucket 容量 2：12 個請求至少需要 (12 - 2) / 5 = 2 秒
+    caption_kwargs = {"mode": "async", "concurrency": 4, "requests_per_minute": 300}
+    stats = IngestPipeline(captioner, _indexer(tmp_path / "chroma"), caption_kwargs, commit_every=4).run(image_paths)
+
+    assert stats["indexed"] == len(image_paths)
+    assert stub_server.state.requests == len(image_paths)
+    assert len(created) == 1
+    limiter = created[0]
+    assert limiter.errors == []
+    assert len(limiter.grants) == len(image_paths)
+    limiter.assert_paced()
+    assert db_rows(tmp_path / "chroma") == sorted(image_paths)
+
+
+def test_shared_limiter_spans_separate_calls(stub_server, image_paths):
+    captioner = make_captioner(stub_server)
+    limiter = _BurstLimiter(300)
+    half = len(image_paths) // 2
+    first = captioner.batch_generate(image_paths[:half], mode="async", concurrency=4, limiter=limiter)
+    second = captioner.batch_generate(image_paths[half:], mode="async", concurrency=4, limiter=limiter)
+
+    assert [r["image_path"] for r in first + second] == image_paths
+    assert not any(r["caption"].startswith("[ERROR]") for r in first + second)
+    # 每次呼叫都是新的 event loop；同一個 bucket 必須持續限流，第二次呼叫不會重新取得 burst
+    assert limiter.errors == []
+    assert len(limiter.grants) == stub_server.state.requests == len(image_paths)
+    limiter.assert_paced()
+    assert limiter.grants[-1] - limiter.grants[0] >= (len(image_paths) - limiter.burst) / limiter.requests.rate - 0.1
+
+
+class _BrokenLimiter(RateLimiter):
+    async def acquire(self, estimated_tokens: int):
+        raise RuntimeError("limiter broken")
+
+
+def test_limiter_errors_are_not_retried(stub_server, image_paths):
+    captioner = make_captioner(stub_server)
+    with pytest.raises(RuntimeError, match="limiter broken"):
+        captioner.batch_generate(image_paths[:2], mode="async", limiter=_BrokenLimiter())
+    # 沒有取得額度就不送出請求
+    assert stub_server.state.requests == 0
+
+
+def test_journal_ignores_partial_checkpoints(tmp_path):
+    journal = IngestJournal(str(tmp_path / "journal"), flush_every=2)
+    journal.add_captions([{"image_path": "/a.jpg", "caption": "a"}, {"image_path": "/b.jpg", "caption": "b"}])
+    journal.add_embedded(np.ones((2, 4)), [{"image_path": "/a.jpg"}, {"image_path": "/a.jpg", "v": 2}])
+    assert len(journal) == 2
+    # 寫到一半被中斷的暫存檔與損毀的 checkpoint 都被略過；同一圖片以最後一筆為準
+    (tmp_path / "journal" / "ckpt-000003.npz.tmp").write_bytes(b"partial")
+    (tmp_path / "journal" / "ckpt-000004.npz").write_bytes(b"garbage")
+    reopened = IngestJournal(str(tmp_path / "journal"))
+    captions, embedded = reopened.replay()
+    assert sorted(captions) == ["/a.jpg", "/b.jpg"]
+    assert [meta for _, meta in embedded] == [{"image_path": "/a.jpg", "v": 2}]
+    # 新的 checkpoint 接在既有編號之後，不覆寫
+    reopened.add_captions([{"image_path": "/c.jpg", "caption": "c"}])
+    reopened.flush()
+    assert os.path.isfile(tmp_path / "journal" / "ckpt-000005.npz")
+    reopened.clear()
+    assert len(reopened) == 0 and reopened.replay() == ({}, [])
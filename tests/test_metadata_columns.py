@@ -0,0 +1,56 @@
+"""欄式 metadata：寫入後逐列、整欄讀回皆與原始 dict 相同，path 前綴與時間可直接由欄位求出"""
+import numpy as np
+import pytest
+
+from src import index_format, metadata_columns
+
+METAS = [
+    {"image_id": "a", "image_path": "/photos/trip/a.jpg", "caption": "海邊夕陽", "indexed_at": "2026-01-01T08:00:00"},
+    {"image_id": "b", "image_path": "/photos/trip/b.jpg", "caption": "", "indexed_at": "2026-01-01T09:30:00.123456",
+     "duplicate_of": "/photos/trip/a.jpg"},
+    {"image_id": "c", "image_path": "/photos/home/c.png", "caption": "黑貓"},
+    {"image_id": "d", "image_path": "/photos/home/d.png", "indexed_at": "2026-01-02T00:00:00+08:00"},
+    {"image_path": "relative.jpg", "caption": "沒有 image_id", "album": ["a", 1]},
+]
+
+
+@pytest.fixture
+def segment(tmp_path):
+    vectors = np.random.default_rng(0).standard_normal((len(METAS), 4)).astype(np.float32)
+    index_format.write_segment(str(tmp_path), "seg-000001", vectors, METAS)
+    return index_format.open_segment(str(tmp_path), "seg-000001")
+
+
+def test_rows_round_trip(segment):
+    view = segment.metadata
+    assert isinstance(view, metadata_columns.ColumnarMetadataView)
+    assert len(view) == segment.count == len(METAS)
+    assert list(view) == METAS
+    assert [list(m) for m in view] == [list(m) for m in METAS]  # key 順序不變
+    assert view[-1] == METAS[-1]
+    with pytest.raises(IndexError):
+        view[len(METAS)]
+
+
+@pytest.mark.parametrize("key", ["image_id", "image_path", "caption", "indexed_at", "duplicate_of", "album"])
+def test_column_matches_rows(segment, key):
+    assert segment.metadata.column(key) == [m.get(key) for m in METAS]
+
+
+def test_path_prefix_and_epoch_seconds(segment):
+    view = segment.metadata
+    assert view.path_prefix_rows("/photos/trip/").tolist() == [0, 1]
+    assert view.path_prefix_rows("/photos/home/c").tolist() == [2]
+    assert view.path_prefix_rows("/photos/").tolist() == [0, 1, 2, 3]
+    seconds = view.epoch_seconds()
+    assert seconds[0] == pytest.approx(1767254400.0)
+    assert seconds[1] - seconds[0] == pytest.approx(5400.123456)
+    # 沒有時間或帶時區（存在 extra）的列為 NaN
+    assert np.isnan(seconds[2:]).all()
+
+
+def test_mismatched_count_is_rejected(tmp_path):
+    vectors = np.zeros((2, 4), dtype=np.float32)
+    with pytest.raises(ValueError):
+        index_format.write_segment(str(tmp_path), "seg-000001", vectors, METAS[:1])
+    assert not (tmp_path / "seg-000001").exists()
@@ -0,0 +1,56 @@
+"""近似重複偵測：multi-index hashing 與暴力比對一致，縮圖 / 重新壓縮的副本歸到同一組"""
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from src.near_duplicates import HammingIndex, group_near_duplicates, hamming
+
+
+def test_hamming_index_matches_brute_force():
+    rng = np.random.default_rng(0)
+    base = [int(x) for x in rng.integers(0, 2 ** 63, 200, dtype=np.int64)]
+    index = HammingIndex(max_distance=4)
+    for h in base:
+        index.add(h)
+    queries = []
+    for h in base[:50]:
+        flips = rng.choice(64, size=int(rng.integers(0, 7)), replace=False)
+        queries.append(h ^ sum(1 << int(b) for b in flips))
+    queries += [int(x) for x in rng.integers(0, 2 ** 63, 50, dtype=np.int64)]
+    for q in queries:
+        dists = [hamming(q, h) for h in base]
+        best = min(range(len(base)), key=lambda i: dists[i])
+        expected = (best, dists[best]) if dists[best] <= 4 else None
+        got = index.nearest(q)
+        assert (got and got[1]) == (expected and expected[1])
+
+
+def _photo(seed: int) -> Image.Image:
+    # 平滑的隨機圖樣：縮圖與 JPEG 壓縮後感知雜湊應幾乎不變
+    pixels = np.random.default_rng(seed).integers(0, 256, (12, 16, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).resize((320, 240), Image.BICUBIC).filter(ImageFilter.GaussianBlur(4))
+
+
+@pytest.mark.parametrize("method", ["dhash", "phash"])
+def test_groups_resized_and_recompressed_copies(tmp_path, method):
+    paths = {}
+    for seed in range(3):
+        original = _photo(seed)
+        paths[f"orig{seed}"] = str(tmp_path / f"orig{seed}.png")
+        original.save(paths[f"orig{seed}"])
+        paths[f"small{seed}"] = str(tmp_path / f"small{seed}.jpg")
+        original.resize((160, 120)).save(paths[f"small{seed}"], quality=70)
+    broken = str(tmp_path / "broken.jpg")
+    with open(broken, "wb") as f:
+        f.write(b"not an image")
+    order = [paths["orig0"], paths["orig1"], paths["small0"], broken, paths["orig2"], paths["small2"], paths["small1"]]
+
+    groups = group_near_duplicates(order, method=method, workers=1)
+    # 每組以第一次出現的圖片為代表；無法讀取的圖片自成一組
+    assert groups.representatives == [paths["orig0"], paths["orig1"], broken, paths["orig2"]]
+    assert groups.members == {
+        paths["orig0"]: [paths["small0"]],
+        paths["orig2"]: [paths["small2"]],
+        paths["orig1"]: [paths["small1"]],
+    }
+    assert groups.duplicate_count == 3
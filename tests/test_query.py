@@ -0,0 +1,84 @@
+"""RAGQuery（manual 模式）：批次查詢與逐筆查詢結果一致"""
+import numpy as np
+import pytest
+
+from conftest import FAKE_MODEL
+from src.rag_indexer import RAGIndexer
+from src.rag_query import RAGQuery
+
+COLLECTION = "test_images"
+CAPTIONS = ["海邊的夕陽", "公園裡的小狗", "夜市的人潮", "雪山上的登山客", "桌上的咖啡",
+            "黑貓睡在沙發上", "台北車站大廳", "下雨的街道", "海邊的小狗", "夕陽下的公園"]
+QUERIES = ["夕陽", "小狗在海邊", "咖啡", "車站", "雨天", "黑貓"]
+
+
+@pytest.fixture
+def collection(tmp_path, fake_embedder):
+    chroma_dir = str(tmp_path / "chroma")
+    indexer = RAGIndexer(chroma_dir, COLLECTION, FAKE_MODEL, "manual", embed_batch_size=4)
+    captions = [
+        {"image_id": f"img{i}", "image_path": f"/photos/img{i}.jpg", "caption": c} for i, c in enumerate(CAPTIONS)
+    ]
+    assert indexer.batch_index(captions) == len(captions)
+    return chroma_dir
+
+
+def _results(result):
+    return [(r["image_path"], round(r["score"], 5)) for r in result["results"]]
+
+
+def test_query_many_matches_single_queries(collection):
+    rq = RAGQuery(collection, COLLECTION, FAKE_MODEL, "manual")
+    batch = rq.query_many(QUERIES, top_k=3)
+    assert [q["query"] for q in batch["queries"]] == QUERIES
+    for text, result in zip(QUERIES, batch["queries"]):
+        assert _results(result) == _results(rq.query(text, top_k=3))
+    assert rq.query_many([])["queries"] == []
+
+
+def test_similarity_many_skips_tombstones(collection, fake_embedder):
+    rq = RAGQuery(collection, COLLECTION, FAKE_MODEL, "manual")
+    db = rq.vector_db
+    db.delete(["/photos/img0.jpg", "/photos/img5.jpg"])
+    queries = np.stack([fake_embedder.encode(q) for q in QUERIES])
+    for q, hits in zip(queries, db.similarity_many(queries, top_k=len(CAPTIONS))):
+        assert [m["image_path"] for _, m in hits] == [m["image_path"] for _, m in db.similarity(q, top_k=len(CAPTIONS))]
+        assert len(hits) == len(CAPTIONS) - 2
+        assert not {"/photos/img0.jpg", "/photos/img5.jpg"} & {m["image_path"] for _, m in hits}
+
+
+def test_library_default_is_single_threaded(collection):
+    # 共用行程的呼叫端（Streamlit、server）預設不平行；CLI / app 由 Config.SEARCH_THREADS 開啟
+    assert RAGQuery(collection, COLLECTION, FAKE_MODEL, "manual").vector_db.search_threads == 1
+    assert RAGQuery(collection, COLLECTION, FAKE_MODEL, "manual", search_threads=0).vector_db.search_threads == 0
+
+
+def test_lexical_and_hybrid_modes(collection, fake_embedder):
+    rq = RAGQuery(collection, COLLECTION, FAKE_MODEL, "manual")
+    # lexical 只依 caption 關鍵字，不需 embedding
+    calls = fake_embedder.calls
+    lexical = rq.query("小狗", top_k=5, mode="lexical")["results"]
+    assert fake_embedder.calls == calls
+    assert sorted(r["caption"] for r in lexical) == ["公園裡的小狗", "海邊的小狗"]
+
+    # hybrid：向量與 BM25 的排名以 RRF（1 / (k + rank)）合併
+    text = "海邊的夕陽"
+    vector = [r["image_path"] for r in rq.query(text, top_k=len(CAPTIONS), mode="vector")["results"]]
+    lexical = [r["image_path"] for r in rq.query(text, top_k=len(CAPTIONS), mode="lexical")["results"]]
+    fused = {}
+    for ranking in (vector, lexical):
+        for rank, path in enumerate(ranking, 1):
+            fused[path] = fused.get(path, 0.0) + 1.0 / (rq.rrf_k + rank)
+    hybrid = rq.query(text, top_k=3, mode="hybrid")["results"]
+    assert [r["score"] for r in hybrid] == pytest.approx(sorted(fused.values(), reverse=True)[:3])
+    assert hybrid[0]["image_path"] == "/photos/img0.jpg"
+
+
+def test_query_filters(collection):
+    rq = RAGQuery(collection, COLLECTION, FAKE_MODEL, "manual")
+    hits = rq.query("小狗", top_k=5, mode="lexical", where={"image_id": ["img1", "img3"]})["results"]
+    assert [r["image_path"] for r in hits] == ["/photos/img1.jpg"]
+    hits = rq.query("公園", top_k=10, path_prefix="/photos/img1")["results"]
+    assert sorted(r["image_path"] for r in hits) == ["/photos/img1.jpg"]
+    # indexed_at 範圍：全部在建立 fixture 之後才索引
+    assert rq.query("公園", top_k=10, indexed_before="2000-01-01")["results"] == []
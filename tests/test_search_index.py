@@ -0,0 +1,113 @@
+"""衍生索引：IVF 與量化 codec 的 recall 與持久化，對照精確搜尋"""
+import numpy as np
+import pytest
+
+from src import ann_index, quantization
+from src.rag_indexer import SimpleVectorDB
+
+
+def _clustered(n: int, dim: int = 32, clusters: int = 40, seed: int = 0):
+    """集中在 clusters 個方向附近的向量，近似真實 embedding 的分佈"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    vectors = centers[rng.integers(0, clusters, n)] + 0.35 * rng.standard_normal((n, dim))
+    metas = [{"image_id": f"img{i}", "image_path": f"/photos/img{i}.jpg", "caption": ""} for i in range(n)]
+    return vectors.astype(np.float32), metas
+
+
+def _db(path, vectors, metas, segments: int = 3) -> SimpleVectorDB:
+    db = SimpleVectorDB()
+    for part in np.array_split(np.arange(len(metas)), segments):
+        db.add_many(vectors[part], [metas[i] for i in part])
+        db.save(path)
+    return db
+
+
+def _recall(db: SimpleVectorDB, vectors, queries, top_k: int = 10, **search) -> float:
+    """db 目前搜尋設定的 top_k 與暴力 cosine 排序的重疊比例"""
+    unit = SimpleVectorDB._normalize(vectors)
+    hits = 0
+    for q in queries:
+        truth = {f"/photos/img{i}.jpg" for i in np.argsort(-(unit @ q))[:top_k]}
+        hits += len(truth & {m["image_path"] for _, m in db.similarity(q, top_k=top_k, **search)})
+    return hits / (top_k * len(queries))
+
+
+def test_ivf_recall_and_persistence(tmp_path):
+    path = str(tmp_path / "db")
+    vectors, metas = _clustered(3000)
+    db = _db(path, vectors, metas)
+    db.update_ann()
+    assert db.ann is not None and len(db.ann) == db.count()
+    db.search_engine = "ivf"
+    queries = _clustered(20, seed=1)[0]
+
+    # 掃描全部分群時與精確搜尋相同；預設 nprobe 在分群資料上 recall 仍高
+    assert _recall(db, vectors, queries, nprobe=db.ann.nlist) == 1.0
+    assert _recall(db, vectors, queries) >= 0.9
+
+    reopened = SimpleVectorDB.load(path)
+    reopened.search_engine = "ivf"
+    assert reopened.ann.nlist == db.ann.nlist
+    np.testing.assert_array_equal(reopened.ann.assign, db.ann.assign)
+    # 新增的列於 add_many 時即歸入分群，不需重新訓練
+    extra, extra_metas = _clustered(50, seed=2)
+    for i, m in enumerate(extra_metas):
+        m["image_path"] = f"/photos/extra{i}.jpg"
+    reopened.add_many(extra, extra_metas)
+    assert len(reopened.ann) == reopened.count()
+    top = reopened.similarity(extra[0], top_k=1, nprobe=reopened.ann.nlist)
+    assert top[0][1]["image_path"] == "/photos/extra0.jpg"
+
+
+def test_ivf_not_trained_on_small_collections(tmp_path):
+    vectors, metas = _clustered(ann_index.MIN_TRAIN_ROWS - 1)
+    db = _db(str(tmp_path / "db"), vectors, metas, segments=1)
+    db.update_ann()
+    assert db.ann is None
+    # 沒有 IVF 時 search_engine="ivf" 退回精確搜尋
+    db.search_engine = "ivf"
+    assert _recall(db, vectors, vectors[:5]) == 1.0
+
+
+@pytest.mark.parametrize("kind, min_recall", [("sq8", 0.95), ("pq", 0.4)])
+def test_quantizer_recall_against_exact(tmp_path, kind, min_recall):
+    path = str(tmp_path / "db")
+    vectors, metas = _clustered(3000)
+    db = _db(path, vectors, metas)
+    db.update_quantizer(kind, pq_m=8)
+    assert db.quantizer.kind == kind and len(db.quantizer) == db.count()
+    db.use_quantizer = True
+    queries = _clustered(20, seed=1)[0]
+
+    # 只以 ADC 分數排序時 recall 受量化誤差影響；rescore 後與精確搜尋一致
+    db.rescore_k = 0
+    adc = _recall(db, vectors, queries)
+    assert adc >= min_recall
+    db.rescore_k = 200
+    assert _recall(db, vectors, queries) >= max(adc, 0.99)
+
+    # 量化碼隨 segment 持久化，重新開啟後分數相同
+    reopened = SimpleVectorDB.load(path)
+    np.testing.assert_array_equal(reopened.quantizer.row_data, db.quantizer.row_data)
+    q = SimpleVectorDB._normalize(queries[0])
+    np.testing.assert_allclose(reopened.quantizer.score(q), db.quantizer.score(q), rtol=1e-6)
+
+
+def test_sq8_scores_match_decoded_vectors():
+    vectors = SimpleVectorDB._normalize(_clustered(quantization.SQ8_MIN_TRAIN_ROWS)[0])
+    sq8 = quantization.train_quantizer("sq8", vectors)
+    sq8.extend(sq8.encode(vectors))
+    q = vectors[0]
+    rows = np.array([0, 5, 999])
+    np.testing.assert_allclose(sq8.score(q), sq8.decode(sq8.row_data) @ q, atol=1e-4)
+    np.testing.assert_allclose(sq8.score(q, rows), sq8.decode(sq8.row_data[rows]) @ q, atol=1e-4)
+    # 逐維量化誤差不超過半個量化間隔
+    assert np.all(np.abs(sq8.decode(sq8.row_data) - vectors) <= sq8.scale / 2 + 1e-6)
+
+
+def test_quantizer_waits_for_min_train_rows(tmp_path):
+    vectors, metas = _clustered(quantization.SQ8_MIN_TRAIN_ROWS - 1)
+    db = _db(str(tmp_path / "db"), vectors, metas, segments=1)
+    db.update_quantizer("sq8")
+    assert db.quantizer is None
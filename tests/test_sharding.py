@@ -0,0 +1,134 @@
+"""分片索引：穩定分配、shard 合併、衝突偵測，以及 replace 合併失敗時不動原本的 collection"""
+import os
+
+import pytest
+
+from conftest import FAKE_MODEL
+from src import sharding
+from src.file_manifest import FileManifest
+from src.rag_indexer import RAGIndexer, SimpleVectorDB
+from src.sharding import (
+    ShardConflictError, find_shards, merge_shards, parse_shard, select_shard, shard_collection, shard_of,
+)
+
+COLLECTION = "test_images"
+
+
+def _index(chroma_dir: str, collection: str, paths, tag: str = ""):
+    """以假 embedder 索引 paths（caption 由檔名產生），並登記檔案清單"""
+    indexer = RAGIndexer(chroma_dir, collection, FAKE_MODEL, "manual")
+    indexer.batch_index([
+        {"image_id": os.path.splitext(os.path.basename(p))[0], "image_path": p, "caption": f"{tag}圖片 {os.path.basename(p)}"}
+        for p in paths
+    ])
+    manifest = FileManifest.open(chroma_dir, collection)
+    manifest.record(paths, {})
+    manifest.close()
+
+
+def _contents(chroma_dir: str, collection: str = COLLECTION):
+    db = SimpleVectorDB.open(chroma_dir, collection)
+    return {m["image_path"]: m["caption"] for m in db.live_metadata()}
+
+
+def _manifest_paths(chroma_dir: str, collection: str = COLLECTION):
+    return sorted(FileManifest.open(chroma_dir, collection).entries())
+
+
+def _shards(chroma_dir: str, image_paths, n: int = 3):
+    root = os.path.dirname(image_paths[0])
+    for i in range(n):
+        _index(chroma_dir, shard_collection(COLLECTION, i, n), select_shard(image_paths, i, n, root))
+    return find_shards(chroma_dir, COLLECTION, n)
+
+
+def test_shard_assignment_is_stable_partition(image_paths):
+    root = os.path.dirname(image_paths[0])
+    parts = [select_shard(image_paths, i, 3, root) for i in range(3)]
+    assert sorted(p for part in parts for p in part) == sorted(image_paths)
+    # 只依相對路徑決定：換一個根目錄、打亂順序結果相同
+    moved = [os.path.join("/elsewhere", os.path.basename(p)) for p in image_paths]
+    assert [shard_of(p, 3, "/elsewhere") for p in moved] == [shard_of(p, 3, root) for p in image_paths]
+    assert select_shard(list(reversed(image_paths)), 1, 3, root) == list(reversed(parts[1]))
+    assert parse_shard("2/4") == (2, 4)
+    for bad in ("4/4", "1-4", "0/0"):
+        with pytest.raises(ValueError):
+            parse_shard(bad)
+
+
+def test_merge_replace_rebuilds_collection(tmp_path, image_paths, fake_embedder):
+    chroma_dir = str(tmp_path / "chroma")
+    _index(chroma_dir, COLLECTION, image_paths[:3], tag="舊")
+    sources = _shards(chroma_dir, image_paths[2:])
+
+    report = merge_shards(sources, chroma_dir, COLLECTION, replace=True)
+    assert report.merged == len(image_paths) - 2 and not report.conflicts
+    # 重建：只剩 shard 的內容，已不在 shard 中的舊圖片被移除
+    contents = _contents(chroma_dir)
+    assert sorted(contents) == sorted(image_paths[2:])
+    assert not any(c.startswith("舊") for c in contents.values())
+    assert _manifest_paths(chroma_dir) == sorted(image_paths[2:])
+    assert not os.path.exists(os.path.join(chroma_dir, f"{COLLECTION}.merging_vectors"))
+
+
+def test_merge_append_keeps_newer(tmp_path, image_paths, fake_embedder):
+    chroma_dir = str(tmp_path / "chroma")
+    _index(chroma_dir, COLLECTION, image_paths[:4], tag="舊")
+    sources = _shards(chroma_dir, image_paths[2:6])
+    report = merge_shards(sources, chroma_dir, COLLECTION)
+    # 與既有資料路徑相同的是重新索引的結果，不是衝突
+    assert report.duplicates == 2 and not report.conflicts
+    contents = _contents(chroma_dir)
+    assert sorted(contents) == sorted(image_paths[:6])
+    assert [contents[p].startswith("舊") for p in image_paths[:6]] == [True, True, False, False, False, False]
+
+
+def test_path_in_two_shards_is_a_conflict(tmp_path, image_paths, fake_embedder):
+    chroma_dir = str(tmp_path / "chroma")
+    _index(chroma_dir, COLLECTION, image_paths[:2], tag="舊")
+    # 混入先前以不同 N 分片留下的舊 shard：與本次的 shard 有相同路徑
+    stale = shard_collection(COLLECTION, 0, 2)
+    _index(chroma_dir, stale, image_paths[:5], tag="stale")
+    sources = [os.path.join(chroma_dir, f"{stale}_vectors")] + _shards(chroma_dir, image_paths)
+
+    with pytest.raises(ShardConflictError) as err:
+        merge_shards(sources, chroma_dir, COLLECTION, replace=True)
+    assert sorted(p for p, _, _ in err.value.conflicts) == sorted(os.path.abspath(p) for p in image_paths[:5])
+    # 沒有寫入任何資料
+    assert sorted(_contents(chroma_dir)) == sorted(image_paths[:2])
+
+    report = merge_shards(sources, chroma_dir, COLLECTION, on_conflict="keep_newer", replace=True)
+    assert len(report.conflicts) == 5
+    contents = _contents(chroma_dir)
+    assert sorted(contents) == sorted(image_paths)
+    assert not any(c.startswith("stale") for c in contents.values())
+
+
+def test_failed_replace_leaves_collection_intact(tmp_path, image_paths, fake_embedder, monkeypatch):
+    chroma_dir = str(tmp_path / "chroma")
+    _index(chroma_dir, COLLECTION, image_paths[:3], tag="舊")
+    sources = _shards(chroma_dir, image_paths[3:])
+    before = _contents(chroma_dir)
+
+    calls = []
+    original_save = SimpleVectorDB.save
+
+    def failing_save(self, path):
+        calls.append(path)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        return original_save(self, path)
+
+    monkeypatch.setattr(SimpleVectorDB, "save", failing_save)
+    with pytest.raises(OSError, match="disk full"):
+        merge_shards(sources, chroma_dir, COLLECTION, replace=True)
+    monkeypatch.setattr(SimpleVectorDB, "save", original_save)
+
+    # 寫入的是暫存 collection，失敗後清除；原本的向量庫與檔案清單都還在
+    assert calls and all(".merging" in p for p in calls)
+    assert _contents(chroma_dir) == before
+    assert _manifest_paths(chroma_dir) == sorted(image_paths[:3])
+    assert not os.path.exists(os.path.join(chroma_dir, f"{sharding._staging_collection(COLLECTION)}_vectors"))
+
+    merge_shards(sources, chroma_dir, COLLECTION, replace=True)
+    assert sorted(_contents(chroma_dir)) == sorted(image_paths[3:])
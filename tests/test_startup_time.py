@@ -0,0 +1,56 @@
+"""CLI 入口的冷啟動檢查：入口不在匯入時載入重量級依賴，超出預算或載入失敗時 exit code 為 1"""
+import json
+
+import pytest
+
+from scripts import check_startup_time
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:      3400 |       3400 |     numpy.core._multiarray_umath
+import time:        80 |       3480 |   numpy
+import time:     15000 |      15000 | src.rag_indexer
+"""
+
+
+def test_slowest_imports_parses_importtime():
+    assert check_startup_time._slowest_imports(IMPORTTIME, n=2) == [
+        ("src.rag_indexer", 15.0), ("numpy.core._multiarray_umath", 3.4)]
+    assert check_startup_time._slowest_imports("some warning\n") == []
+
+
+@pytest.mark.parametrize("entry", check_startup_time.ENTRY_POINTS)
+def test_entry_points_import_no_heavy_modules(entry):
+    result = check_startup_time.measure(entry, repeat=1)
+    assert "error" not in result, result.get("error")
+    assert result["heavy_modules"] == []
+    assert result["median_ms"] > 0
+    assert result["slowest_imports"]
+
+
+def test_heavy_import_is_reported(tmp_path):
+    entry = tmp_path / "eager.py"
+    entry.write_text("from PIL import Image\n", encoding="utf-8")
+    assert check_startup_time.measure(str(entry), repeat=1)["heavy_modules"] == ["PIL"]
+
+    broken = tmp_path / "broken.py"
+    broken.write_text("import no_such_module_for_startup_test\n", encoding="utf-8")
+    assert "no_such_module_for_startup_test" in check_startup_time.measure(str(broken), repeat=1)["error"]
+
+
+def test_main_fails_over_budget(tmp_path, monkeypatch):
+    output = tmp_path / "startup.json"
+    entry = "scripts/compact_index.py"
+    monkeypatch.setattr("sys.argv", ["check_startup_time.py", entry, "--repeat", "1",
+                                     "--budget_ms", "0.001", "--output", str(output)])
+    with pytest.raises(SystemExit) as exc:
+        check_startup_time.main()
+    assert exc.value.code == 1
+    report = json.loads(output.read_text(encoding="utf-8"))
+    assert report["budget_ms"] == 0.001
+    assert [r["entry"] for r in report["results"]] == [entry]
+
+    monkeypatch.setattr("sys.argv", ["check_startup_time.py", entry, "--repeat", "1",
+                                     "--budget_ms", "60000", "--output", str(output)])
+    check_startup_time.main()  # 不超出預算時正常結束
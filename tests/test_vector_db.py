@@ -0,0 +1,244 @@
+"""SimpleVectorDB：儲存、持久化、刪除與各種查詢路徑的結果與暴力計算一致"""
+import math
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from src import lexical_index
+from src.metadata_index import MetadataFilter
+from src.rag_indexer import SimpleVectorDB
+
+WORDS = ["台北車站", "海邊", "夕陽", "黑貓", "小狗", "公園", "夜市", "cat", "雪山", "咖啡"]
+T0 = datetime(2026, 1, 1)
+
+
+def _random_rows(rng, start: int, n: int, dim: int = 16):
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    metas = [{"image_id": f"img{i}", "image_path": f"/photos/img{i}.jpg", "caption": f"caption {i}"}
+             for i in range(start, start + n)]
+    return vectors, metas
+
+
+def _rows(rng, start: int, n: int, dim: int = 16):
+    """帶 caption、時間與相簿欄位的列，供過濾與 BM25 測試使用"""
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    metas = []
+    for i in range(start, start + n):
+        words = rng.choice(WORDS, size=int(rng.integers(1, 5)))
+        metas.append({
+            "image_id": f"img{i}",
+            "image_path": f"/photos/{'trip' if i % 3 else 'home'}/img{i}.jpg",
+            "caption": "，".join(words),
+            "indexed_at": (T0 + timedelta(hours=i)).isoformat(),
+            "album": f"a{i % 4}",
+        })
+    return vectors, metas
+
+
+def _build(path, batches=(40, 30, 25), tail: int = 15, seed: int = 0):
+    """每批存成一個 segment，最後一批留在 tail；回傳 (db, 全部向量, 全部 metadata)"""
+    rng = np.random.default_rng(seed)
+    db = SimpleVectorDB()
+    db.lexical = True
+    all_vecs, all_metas = [], []
+    for n in batches:
+        vecs, metas = _rows(rng, len(all_metas), n)
+        db.add_many(vecs, metas)
+        db.save(path)
+        all_vecs.append(vecs)
+        all_metas.extend(metas)
+    vecs, metas = _rows(rng, len(all_metas), tail)
+    db.add_many(vecs, metas)
+    all_vecs.append(vecs)
+    all_metas.extend(metas)
+    return db, np.concatenate(all_vecs), all_metas
+
+
+def _brute_force(vectors, metas, query, top_k, keep=lambda m: True):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    q = query / np.linalg.norm(query)
+    scored = [(float(unit[i] @ q), metas[i]["image_path"]) for i in range(len(metas)) if keep(metas[i])]
+    return sorted(scored, key=lambda s: -s[0])[:top_k]
+
+
+def _paths(results):
+    return [meta["image_path"] for _, meta in results]
+
+
+def test_growable_matrix_top_k_matches_brute_force():
+    rng = np.random.default_rng(0)
+    db = SimpleVectorDB()
+    all_vecs, all_metas = [], []
+    # 分多次加入、總數超過初始容量，迫使 tail 成長
+    for n in (700, 1, 600, 300):
+        vecs, metas = _random_rows(rng, len(all_metas), n)
+        db.add_many(vecs, metas)
+        all_vecs.append(vecs)
+        all_metas.extend(metas)
+    vectors = np.concatenate(all_vecs)
+    assert db.count() == len(all_metas)
+    np.testing.assert_allclose(np.linalg.norm(db.vectors, axis=1), 1.0, rtol=1e-5)
+
+    for _ in range(5):
+        query = rng.standard_normal(16)
+        expected = _brute_force(vectors, all_metas, query, 10)
+        got = db.similarity(query, top_k=10)
+        assert _paths(got) == [p for _, p in expected]
+        np.testing.assert_allclose([s for s, _ in got], [s for s, _ in expected], rtol=1e-5)
+    # top_k=None 回傳全部列，分數遞減
+    scores = [s for s, _ in db.similarity(rng.standard_normal(16))]
+    assert len(scores) == len(all_metas) and scores == sorted(scores, reverse=True)
+
+
+def test_segments_survive_save_and_reopen(tmp_path):
+    path = str(tmp_path / "db")
+    db, vectors, metas = _build(path)
+    db.save(path)
+    assert db.segment_count() == 4
+
+    reopened = SimpleVectorDB.load(path)
+    assert reopened.segment_count() == 4
+    assert reopened.count() == len(metas)
+    assert list(reopened.live_metadata()) == metas
+    np.testing.assert_allclose(reopened.vectors, SimpleVectorDB._normalize(vectors), rtol=1e-6)
+
+    query = np.random.default_rng(1).standard_normal(16)
+    expected = [p for _, p in _brute_force(vectors, metas, query, 10)]
+    assert _paths(reopened.similarity(query, top_k=10)) == expected
+    assert _paths(db.similarity(query, top_k=10)) == expected
+
+
+def test_delete_and_compact(tmp_path):
+    path = str(tmp_path / "db")
+    db, vectors, metas = _build(path)
+    db.save(path)
+    deleted = {m["image_path"] for m in metas[::5]}
+    assert db.delete(deleted) == len(deleted)
+    assert db.delete(deleted) == 0
+    survivors = [m for m in metas if m["image_path"] not in deleted]
+    query = np.random.default_rng(2).standard_normal(16)
+    expected = [p for _, p in _brute_force(vectors, metas, query, 10, lambda m: m["image_path"] not in deleted)]
+
+    # tombstone 已落盤：重新開啟後仍排除
+    reopened = SimpleVectorDB.load(path)
+    assert reopened.live_count() == len(survivors)
+    assert _paths(reopened.similarity(query, top_k=10)) == expected
+
+    assert reopened.compact(full=True) == 3
+    assert reopened.segment_count() == 1
+    assert _paths(reopened.similarity(query, top_k=10)) == expected
+
+    assert reopened.purge() == len(deleted)
+    assert reopened.count() == reopened.live_count() == len(survivors)
+    purged = SimpleVectorDB.load(path)
+    assert list(purged.live_metadata()) == survivors
+    assert _paths(purged.similarity(query, top_k=10)) == expected
+
+
+def test_upsert_keys_on_path_not_stem(tmp_path):
+    db = SimpleVectorDB()
+    vecs = np.eye(3, dtype=np.float32)
+    db.add_many(vecs[:2], [
+        {"image_id": "x", "image_path": "/photos/x.jpg", "caption": "jpg"},
+        {"image_id": "x", "image_path": "/photos/x.png", "caption": "png"},
+    ])
+    assert db.live_count() == 2
+    db.add_many(vecs[2:], [{"image_id": "x", "image_path": "/photos/x.jpg", "caption": "jpg v2"}])
+    assert sorted(m["caption"] for m in db.live_metadata()) == ["jpg v2", "png"]
+    assert db.delete(["/photos/x.png"]) == 1
+    assert [m["caption"] for m in db.live_metadata()] == ["jpg v2"]
+
+
+def _bm25_brute_force(captions, query, k1=lexical_index.DEFAULT_K1, b=lexical_index.DEFAULT_B):
+    docs = [Counter(lexical_index.tokenize(c)) for c in captions]
+    lengths = [sum(d.values()) for d in docs]
+    avgdl = max(sum(lengths) / len(docs), 1.0)
+    scores = {}
+    for term, qtf in Counter(lexical_index.tokenize(query)).items():
+        df = sum(term in d for d in docs)
+        if not df:
+            continue
+        idf = math.log(1.0 + (len(docs) - df + 0.5) / (df + 0.5))
+        for row, d in enumerate(docs):
+            tf = d.get(term, 0)
+            if tf:
+                norm = k1 * (1.0 - b + b * lengths[row] / avgdl)
+                scores[row] = scores.get(row, 0.0) + qtf * idf * tf * (k1 + 1.0) / (tf + norm)
+    return scores
+
+
+@pytest.mark.parametrize("query", ["台北車站", "黑貓 夕陽", "cat", "車站夜市", "不存在的詞"])
+def test_bm25_matches_brute_force(tmp_path, query):
+    path = str(tmp_path / "db")
+    db, _, metas = _build(path)
+    expected = _bm25_brute_force([m["caption"] for m in metas], query)
+
+    rows, scores = db.lexical_search(query)
+    assert sorted(rows.tolist()) == sorted(expected)
+    np.testing.assert_allclose(scores, [expected[r] for r in rows.tolist()], rtol=1e-5)
+    assert list(scores) == sorted(scores, reverse=True)
+
+    # 重新開啟後由各 segment 的倒排表查詢，結果相同
+    db.save(path)
+    rows2, scores2 = SimpleVectorDB.load(path).lexical_search(query, top_k=5)
+    # 同分的列順序不固定，只比較分數
+    np.testing.assert_allclose(scores2, scores[:5], rtol=1e-6)
+    np.testing.assert_allclose(scores2, [expected[r] for r in rows2.tolist()], rtol=1e-5)
+
+
+@pytest.mark.parametrize("flt, keep", [
+    (MetadataFilter(path_prefix="/photos/home/"), lambda m: m["image_path"].startswith("/photos/home/")),
+    (MetadataFilter(indexed_after=T0 + timedelta(hours=20), indexed_before=T0 + timedelta(hours=70)),
+     lambda m: T0 + timedelta(hours=20) <= datetime.fromisoformat(m["indexed_at"]) < T0 + timedelta(hours=70)),
+    (MetadataFilter(where={"album": ["a1", "a3"]}), lambda m: m["album"] in ("a1", "a3")),
+    (MetadataFilter(path_prefix="/photos/trip/", where={"album": "a2"}),
+     lambda m: m["image_path"].startswith("/photos/trip/") and m["album"] == "a2"),
+])
+def test_filtered_search_matches_brute_force(tmp_path, flt, keep):
+    path = str(tmp_path / "db")
+    db, vectors, metas = _build(path)
+    deleted = {m["image_path"] for m in metas[3::7]}
+    db.delete(deleted)
+    alive = lambda m: m["image_path"] not in deleted and keep(m)  # noqa: E731
+    rng = np.random.default_rng(3)
+    for _ in range(5):
+        query = rng.standard_normal(16)
+        expected = _brute_force(vectors, metas, query, 8, alive)
+        got = db.similarity(query, top_k=8, filter=flt)
+        assert _paths(got) == [p for _, p in expected]
+        np.testing.assert_allclose([s for s, _ in got], [s for s, _ in expected], rtol=1e-5)
+    assert sorted(db.filter_rows(flt).tolist()) == [i for i, m in enumerate(metas) if alive(m)]
+
+
+def test_lexical_search_respects_filter(tmp_path):
+    db, _, metas = _build(str(tmp_path / "db"))
+    home = MetadataFilter(path_prefix="/photos/home/")
+    for query in ["台北車站", "黑貓 夕陽"]:
+        expected = _bm25_brute_force([m["caption"] for m in metas], query)
+        rows, _ = db.lexical_search(query, filter=home)
+        assert sorted(rows.tolist()) == sorted(r for r in expected if metas[r]["image_path"].startswith("/photos/home/"))
+
+
+
+def test_parallel_scan_matches_single_thread(tmp_path, monkeypatch):
+    # chunk 縮小到 256 列，少量資料即可走平行路徑
+    monkeypatch.setattr(SimpleVectorDB, "_SEARCH_CHUNK_BYTES", 256 * 4 * 16)
+    db, vectors, metas = _build(str(tmp_path / "db"), batches=(700, 500, 300), tail=200)
+    deleted = {m["image_path"] for m in metas[::11]}
+    db.delete(deleted)
+    queries = np.random.default_rng(4).standard_normal((6, 16))
+
+    calls = []
+    parallel = db._parallel_top_k
+    monkeypatch.setattr(db, "_parallel_top_k", lambda *a: calls.append(a) or parallel(*a))
+    for threads in (1, 4):
+        db.search_threads = threads
+        single = [db.similarity(q, top_k=10) for q in queries]
+        batch = db.similarity_many(queries, top_k=10)
+        for q, got, got_many in zip(queries, single, batch):
+            expected = _brute_force(vectors, metas, q, 10, lambda m: m["image_path"] not in deleted)
+            assert _paths(got) == _paths(got_many) == [p for _, p in expected]
+            np.testing.assert_allclose([s for s, _ in got], [s for s, _ in expected], rtol=1e-5)
+        assert bool(calls) == (threads > 1)